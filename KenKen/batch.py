@@ -0,0 +1,273 @@
+'''Batch solving of KenKen puzzles.
+
+Run as
+
+    python batch.py [input.jsonl] [-o output.jsonl] [--workers N]
+                    [--prop prop_GAC3] [--var-ord ord_mrv] [--val-ord val_lcv_support]
+                    [--time-limit SECONDS] [--unordered]
+
+Each input line (from input.jsonl, or stdin if it is omitted or '-') is a
+puzzle in the kenken_grid format used by kenken_csp_model, either on its
+own or as {"id": ..., "grid": kenken_grid}. Each output line is a JSON
+object with the id (or input line number) of the puzzle, its status
+('solved', 'unsat', 'limit' or 'error'), the solution as a list of rows,
+and the timing and search statistics. Output lines come in input order
+unless --unordered is given.
+
+Puzzles are solved on a pool of worker processes. Every worker keeps one
+GridModel per board size, so the variables and the row and column
+constraints of a size are built once per worker; for each puzzle only
+its cage constraints are built and swapped in. If a worker process dies
+while solving a puzzle (killed, out of memory, crashed), that puzzle gets
+an 'error' line and the rest of the batch goes on.
+'''
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+import os
+import sys
+import time
+import json
+import argparse
+import multiprocessing
+import propagators
+import heuristics
+
+#Default configuration of the batch solver (the keys are those of the
+#configurations of parallel.py, except seed and restarts)
+BATCH_CONFIG = dict(prop=prop_GAC3, var_ord=ord_mrv, val_ord=val_lcv_support,
+                    var_type=BitVariable, alldiff='gac', cages='arith')
+
+#GridModels of this process, by board size
+BATCH_MODELS = dict()
+#Configuration and time limit of this process, and the queue it reports
+#the puzzles it starts on (or None), set by batch_init
+BATCH_WORKER = dict(config=BATCH_CONFIG, time_limit=None, started=None)
+#Seconds between checks for worker processes that died
+BATCH_POLL = 0.1
+
+def batch_init(config, time_limit=None, started=None):
+    '''Initializer of a batch worker process'''
+    BATCH_MODELS.clear()
+    BATCH_WORKER['config'] = config
+    BATCH_WORKER['time_limit'] = time_limit
+    BATCH_WORKER['started'] = started
+
+def grid_model(size, config):
+    '''Return the GridModel of this process for board size, building it
+       on first use'''
+    model = BATCH_MODELS.get(size)
+    if model is None:
+        model = GridModel(size, config.get('var_type', Variable), config.get('alldiff'))
+        BATCH_MODELS[size] = model
+    return model
+
+def parse_puzzle(line):
+    '''Return (id, kenken_grid) of an input line, raising ValueError if it
+       is not a puzzle: every cell of a cage must be on the board and its
+       operation 0 to 3'''
+    item = json.loads(line)
+    puzzle_id = None
+    if isinstance(item, dict):
+        puzzle_id = item.get('id')
+        item = item.get('grid')
+    if (not isinstance(item, list) or not item or not isinstance(item[0], list)
+            or len(item[0]) != 1 or not isinstance(item[0][0], int)
+            or not 1 <= item[0][0] <= 9):
+        raise ValueError("expected a kenken_grid starting with [size], size 1 to 9")
+    size = item[0][0]
+    for cage in item[1:]:
+        if (not isinstance(cage, list) or len(cage) < 2
+                or not all(isinstance(x, int) for x in cage)):
+            raise ValueError("bad cage {}".format(json.dumps(cage)))
+        #[cell, target] or [cell, ..., target, op]
+        cells = cage[:1] if len(cage) == 2 else cage[:-2]
+        for cell in cells:
+            if not (1 <= cell // 10 <= size and 1 <= cell % 10 <= size):
+                raise ValueError("bad cage {}: cell {} is not on a {}x{} board".format(
+                    json.dumps(cage), cell, size, size))
+        if len(cage) > 2 and not 0 <= cage[-1] <= 3:
+            raise ValueError("bad cage {}: operation {} is not 0 to 3".format(
+                json.dumps(cage), cage[-1]))
+    return puzzle_id, item
+
+def solve_puzzle(task):
+    '''Solve the puzzle of an input line in this process. task is (line
+       number, line); returns the output line (without a newline).'''
+    lineno, line = task
+    if BATCH_WORKER['started'] is not None:
+        BATCH_WORKER['started'].put((lineno, os.getpid()))
+    config = BATCH_WORKER['config']
+    result = dict(id=lineno)
+    try:
+        puzzle_id, kenken_grid = parse_puzzle(line)
+        if puzzle_id is not None:
+            result['id'] = puzzle_id
+        size = kenken_grid[0][0]
+        result['size'] = size
+
+        stime = time.perf_counter()
+        csp, board = grid_model(size, config).set_puzzle(kenken_grid,
+                                                         config.get('cages', 'table'))
+        result['build'] = round(time.perf_counter() - stime, 6)
+
+        solver = BT(csp)
+        outcome = solver.solve(config['prop'], config.get('var_ord'), config.get('val_ord'),
+                               time_limit=BATCH_WORKER['time_limit'])
+        result['status'] = outcome.status
+        if outcome.status == 'solved':
+            result['solution'] = [[var.get_assigned_value() for var in row] for row in board]
+        result['solve'] = round(outcome.elapsed, 6)
+        result['decisions'] = outcome.nDecisions
+        result['nodes'] = outcome.nNodes
+        result['prunings'] = outcome.nPrunings
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    return json.dumps(result)
+
+def lost_puzzle(task, pid):
+    '''The output line of the puzzle of task (as for solve_puzzle) when
+       worker process pid died before returning it'''
+    lineno, line = task
+    result = dict(id=lineno)
+    try:
+        puzzle_id, kenken_grid = parse_puzzle(line)
+        if puzzle_id is not None:
+            result['id'] = puzzle_id
+    except ValueError:
+        pass
+    result['status'] = 'error'
+    result['error'] = "worker process {} died without a result".format(pid)
+    return json.dumps(result)
+
+def solve_batch(lines, out, config=BATCH_CONFIG, workers=None, time_limit=None,
+                ordered=True):
+    '''Solve the puzzles of the JSONL lines (an iterable of strings, such
+       as an open file) and write one output line for each to out as soon
+       as it is known, in input order if ordered is True. Blank lines are
+       skipped. With workers 1 the puzzles are solved in this process,
+       otherwise on a pool of workers processes (one per CPU by default).
+       Returns the number of puzzles.
+
+       Every worker reports the puzzles it starts, and every BATCH_POLL
+       seconds the workers solving puzzles are checked. If one has died
+       its puzzle is written as an 'error' (the pool starts a new worker
+       in its place). At most two puzzles per worker are handed to the
+       pool ahead of the output, so lines are read as they are needed.'''
+
+    tasks = ((lineno, line) for lineno, line in enumerate(lines, 1) if line.strip())
+    n = 0
+    if workers == 1:
+        batch_init(config, time_limit)
+        for task in tasks:
+            out.write(solve_puzzle(task) + "\n")
+            out.flush()
+            n += 1
+        return n
+
+    ctx = multiprocessing.get_context()
+    started = ctx.SimpleQueue()
+    window = 2 * (workers or os.cpu_count() or 1)
+    with ctx.Pool(workers, batch_init, (config, time_limit, started)) as pool:
+        #line number -> [task, AsyncResult, output line or None], in input order
+        pending = dict()
+        #line number -> pid of the worker that started it
+        running = dict()
+        more = True
+        while more or pending:
+            while more and len(pending) < window:
+                task = next(tasks, None)
+                if task is None:
+                    more = False
+                else:
+                    pending[task[0]] = [task, pool.apply_async(solve_puzzle, (task,)), None]
+            if not pending:
+                break
+
+            for item in pending.values():
+                if item[2] is None and item[1].ready():
+                    item[2] = item[1].get()
+            written = n
+            for lineno in list(pending):
+                line = pending[lineno][2]
+                if line is None:
+                    if ordered:
+                        break
+                    continue
+                del pending[lineno]
+                running.pop(lineno, None)
+                out.write(line + "\n")
+                out.flush()
+                n += 1
+            if n > written:
+                continue
+
+            #wait for the first puzzle still to be solved, then look for
+            #workers that died solving theirs
+            waiting = [item for item in pending.values() if item[2] is None]
+            waiting[0][1].wait(BATCH_POLL)
+            while not started.empty():
+                lineno, pid = started.get()
+                if lineno in pending:
+                    running[lineno] = pid
+            alive = set(p.pid for p in multiprocessing.active_children())
+            for lineno, item in pending.items():
+                pid = running.get(lineno)
+                if item[2] is None and pid is not None and pid not in alive \
+                        and not item[1].ready():
+                    print("ERROR batch worker {} died solving line {}".format(pid, lineno),
+                          file=sys.stderr)
+                    item[2] = lost_puzzle(item[0], pid)
+    return n
+
+def lookup(module, name):
+    '''Return the function called name in module (or None for 'none')'''
+    if name.lower() == 'none':
+        return None
+    fn = getattr(module, name, None)
+    if not callable(fn):
+        raise argparse.ArgumentTypeError("unknown function {}".format(name))
+    return fn
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve KenKen puzzles from a JSONL file.")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSONL file of puzzles ('-' or omitted for stdin)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="JSONL file for the results ('-' or omitted for stdout)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--prop', default=BATCH_CONFIG['prop'].__name__)
+    parser.add_argument('--var-ord', default=BATCH_CONFIG['var_ord'].__name__)
+    parser.add_argument('--val-ord', default=BATCH_CONFIG['val_ord'].__name__)
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help="give up on a puzzle after this many seconds of search")
+    parser.add_argument('--unordered', action='store_true',
+                        help="write results as they finish rather than in input order")
+    args = parser.parse_args(argv)
+
+    try:
+        config = dict(BATCH_CONFIG, prop=lookup(propagators, args.prop),
+                      var_ord=lookup(heuristics, args.var_ord),
+                      val_ord=lookup(heuristics, args.val_ord))
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if config['prop'] is None:
+        parser.error("a propagator is required")
+
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        solve_batch(infile, outfile, config, args.workers, args.time_limit,
+                    not args.unordered)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,674 @@
+'''Micro-benchmarks for the CSP routines.
+
+Run as
+
+    python benchmarks.py [name ...]
+
+to run the named benchmarks (all of them if no name is given). Each
+benchmark prints a small table of timings; nothing here is needed by the
+solver itself.
+'''
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from parallel import *
+import os
+import sys
+import time
+import io
+import itertools
+import contextlib
+import resource
+import shutil
+import tempfile
+import tracemalloc
+import threading
+import random
+import multiprocessing
+
+#Sample boards in the kenken_grid format used by kenken_csp_model
+BOARDS = {
+    4: [[4], [11, 12, 7, 0], [13, 14, 23, 8, 3], [21, 22, 31, 32, 7, 0],
+        [24, 34, 44, 12, 3], [33, 43, 5, 0], [41, 42, 8, 3]],
+    5: [[5], [11, 12, 13, 6, 0], [14, 15, 1, 1], [21, 31, 8, 3],
+        [22, 23, 24, 20, 3], [25, 35, 45, 6, 3], [32, 42, 3, 1],
+        [33, 34, 15, 3], [41, 51, 52, 45, 3], [43, 53, 44, 8, 0],
+        [54, 55, 2, 1]],
+    6: [[6], [11, 21, 22, 31, 15, 0], [12, 13, 1, 1], [14, 24, 15, 25, 14, 0],
+        [16, 26, 24, 3], [23, 33, 43, 13, 0], [32, 42, 41, 25, 3],
+        [34, 44, 35, 12, 0], [36, 46, 56, 66, 11, 0], [45, 55, 1, 1],
+        [51, 61, 3, 1], [52, 62, 63, 11, 0], [53, 54, 64, 65, 18, 0]],
+    7: [[7], [11, 21, 22, 12, 168, 3], [13, 14, 2, 1], [15, 25, 6, 2],
+        [16, 26, 27, 17, 17, 0], [23, 24, 34, 15, 3], [31, 32, 42, 41, 50, 3],
+        [33, 43, 53, 54, 882, 3], [35, 36, 37, 47, 19, 0], [44, 45, 55, 10, 0],
+        [46, 56, 57, 48, 3], [51, 52, 3, 2], [61, 62, 24, 3], [63, 73, 3, 1],
+        [64, 65, 9, 0], [66, 67, 77, 9, 0], [71, 72, 1, 1], [74, 75, 76, 8, 0]],
+    8: [[8], [11, 12, 7, 0], [13, 23, 1, 1], [14, 24, 7, 0],
+        [15, 25, 26, 27, 180, 3], [16, 17, 3, 1], [18, 28, 38, 37, 25, 0],
+        [21, 31, 41, 42, 3], [22, 32, 10, 0], [33, 34, 35, 43, 18, 0],
+        [36, 46, 45, 12, 0], [42, 52, 51, 16, 0], [44, 54, 2, 2],
+        [47, 48, 2, 1], [53, 63, 73, 62, 14, 0], [55, 56, 12, 0],
+        [57, 58, 1, 1], [61, 71, 4, 2], [64, 65, 75, 85, 16, 0],
+        [66, 76, 67, 86, 29, 0], [68, 78, 3, 1], [72, 82, 81, 83, 23, 0],
+        [74, 84, 8, 0], [77, 87, 88, 12, 0]],
+    9: [[9], [11, 21, 8, 1], [12, 22, 23, 15, 0], [13, 14, 1, 1],
+        [15, 16, 35, 3], [17, 27, 18, 72, 3], [19, 29, 8, 0],
+        [24, 25, 26, 35, 64, 3], [28, 38, 4, 2], [31, 41, 8, 0],
+        [32, 42, 4, 1], [33, 34, 44, 90, 3], [36, 37, 46, 47, 26, 0],
+        [39, 49, 48, 59, 504, 3], [43, 53, 4, 1], [45, 55, 6, 3],
+        [51, 52, 62, 224, 3], [54, 64, 74, 168, 3], [56, 66, 3, 2],
+        [57, 58, 2, 1], [61, 71, 81, 91, 480, 3], [63, 73, 2, 2],
+        [65, 75, 15, 0], [67, 77, 6, 3], [68, 78, 69, 40, 3],
+        [72, 82, 83, 92, 93, 27, 0], [76, 86, 85, 210, 3],
+        [79, 89, 99, 98, 864, 3], [84, 94, 9, 3], [87, 97, 88, 17, 0],
+        [95, 96, 3, 1]],
+}
+
+
+def timed(fn, *args, repeat=1):
+    '''Return (best wall clock time over repeat runs, last result of fn)'''
+    best = None
+    for _ in range(repeat):
+        stime = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - stime
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def quiet_search(solver, *args):
+    '''Run solver.bt_search without its progress printing'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver.bt_search(*args)
+    return solver
+
+
+def domain_ops(vars, rounds):
+    '''Exercise the current domain methods the propagators use most'''
+    for _ in range(rounds):
+        for var in vars:
+            dom = var.domain()
+            for val in dom[::2]:
+                var.prune_value(val)
+            for val in dom:
+                var.in_cur_domain(val)
+            var.cur_domain_size()
+            var.cur_domain()
+            for val in dom[::2]:
+                var.unprune_value(val)
+
+
+def bench_domains():
+    '''List flags (Variable) versus bitmask (BitVariable) current domains
+       on a 9x9 board.'''
+    grid = BOARDS[9]
+    print("{:<12} {:>12} {:>12} {:>12}".format(
+        "var_type", "domain ops", "ord_mrv", "FC solve"))
+    for var_type in (Variable, BitVariable):
+        csp, board = binary_ne_grid(grid, var_type)
+        t_ops, _ = timed(domain_ops, csp.get_all_vars(), 200, repeat=3)
+        t_mrv, _ = timed(lambda: [ord_mrv(csp) for _ in range(2000)], repeat=3)
+        t_bt, _ = timed(quiet_search, BT(csp), prop_FC, ord_mrv, repeat=3)
+        print("{:<12} {:>11.3f}s {:>11.3f}s {:>11.3f}s".format(
+            var_type.__name__, t_ops, t_mrv, t_bt))
+
+
+def bench_gac3():
+    '''One pass GAC (prop_GAC) versus the GAC-3 fixpoint (prop_GAC3)
+       on the sample boards.'''
+    print("{:<4} {:<10} {:>10} {:>10} {:>10}".format(
+        "n", "propagator", "decisions", "prunings", "time"))
+    for n in (4, 5, 6, 7):
+        csp, board = kenken_csp_model(BOARDS[n])
+        for prop in (prop_GAC, prop_GAC3):
+            t, solver = timed(quiet_search, BT(csp), prop, ord_mrv)
+            print("{:<4} {:<10} {:>10} {:>10} {:>9.3f}s".format(
+                n, prop.__name__, solver.nDecisions, solver.nPrunings, t))
+
+
+class NoResidues(dict):
+    '''Stand-in for Constraint.residues that never remembers a support,
+       so has_support always scans from the start of its list'''
+
+    def __setitem__(self, key, value):
+        pass
+
+
+def bench_supports():
+    '''Support checks made by prop_GAC with and without residual
+       supports.'''
+    print("{:<4} {:<10} {:>12} {:>12} {:>10}".format(
+        "n", "residues", "checks", "hits", "time"))
+    for n in (5, 6, 7):
+        for residues in (False, True):
+            csp, board = kenken_csp_model(BOARDS[n])
+            for c in csp.get_all_cons():
+                if not residues:
+                    c.residues = NoResidues()
+            t, solver = timed(quiet_search, BT(csp), prop_GAC, ord_mrv)
+            checks = sum(c.nSupportChecks for c in csp.get_all_cons())
+            hits = sum(c.nResidueHits for c in csp.get_all_cons())
+            print("{:<4} {:<10} {:>12} {:>12} {:>9.3f}s".format(
+                n, str(residues), checks, hits, t))
+
+
+def bench_tables():
+    '''GAC-3 with has_support revisions (prop_GAC3) versus Simple Tabular
+       Reduction (prop_STR2) and Compact-Table (prop_CT).'''
+    print("{:<4} {:<10} {:>10} {:>10}".format(
+        "n", "propagator", "decisions", "time"))
+    for n in (5, 6, 7):
+        for prop in (prop_GAC3, prop_STR2, prop_CT):
+            csp, board = kenken_csp_model(BOARDS[n])
+            t, solver = timed(quiet_search, BT(csp), prop, ord_mrv)
+            print("{:<4} {:<10} {:>10} {:>9.3f}s".format(
+                n, prop.__name__, solver.nDecisions, t))
+
+
+def in_child(fn, *args):
+    '''Run fn(*args) in a fresh process and return its result, so that
+       memory measurements are not polluted by earlier runs'''
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def build_and_solve(n, alldiff, prop):
+    '''Build the KenKen model of BOARDS[n] and solve it. Returns the
+       build time, the growth in peak resident memory (MB) while building
+       and the solve time.'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t_build, (csp, board) = timed(kenken_csp_model, BOARDS[n], Variable, alldiff,
+                                  'table', CAGE_CACHE, 'nary', None)
+    mem = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024.0
+    t_solve, _ = timed(quiet_search, BT(csp), prop, ord_mrv)
+    return t_build, mem, t_solve
+
+
+def bench_alldiff():
+    '''Rows and columns as tables of permutations (solved with prop_CT)
+       versus AllDiffConstraint (solved with prop_GAC3).'''
+    print("{:<4} {:<8} {:>10} {:>10} {:>10}".format(
+        "n", "encoding", "build", "memory", "solve"))
+    for n in (4, 5, 6, 7, 8, 9):
+        for alldiff, prop in ((None, prop_CT), ('gac', prop_GAC3)):
+            t_build, mem, t_solve = in_child(build_and_solve, n, alldiff, prop)
+            print("{:<4} {:<8} {:>9.3f}s {:>8.1f}MB {:>9.3f}s".format(
+                n, alldiff or 'table', t_build, mem, t_solve))
+
+
+def bench_cages():
+    '''Cages as tables built from itertools.product versus intensional
+       arithmetic cage constraints (rows and columns are AllDiffConstraints,
+       solved with prop_GAC3).'''
+    print("{:<4} {:<8} {:>10} {:>10} {:>10}".format(
+        "n", "cages", "build", "decisions", "solve"))
+    for n in (4, 5, 6, 7, 8, 9):
+        for cages in ('table', 'arith'):
+            t_build, (csp, board) = timed(kenken_csp_model, BOARDS[n], Variable, 'gac', cages)
+            t_solve, solver = timed(quiet_search, BT(csp), prop_GAC3, ord_mrv)
+            print("{:<4} {:<8} {:>9.3f}s {:>10} {:>9.3f}s".format(
+                n, cages, t_build, solver.nDecisions, t_solve))
+
+
+def product_tuples(op, target_value, k, size):
+    '''The satisfying tuples of a cage found by filtering the whole cross
+       product of the domains, as kenken_csp_model used to build them'''
+    verify = {0: verify_add, 1: verify_sub, 2: verify_div, 3: verify_mult}[op]
+    return [t for t in itertools.product(range(1, size + 1), repeat=k)
+            if verify(t, target_value)]
+
+
+def board_cages(grid):
+    '''Return (op, target, cells) for every multi-cell cage of grid'''
+    return [(cage[-1], cage[-2], [(cell // 10, cell % 10) for cell in cage[:-2]])
+            for cage in grid[1:] if len(cage) > 2]
+
+
+def bench_cagegen():
+    '''Building the cage tables of each board by filtering the cross
+       product versus generating the satisfying tuples directly.'''
+    print("{:<4} {:>8} {:>12} {:>12} {:>10} {:>10}".format(
+        "n", "max k", "product", "generated", "tuples", "kept"))
+    for n in sorted(BOARDS):
+        cages = board_cages(BOARDS[n])
+        t_prod, prod = timed(lambda: [product_tuples(op, t, len(cells), n)
+                                      for op, t, cells in cages], repeat=3)
+        t_gen, gen = timed(lambda: [cage_tuples(op, t, cells, n)
+                                    for op, t, cells in cages], repeat=3)
+        print("{:<4} {:>8} {:>11.4f}s {:>11.4f}s {:>10} {:>10}".format(
+            n, max(len(cells) for op, t, cells in cages), t_prod, t_gen,
+            sum(map(len, prod)), sum(map(len, gen))))
+
+
+def unshared_ne_grid(kenken_grid):
+    '''binary_ne_grid with every constraint given its own copy of the
+       not-equal table, as before tables could be shared'''
+    size = kenken_grid[0][0]
+    domain = list(range(1, size + 1))
+    board = init_vars(domain)
+    lines = board + [list(col) for col in zip(*board)]
+    csp = CSP("{0}-BinaryKenKen".format(size))
+    for row in board:
+        for var in row:
+            csp.add_var(var)
+    for line in lines:
+        for pair in itertools.combinations(line, 2):
+            c = Constraint("C({0},{1})".format(pair[0].name, pair[1].name), pair)
+            c.add_satisfying_tuples(itertools.permutations(domain, 2))
+            csp.add_constraint(c)
+    return csp, board
+
+
+def fresh_ne_grid(kenken_grid):
+    '''binary_ne_grid without a GridTemplateCache: the shared not-equal
+       table is built afresh'''
+    return binary_ne_grid(kenken_grid, Variable, None)
+
+
+def build_traced(build, n):
+    '''Build BOARDS[n] with build. Returns the build time and the memory
+       (MB) still allocated by the model afterwards'''
+    tracemalloc.start()
+    t, model = timed(build, BOARDS[n])
+    mem = tracemalloc.get_traced_memory()[0] / (1024.0 * 1024.0)
+    tracemalloc.stop()
+    return t, mem
+
+
+def bench_relations():
+    '''The binary not-equal model with one Relation shared by every
+       constraint versus a copy of the table per constraint.'''
+    print("{:<4} {:>12} {:<10} {:>10} {:>10}".format(
+        "n", "constraints", "tables", "build", "memory"))
+    for n in (4, 5, 6, 7, 8, 9):
+        for label, build in (('copied', unshared_ne_grid), ('shared', fresh_ne_grid)):
+            t, mem = in_child(build_traced, build, n)
+            print("{:<4} {:>12} {:<10} {:>9.4f}s {:>8.2f}MB".format(
+                n, n * n * (n - 1), label, t, mem))
+
+
+def bench_binary():
+    '''Forward checking and GAC on the binary not-equal model, with the
+       generic tuple-based routines versus the bit-matrix fast path.'''
+    print("{:<4} {:<10} {:<8} {:>10} {:>10}".format(
+        "n", "propagator", "path", "decisions", "time"))
+    for n in (6, 7, 8, 9):
+        for prop in (prop_FC, prop_GAC, prop_GAC3):
+            for bits in (False, True):
+                csp, board = binary_ne_grid(BOARDS[n])
+                if not bits:
+                    for c in csp.get_all_cons():
+                        c.tabular = False
+                t, solver = timed(quiet_search, BT(csp), prop, ord_mrv)
+                print("{:<4} {:<10} {:<8} {:>10} {:>9.4f}s".format(
+                    n, prop.__name__, 'bits' if bits else 'generic', solver.nDecisions, t))
+
+
+def timed_heuristic(heuristic):
+    '''Wrap a variable or value ordering function so that the time spent
+       in it and the number of calls are added up in the wrapper's
+       'elapsed' and 'calls' attributes'''
+    def wrapper(*args):
+        stime = time.perf_counter()
+        result = heuristic(*args)
+        wrapper.elapsed += time.perf_counter() - stime
+        wrapper.calls += 1
+        return result
+    wrapper.elapsed = 0.0
+    wrapper.calls = 0
+    return wrapper
+
+
+def bench_mrv():
+    '''Variable selection time of ord_mrv (a scan of every variable per
+       decision) versus ord_mrv_inc (bucketed incremental index), for
+       plain and bit-set variables.'''
+    print("{:<4} {:<12} {:<12} {:>10} {:>12} {:>10}".format(
+        "n", "variables", "var_ord", "decisions", "select", "search"))
+    for n in (6, 7, 8, 9):
+        for var_type in (Variable, BitVariable):
+            for var_ord in (ord_mrv, ord_mrv_inc):
+                csp, board = kenken_csp_model(BOARDS[n], var_type, 'gac', 'arith')
+                select = timed_heuristic(var_ord)
+                t, solver = timed(quiet_search, BT(csp), prop_GAC3, select)
+                print("{:<4} {:<12} {:<12} {:>10} {:>11.4f}s {:>9.4f}s".format(
+                    n, var_type.__name__, var_ord.__name__, solver.nDecisions,
+                    select.elapsed, t))
+
+
+def bench_wdeg():
+    '''Search effort of MRV versus conflict-weighted dom/wdeg (rows and
+       columns are AllDiffConstraints, cages arithmetic constraints,
+       solved with prop_GAC3).'''
+    print("{:<4} {:<14} {:>10} {:>10} {:>10}".format(
+        "n", "var_ord", "decisions", "prunings", "time"))
+    for n in (6, 7, 8, 9):
+        for var_ord in (ord_mrv, ord_mrv_inc, ord_dom_wdeg):
+            csp, board = kenken_csp_model(BOARDS[n], BitVariable, 'gac', 'arith')
+            t, solver = timed(quiet_search, BT(csp), prop_GAC3, var_ord)
+            print("{:<4} {:<14} {:>10} {:>10} {:>9.3f}s".format(
+                n, var_ord.__name__, solver.nDecisions, solver.nPrunings, t))
+
+
+def bench_lcv():
+    '''Per call cost of val_lcv (trial assignments) versus
+       val_lcv_support (support counts), for table constraints solved
+       with prop_CT and with prop_GAC3 (plain tables, whose counts are
+       sampled) and for AllDiffConstraints solved with prop_GAC3.'''
+    print("{:<4} {:<8} {:<10} {:<16} {:>10} {:>12} {:>10}".format(
+        "n", "model", "prop", "val_ord", "decisions", "per call", "search"))
+    for n in (5, 6, 7, 8):
+        for model, alldiff, prop in (('table', None, prop_CT), ('table', None, prop_GAC3),
+                                     ('alldiff', 'gac', prop_GAC3)):
+            if alldiff is None and n > 7:
+                continue
+            for val_ord in (val_lcv, val_lcv_support):
+                csp, board = kenken_csp_model(BOARDS[n], BitVariable, alldiff)
+                order = timed_heuristic(val_ord)
+                t, solver = timed(quiet_search, BT(csp), prop, ord_mrv, order)
+                print("{:<4} {:<8} {:<10} {:<16} {:>10} {:>10.1f}us {:>9.3f}s".format(
+                    n, model, prop.__name__, val_ord.__name__, solver.nDecisions,
+                    1e6 * order.elapsed / max(order.calls, 1), t))
+
+
+def chain_csp(n):
+    '''n variables over {0, 1, 2} with x_i != x_i+1: the search goes
+       n levels deep'''
+    vars = [BitVariable('x{}'.format(i), [0, 1, 2]) for i in range(n)]
+    csp = CSP('chain{}'.format(n), vars)
+    ne = Relation([(a, b) for a in range(3) for b in range(3) if a != b], 2)
+    for i in range(n - 1):
+        csp.add_constraint(Constraint('C{}'.format(i), [vars[i], vars[i + 1]], ne))
+    return csp
+
+
+def bench_search():
+    '''The solutions generator: counting every 4x4 Latin square, the
+       first k solutions of the 5x5 binary model, and first solutions of
+       chains far deeper than Python's recursion limit.'''
+    print("{:<36} {:>10} {:>10} {:>10}".format(
+        "problem", "solutions", "decisions", "time"))
+    for label, csp, prop, limit in (
+            ('latin 4x4, all', binary_ne_grid([[4]])[0], prop_FC, None),
+            ('latin 4x4, all', binary_ne_grid([[4]])[0], prop_GAC3, None),
+            ('latin 5x5, first 1000', binary_ne_grid([[5]])[0], prop_FC, 1000),
+            ('chain 5000, first', chain_csp(5000), prop_FC, 1),
+            ('chain 20000, first', chain_csp(20000), prop_FC, 1)):
+        solver = BT(csp)
+        t, n = timed(lambda: solver.count_solutions(prop, limit=limit))
+        print("{:<36} {:>10} {:>10} {:>9.3f}s".format(
+            label + ' (' + prop.__name__ + ')', n, solver.nDecisions, t))
+
+
+def bench_unique():
+    '''Uniqueness checks (BT.check_unique) of the sample boards: the
+       answer, the effort and the time per check.'''
+    print("{:<4} {:<14} {:>8} {:>10} {:>10}".format(
+        "n", "var_ord", "answer", "decisions", "time"))
+    for n in sorted(BOARDS):
+        for var_ord in (ord_mrv, ord_dom_wdeg):
+            csp, board = kenken_csp_model(BOARDS[n], BitVariable, 'gac', 'arith')
+            solver = BT(csp)
+            t, answer = timed(solver.check_unique, prop_GAC3, var_ord)
+            print("{:<4} {:<14} {:>8} {:>10} {:>9.3f}s".format(
+                n, var_ord.__name__, answer, solver.nDecisions, t))
+
+
+def bench_limits():
+    '''How closely BT.solve keeps to a wall clock limit, and what the
+       limit and cancellation checks cost, on the 6x6 board with forward
+       checking (a long search).'''
+    csp, board = kenken_csp_model(BOARDS[6], BitVariable)
+    solver = BT(csp)
+    print("{:<10} {:>10} {:>10} {:>10}".format(
+        "limit", "status", "decisions", "elapsed"))
+    for limit in (0.01, 0.05, 0.1, 0.5):
+        outcome = solver.solve(prop_FC, ord_mrv, None, time_limit=limit)
+        print("{:<10} {:>10} {:>10} {:>9.4f}s".format(
+            limit, outcome.status, outcome.nDecisions, outcome.elapsed))
+    print()
+    print("{:<36} {:>10}".format("checks (20000 decisions)", "time"))
+    for label, kwargs in (('decision limit only', {}),
+                          ('+ time limit and cancel token',
+                           dict(time_limit=3600, cancel=threading.Event()))):
+        best = min(solver.solve(prop_FC, ord_mrv, None, decision_limit=20000,
+                                **kwargs).elapsed for _ in range(3))
+        print("{:<36} {:>9.4f}s".format(label, best))
+
+
+def bench_restarts():
+    '''Decisions over ten random seeds (median, worst, total) of the
+       randomized heuristics without restarts, and with Luby and
+       geometric restarts with and without nogood recording.'''
+    print("{:<4} {:<24} {:>8} {:>8} {:>8}".format(
+        "n", "strategy", "median", "worst", "total"))
+    strategies = (('no restarts', None),
+                  ('luby 50', dict(schedule='luby', base=50)),
+                  ('luby 50, no nogoods', dict(schedule='luby', base=50, learn=False)),
+                  ('geometric 20 x1.5', dict(schedule='geometric', base=20)))
+    for n in (6, 8):
+        for label, kwargs in strategies:
+            decisions = []
+            for seed in range(10):
+                csp, board = kenken_csp_model(BOARDS[n], BitVariable, 'gac', 'arith')
+                solver = BT(csp)
+                if kwargs is None:
+                    random.seed(seed)
+                    outcome = solver.solve(prop_GAC3, ord_mrv_rand, val_lcv_support_rand)
+                else:
+                    outcome = solver.solve_restarts(prop_GAC3, ord_mrv_rand,
+                                                    val_lcv_support_rand, seed=seed, **kwargs)
+                decisions.append(outcome.nDecisions)
+            decisions.sort()
+            print("{:<4} {:<24} {:>8} {:>8} {:>8}".format(
+                n, label, decisions[len(decisions) // 2], decisions[-1], sum(decisions)))
+
+
+def bench_cbj():
+    '''Decisions, levels backjumped over and time of chronological
+       backtracking (BT.solve) versus conflict-directed backjumping
+       (BT.solve_cbj) without and with nogood learning.'''
+    print("{:<4} {:<10} {:<14} {:>10} {:>10} {:>9}".format(
+        "n", "prop", "search", "decisions", "backjumps", "time"))
+    runs = [(4, prop_BT), (5, prop_BT), (4, prop_FC), (5, prop_FC)]
+    runs += [(n, prop_GAC3) for n in (6, 7, 8, 9)]
+    for n, prop in runs:
+        for label, learn in (('chronological', None), ('cbj', False), ('cbj + learn', True)):
+            csp, board = kenken_csp_model(BOARDS[n], BitVariable, 'gac', 'arith')
+            solver = BT(csp)
+            if learn is None:
+                t, outcome = timed(solver.solve, prop, ord_mrv, val_lcv_support)
+                backjumps = '-'
+            else:
+                t, outcome = timed(solver.solve_cbj, prop, ord_mrv, val_lcv_support, learn)
+                backjumps = solver.nBackjumps
+            print("{:<4} {:<10} {:<14} {:>10} {:>10} {:>8.3f}s".format(
+                n, prop.__name__, label, outcome.nDecisions, backjumps, t))
+
+
+def bench_portfolio():
+    '''Wall clock time to solve each sample board with every PORTFOLIO
+       configuration on its own (one worker; best, worst and the first
+       configuration) against the whole portfolio at once.'''
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:<4} {:>10} {:>10} {:>10} {:>10}  {}".format(
+        "n", "first", "best", "worst", "portfolio", "winner"))
+    for n in (6, 7, 8, 9):
+        times = []
+        for config in PORTFOLIO:
+            outcome = solve_portfolio(BOARDS[n], [config], time_limit=30)
+            times.append(outcome.elapsed if outcome.winner else float('inf'))
+        outcome = solve_portfolio(BOARDS[n], PORTFOLIO, time_limit=30)
+        cols = ["{:>9.3f}s".format(t) if t != float('inf') else "{:>10}".format("limit")
+                for t in (times[0], min(times), max(times), outcome.elapsed)]
+        print("{:<4} {} {} {} {}  {}".format(
+            n, *cols, outcome.winner.label if outcome.winner else '-'))
+
+
+def bench_eps():
+    '''Counting the 5184 solutions of a 5x5 board with two cages:
+       sequentially (BT.count_solutions) and with embarrassingly
+       parallel search (solve_eps) on one worker and on every CPU.'''
+    grid = [[5], [11, 12, 13, 6, 0], [54, 55, 2, 1]]
+    config = dict(prop=prop_GAC3, var_ord=ord_mrv, var_type=BitVariable,
+                  alldiff='gac', cages='arith')
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:<12} {:>8} {:>12} {:>9} {:>9} {:>9}".format(
+        "search", "workers", "subproblems", "split", "time", "speedup"))
+    csp, board = kenken_csp_model(grid, BitVariable, 'gac', 'arith')
+    t_seq, count = timed(BT(csp).count_solutions, prop_GAC3, ord_mrv)
+    print("{:<12} {:>8} {:>12} {:>9} {:>8.3f}s {:>9}".format(
+        "sequential", 1, '-', '-', t_seq, '-'))
+    for workers in sorted(set((1, os.cpu_count() or 1))):
+        outcome = solve_eps(grid, config, 'count', workers)
+        print("{:<12} {:>8} {:>12} {:>8.3f}s {:>8.3f}s {:>8.2f}x".format(
+            "eps", workers, outcome.nSubproblems, outcome.split, outcome.elapsed,
+            t_seq / outcome.elapsed))
+
+
+def bench_batch():
+    '''Model build time for a batch of 60 puzzles (ten of each sample
+       board) with a fresh kenken_csp_model per puzzle versus one
+       GridModel per board size with the cages swapped in, for the
+       permutation table and the AllDiffConstraint grid encodings.'''
+    puzzles = [BOARDS[n] for n in sorted(BOARDS)] * 10
+    print("{:<10} {:>10} {:>10} {:>9}".format("grid", "fresh", "GridModel", "speedup"))
+    for alldiff, cages in ((None, 'table'), ('gac', 'arith')):
+        t_fresh, _ = timed(lambda: [kenken_csp_model(g, Variable, alldiff, cages,
+                                                     CAGE_CACHE, 'nary', None)
+                                    for g in puzzles])
+        def reuse():
+            models = dict()
+            for g in puzzles:
+                size = g[0][0]
+                if size not in models:
+                    models[size] = GridModel(size, Variable, alldiff)
+                models[size].set_puzzle(g, cages)
+        t_reuse, _ = timed(reuse)
+        print("{:<10} {:>9.3f}s {:>9.3f}s {:>8.1f}x".format(
+            alldiff or 'table', t_fresh, t_reuse, t_fresh / t_reuse))
+
+
+def bench_templates():
+    '''Model build time of each sample board with the row and column
+       tables (binary not-equal and n-ary permutation encodings) built
+       afresh from cold caches, built afresh with a warm cage table cache,
+       and taken from a warm GridTemplateCache.'''
+    print("{:<4} {:<8} {:>10} {:>10} {:>10} {:>9}".format(
+        "n", "grid", "cold", "warm", "templated", "speedup"))
+    for n in (4, 5, 6, 7, 8, 9):
+        for grid in ('binary', 'nary'):
+            t_cold, _ = timed(kenken_csp_model, BOARDS[n], Variable, None, 'table',
+                              CageTableCache(), grid, None)
+            t_warm, _ = timed(kenken_csp_model, BOARDS[n], Variable, None, 'table',
+                              CAGE_CACHE, grid, None, repeat=3)
+            templates = GridTemplateCache()
+            kenken_csp_model(BOARDS[n], Variable, None, 'table', CAGE_CACHE, grid, templates)
+            t_tmpl, _ = timed(kenken_csp_model, BOARDS[n], Variable, None, 'table',
+                              CAGE_CACHE, grid, templates, repeat=3)
+            print("{:<4} {:<8} {:>9.4f}s {:>9.4f}s {:>9.4f}s {:>8.1f}x".format(
+                n, grid, t_cold, t_warm, t_tmpl, t_warm / t_tmpl))
+
+
+def startup_and_solve(n, path=None):
+    '''Build the table model of BOARDS[n] with cold caches, or load it
+       from path (saved by CSP.save_compiled), then solve it. Returns the
+       startup time, the solve time and the growth in peak resident
+       memory (MB).'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if path is None:
+        t_start, (csp, board) = timed(kenken_csp_model, BOARDS[n], Variable, None, 'table',
+                                      CageTableCache(), 'nary', None)
+    else:
+        t_start, csp = timed(CSP.load_compiled, path)
+    t_solve, _ = timed(BT(csp).solve, prop_GAC3, ord_mrv)
+    mem = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024.0
+    return t_start, t_solve, mem
+
+
+def bench_compiled():
+    '''Startup time of a fresh process that builds the permutation table
+       model of a sample board from scratch versus one that loads it with
+       CSP.load_compiled (memory-mapped), and the time and peak memory of
+       solving it with prop_GAC3 afterwards.'''
+    directory = tempfile.mkdtemp()
+    try:
+        print("{:<4} {:<10} {:>10} {:>10} {:>10} {:>10}".format(
+            "n", "model", "startup", "solve", "total", "memory"))
+        for n in (4, 5, 6, 7, 8, 9):
+            path = os.path.join(directory, str(n))
+            csp, board = kenken_csp_model(BOARDS[n], Variable, None, 'table',
+                                          CageTableCache(), 'nary', None)
+            csp.save_compiled(path)
+            for label, source in (('built', None), ('compiled', path)):
+                t_start, t_solve, mem = in_child(startup_and_solve, n, source)
+                print("{:<4} {:<10} {:>9.4f}s {:>9.4f}s {:>9.4f}s {:>8.1f}MB".format(
+                    n, label, t_start, t_solve, t_start + t_solve, mem))
+    finally:
+        shutil.rmtree(directory)
+
+
+def build_all(cache):
+    '''Build the model of every sample board with cage tables from cache'''
+    for n in sorted(BOARDS):
+        kenken_csp_model(BOARDS[n], Variable, 'gac', 'table', cache)
+
+
+def bench_cagecache():
+    '''Model build latency for all the sample boards without a cage table
+       cache, with a cold and a warm in-memory cache, and with a fresh
+       cache loading from a warm on-disk store (as a new process would).'''
+    directory = tempfile.mkdtemp()
+    try:
+        print("{:<12} {:>10} {:>8} {:>10} {:>8}".format(
+            "cache", "build", "hits", "disk hits", "misses"))
+        mem = CageTableCache()
+        disk = CageTableCache(directory=directory)
+        build_all(disk)
+        runs = (('none', None), ('cold', mem), ('warm', mem),
+                ('disk', CageTableCache(directory=directory)))
+        for label, cache in runs:
+            if cache is not None:
+                cache.clear_stats()
+            t, _ = timed(build_all, cache)
+            print("{:<12} {:>9.4f}s {:>8} {:>10} {:>8}".format(
+                label, t, cache.hits if cache else '-',
+                cache.disk_hits if cache else '-', cache.misses if cache else '-'))
+    finally:
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    'domains': bench_domains,
+    'gac3': bench_gac3,
+    'supports': bench_supports,
+    'tables': bench_tables,
+    'alldiff': bench_alldiff,
+    'cages': bench_cages,
+    'cagegen': bench_cagegen,
+    'cagecache': bench_cagecache,
+    'relations': bench_relations,
+    'binary': bench_binary,
+    'mrv': bench_mrv,
+    'wdeg': bench_wdeg,
+    'lcv': bench_lcv,
+    'search': bench_search,
+    'unique': bench_unique,
+    'limits': bench_limits,
+    'restarts': bench_restarts,
+    'cbj': bench_cbj,
+    'portfolio': bench_portfolio,
+    'eps': bench_eps,
+    'batch': bench_batch,
+    'templates': bench_templates,
+    'compiled': bench_compiled,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("==", name)
+        BENCHMARKS[name]()
@@ -1,5 +1,13 @@
+import os
 import time
+import json
+import random
 import functools
+import importlib
+try:
+    import numpy
+except ImportError:
+    numpy = None            #CompactTableConstraint falls back to plain lists
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -15,6 +23,10 @@ import functools
       So one can remove values, add them back, and query if they are 
       still current. 
 
+      The subclass BitVariable offers the same interface but keeps
+      the current domain as an integer bitmask, so that membership,
+      pruning and domain size are constant time operations.
+
     B) class constraint
 
       This class allows one to define constraints specified by tables
@@ -30,10 +42,36 @@ import functools
       for each variable in the constraint (in the same ORDER as the
       variables of the constraint were specified).
 
-    C) Backtracking routine---takes propagator and CSP as arguments
+      The tuples themselves are held in a Relation, an immutable
+      object that any number of constraints of the same arity can
+      share, so structurally identical constraints (e.g. every
+      not-equal constraint of a grid) store their table only once.
+
+      The subclass TableConstraint filters its table with Simple
+      Tabular Reduction (STR2) during GAC propagation, and the subclass
+      CompactTableConstraint with the bitset based Compact-Table
+      algorithm.
+
+      AllDiffConstraint is a global all-different constraint that
+      stores no tuples at all. It filters with bipartite matching.
+
+      A CompiledRelation is a Relation read from integer arrays, such
+      as the memory-mapped files of a CSP saved with save_compiled.
+
+    C) class Trail
+
+      A solver-wide undo stack. Propagators prune values through the
+      trail, and the backtracking routine rolls the trail back to a
+      checkpoint to undo everything done since an assignment.
+
+    D) Backtracking routine---takes propagator and CSP as arguments
        so that basic backtracking, forward-checking or GAC can be 
        executed depending on the propagator used.
 
+       The search runs on an explicit stack rather than by recursion.
+       BT.solutions is a generator of solutions; bt_search finds and
+       prints the first one.
+
 '''
 
 class Variable: 
@@ -71,6 +109,13 @@ class Variable:
            value. However, the internal state of the current domain
            flags are not changed so that pruning and unpruning can
            work independently of assignment and unassignment. 
+
+       (c) Objects in the list 'watchers' are told about every change:
+           watcher.domain_changed(var, delta) when the number of values
+           in the (internal) current domain changes by delta, and
+           watcher.assignment_changed(var) when var is assigned or
+           unassigned. Incremental heuristics use this to keep their
+           indexes up to date.
            '''
     #
     #set up and info methods
@@ -84,6 +129,7 @@ class Variable:
         self.curdom = [True] * len(domain)      #using list
         #for bt_search
         self.assignedValue = None
+        self.watchers = []              #see (c) above
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
@@ -91,6 +137,8 @@ class Variable:
         for val in values: 
             self.dom.append(val)
             self.curdom.append(True)
+            for w in self.watchers:
+                w.domain_changed(self, 1)
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -106,11 +154,19 @@ class Variable:
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        i = self.value_index(value)
+        if self.curdom[i]:
+            self.curdom[i] = False
+            for w in self.watchers:
+                w.domain_changed(self, -1)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        i = self.value_index(value)
+        if not self.curdom[i]:
+            self.curdom[i] = True
+            for w in self.watchers:
+                w.domain_changed(self, 1)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
@@ -142,10 +198,28 @@ class Variable:
         else:
             return(sum(1 for v in self.curdom if v))
 
+    def cur_domain_mask(self):
+        '''Return the CURRENT domain as an integer bitmask: bit i is set
+           if dom[i] is in the current domain (if assigned only the bit of
+           the assigned value is set)'''
+        if self.is_assigned():
+            return 1 << self.value_index(self.get_assigned_value())
+        mask = 0
+        for i, flag in enumerate(self.curdom):
+            if flag:
+                mask |= 1 << i
+        return mask
+
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
+        delta = 0
         for i in range(len(self.curdom)):
-            self.curdom[i] = True
+            if not self.curdom[i]:
+                self.curdom[i] = True
+                delta += 1
+        if delta:
+            for w in self.watchers:
+                w.domain_changed(self, delta)
 
     #
     #methods for assigning and unassigning
@@ -165,6 +239,8 @@ class Variable:
             return
 
         self.assignedValue = value
+        for w in self.watchers:
+            w.assignment_changed(self)
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
@@ -172,6 +248,8 @@ class Variable:
             print("ERROR: trying to unassign variable", self, " not yet assigned")
             return
         self.assignedValue = None
+        for w in self.watchers:
+            w.assignment_changed(self)
 
     def get_assigned_value(self):
         '''return assigned value...returns None if is unassigned'''
@@ -197,13 +275,364 @@ class Variable:
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
                                                              self.curdom))
+
+class BitVariable(Variable):
+
+    '''A Variable whose current domain is stored as an integer bitmask
+       rather than a list of flags. Bit i of 'curdom' is set if and only
+       if dom[i] is still in the current domain.
+
+       The class keeps a value->index map, so finding a value no longer
+       needs a scan of the domain list, and a cached count of the values
+       still in the current domain. Membership, prune, unprune and size
+       are all O(1).
+
+       The external interface is exactly that of Variable, so the
+       propagators and heuristics work unchanged with either kind of
+       variable.
+       '''
+
+    def __init__(self, name, domain=[]):
+        '''Create a variable object, specifying its name (a
+        string). Optionally specify the initial domain.
+        '''
+        self.name = name
+        self.dom = []
+        self.val_idx = dict()           #value -> index in dom
+        self.curdom = 0                 #bitmask over dom indices
+        self.ncur = 0                   #number of bits set in curdom
+        self.assignedValue = None
+        self.watchers = []
+        self.add_domain_values(domain)
+
+    def add_domain_values(self, values):
+        '''Add additional domain values to the domain
+           Removals not supported removals'''
+        for val in values:
+            self.val_idx[val] = len(self.dom)
+            self.curdom |= 1 << len(self.dom)
+            self.ncur += 1
+            self.dom.append(val)
+            for w in self.watchers:
+                w.domain_changed(self, 1)
+
+    #
+    #methods for current domain (pruning and unpruning)
+    #
+
+    def prune_value(self, value):
+        '''Remove value from CURRENT domain'''
+        bit = 1 << self.val_idx[value]
+        if self.curdom & bit:
+            self.curdom ^= bit
+            self.ncur -= 1
+            for w in self.watchers:
+                w.domain_changed(self, -1)
+
+    def unprune_value(self, value):
+        '''Restore value to CURRENT domain'''
+        bit = 1 << self.val_idx[value]
+        if not self.curdom & bit:
+            self.curdom |= bit
+            self.ncur += 1
+            for w in self.watchers:
+                w.domain_changed(self, 1)
+
+    def cur_domain(self):
+        '''return list of values in CURRENT domain (if assigned 
+           only assigned value is viewed as being in current domain)'''
+        if self.is_assigned():
+            return [self.get_assigned_value()]
+        vals = []
+        mask = self.curdom
+        while mask:
+            low = mask & -mask
+            vals.append(self.dom[low.bit_length() - 1])
+            mask ^= low
+        return vals
+
+    def in_cur_domain(self, value):
+        '''check if value is in CURRENT domain (without constructing list)
+           if assigned only assigned value is viewed as being in current 
+           domain'''
+        i = self.val_idx.get(value)
+        if i is None:
+            return False
+        if self.is_assigned():
+            return value == self.get_assigned_value()
+        return (self.curdom >> i) & 1 == 1
+
+    def cur_domain_size(self):
+        '''Return the size of the variables domain (without construcing list)'''
+        if self.is_assigned():
+            return 1
+        return self.ncur
+
+    def cur_domain_mask(self):
+        '''Return the CURRENT domain as an integer bitmask (see Variable)'''
+        if self.is_assigned():
+            return 1 << self.val_idx[self.get_assigned_value()]
+        return self.curdom
+
+    def restore_curdom(self):
+        '''return all values back into CURRENT domain'''
+        delta = len(self.dom) - self.ncur
+        self.curdom = (1 << len(self.dom)) - 1
+        self.ncur = len(self.dom)
+        if delta:
+            for w in self.watchers:
+                w.domain_changed(self, delta)
+
+    #
+    #internal methods
+    #
+
+    def value_index(self, value):
+        '''Domain values need not be numbers, so return the index
+           in the domain list of a variable value'''
+        return self.val_idx[value]
+
+    def print_all(self):
+        '''Also print the variable domain and current domain'''
+        print("Var--\"{}\": Dom = {}, CurDom = {:b}".format(self.name,
+                                                               self.dom,
+                                                               self.curdom))
+
+class Relation:
+    '''An immutable set of satisfying tuples of a given arity, with an
+       index from each position/value to the tuples that support it.
+       A relation knows nothing about variables: constraints bind it to
+       their scope, so one Relation can be shared by every constraint
+       with the same table.'''
+
+    def __init__(self, tuples, arity):
+        #tuples in their original order, without duplicates
+        self.tuples = tuple(dict.fromkeys(tuple(t) for t in tuples))
+        self.arity = arity
+        self.sat = frozenset(self.tuples)
+        self.matrices = dict()      #bit_matrix cache
+
+        #supports[i][val] is the list of tuples with val at position i
+        self.supports = [dict() for i in range(arity)]
+        for t in self.tuples:
+            if len(t) != arity:
+                print("ERROR: tuple", t, "does not have arity", arity)
+                continue
+            for i, val in enumerate(t):
+                if not val in self.supports[i]:
+                    self.supports[i][val] = []
+                self.supports[i][val].append(t)
+
+    def extend(self, tuples):
+        '''Return a new Relation with tuples added to these ones'''
+        return Relation(self.tuples + tuple(tuple(t) for t in tuples), self.arity)
+
+    def bit_matrix(self, dom0, dom1):
+        '''For a binary relation over variables with domains dom0 and
+           dom1, return (rows0, rows1): rows0[i] is the bitmask of the
+           indices j in dom1 such that (dom0[i], dom1[j]) is in the
+           relation, and rows1[j] the bitmask of the supporting indices
+           in dom0 of dom1[j]. Matrices are cached per pair of domains,
+           so constraints sharing the relation share them too.'''
+        key = (tuple(dom0), tuple(dom1))
+        if key not in self.matrices:
+            idx0 = dict((val, i) for i, val in enumerate(dom0))
+            idx1 = dict((val, j) for j, val in enumerate(dom1))
+            rows0 = [0] * len(dom0)
+            rows1 = [0] * len(dom1)
+            for a, b in self:
+                if a in idx0 and b in idx1:
+                    rows0[idx0[a]] |= 1 << idx1[b]
+                    rows1[idx1[b]] |= 1 << idx0[a]
+            self.matrices[key] = (rows0, rows1)
+        return self.matrices[key]
+
+    def __len__(self):
+        return len(self.tuples)
+
+    def __iter__(self):
+        return iter(self.tuples)
+
+    def __contains__(self, t):
+        return t in self.sat
+
+class SupportRows:
+    '''supports[i][val] of a CompiledRelation: a read only sequence of
+       the tuples with val at position i, in the relation's order. Only
+       the tuple numbers are held (a slice of the relation's order array);
+       each tuple is made from its row of the table when it is looked up,
+       so the relation's tuples are never all created.'''
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, j):
+        return tuple(self.table[self.rows[j]].tolist())
+
+    def __iter__(self):
+        for t in self.table[self.rows].tolist():
+            yield tuple(t)
+
+class SupportIndex:
+    '''supports[i] of a CompiledRelation: a read only mapping from each
+       value to the SupportRows of the tuples with that value at position
+       i, taken from the relation's order and index arrays.'''
+
+    def __init__(self, relation, i):
+        self.relation = relation
+        self.i = i
+
+    def get(self, val, default=None):
+        rows = self.relation.rows(self.i, val)
+        if rows is None:
+            return default
+        return SupportRows(self.relation.table, rows)
+
+    def __getitem__(self, val):
+        sups = self.get(val)
+        if sups is None:
+            raise KeyError(val)
+        return sups
+
+    def __contains__(self, val):
+        return self.relation.rows(self.i, val) is not None
+
+    def keys(self):
+        r = self.relation
+        starts = r.index[self.i]
+        return [r.lo + k for k in range(len(starts) - 1) if starts[k] < starts[k + 1]]
+
+    def items(self):
+        return [(val, self[val]) for val in self.keys()]
+
+class CompiledRelation(Relation):
+    '''A Relation over integer values held in arrays rather than Python
+       tuples, as written by CSP.save_compiled: table is the (tuples x
+       arity) array of tuples, order[i] the tuple numbers sorted (stably)
+       by their value at position i, and order[i][index[i][v - lo] :
+       index[i][v - lo + 1]] those with value v there. The arrays may be
+       memory-mapped, so that processes loading the same files share
+       them.
+
+       supports and membership tests work on the arrays: supports[i][v]
+       is a SupportRows, and t in relation looks up the number of t, in
+       base (hi - lo + 1), in a sorted array of the numbers of the
+       tuples, built on the first test. tuples and sat are only built
+       from the arrays if they are asked for.'''
+
+    def __init__(self, table, order, index, lo):
+        #plain arrays over the same memory: indexing a numpy.memmap is
+        #several times slower
+        self.table = numpy.asarray(table)
+        self.order = numpy.asarray(order)
+        self.index = numpy.asarray(index)
+        self.lo = lo
+        self.arity = table.shape[1]
+        self.matrices = dict()      #bit_matrix cache
+        self.supports = [SupportIndex(self, i) for i in range(self.arity)]
+        self._tuples = None
+        self._sat = None
+        self._keys = None
+
+    @classmethod
+    def from_relation(cls, relation):
+        '''Return the arrays (table, order, index, lo) of relation, whose
+           values must be integers, or None if they are not'''
+        vals = set()
+        for t in relation.tuples:
+            vals.update(t)
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in vals):
+            return None
+        lo = min(vals) if vals else 0
+        hi = max(vals) if vals else 0
+        dtype = numpy.int64
+        for small in (numpy.int8, numpy.int16, numpy.int32):
+            if numpy.iinfo(small).min <= lo and hi <= numpy.iinfo(small).max:
+                dtype = small
+                break
+        table = numpy.array(relation.tuples, dtype=dtype).reshape(len(relation), relation.arity)
+        order = numpy.empty((relation.arity, len(relation)), dtype=numpy.int32)
+        index = numpy.empty((relation.arity, hi - lo + 2), dtype=numpy.int64)
+        for i in range(relation.arity):
+            order[i] = numpy.argsort(table[:, i], kind='stable')
+            index[i] = numpy.searchsorted(table[order[i], i], numpy.arange(lo, hi + 2))
+        return table, order, index, lo
+
+    def rows(self, i, val):
+        '''The tuple numbers with val at position i (None if there are none)'''
+        k = val - self.lo
+        if not isinstance(val, int) or k < 0 or k + 1 >= self.index.shape[1]:
+            return None
+        start, end = self.index[i, k], self.index[i, k + 1]
+        if start == end:
+            return None
+        return self.order[i, start:end]
+
+    def key_array(self):
+        '''The sorted numbers of the tuples (see the class docstring),
+           or None if they do not fit in 64 bits'''
+        if self._keys is None:
+            base = self.index.shape[1] - 1
+            if base ** self.arity >= 2 ** 63:
+                return None
+            keys = numpy.zeros(self.table.shape[0], dtype=numpy.int64)
+            for i in range(self.arity):
+                keys *= base
+                keys += self.table[:, i]
+                keys -= self.lo
+            keys.sort()
+            self._keys = keys
+        return self._keys
+
+    @property
+    def tuples(self):
+        if self._tuples is None:
+            self._tuples = tuple(tuple(t) for t in self.table.tolist())
+        return self._tuples
+
+    @property
+    def sat(self):
+        if self._sat is None:
+            self._sat = frozenset(self.tuples)
+        return self._sat
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    def __iter__(self):
+        if self._tuples is not None:
+            return iter(self._tuples)
+        return (tuple(t) for t in self.table.tolist())
+
+    def __contains__(self, t):
+        keys = self.key_array()
+        if keys is None:
+            return tuple(t) in self.sat
+        if len(t) != self.arity:
+            return False
+        base = self.index.shape[1] - 1
+        key = 0
+        for val in t:
+            if not isinstance(val, int):
+                return False
+            k = val - self.lo
+            if k < 0 or k >= base:
+                return False
+            key = key * base + k
+        j = keys.searchsorted(key)
+        return j < len(keys) and keys[j] == key
+
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
        the satisfied function which tests if an assignment to the
        variables in the constraint's scope satisfies the constraint'''
 
-    def __init__(self, name, scope): 
+    def __init__(self, name, scope, relation=None): 
         '''create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable objects).
         The order of the variables in the scope is critical to the
@@ -214,6 +643,11 @@ class Constraint:
         in the scope such that this sequence of values satisfies the
         constraints).
 
+        The tuples are kept in a Relation. Pass relation to share an
+        existing one (e.g. the same table for many constraints);
+        otherwise the constraint starts with an empty relation of its
+        own.
+
         NOTE: This is a very space expensive representation...a proper
         constraint object would allow for representing the constraint
         with a function.  
@@ -221,27 +655,68 @@ class Constraint:
 
         self.scope = list(scope)
         self.name = name
-        self.sat_tuples = dict()
+        if relation is None:
+            relation = Relation((), len(self.scope))
+        elif relation.arity != len(self.scope):
+            print("ERROR: relation of arity", relation.arity, "for constraint",
+                  name, "over", len(self.scope), "variables")
+        self.relation = relation
+
+        #position of each variable in scope, to look up its supports in
+        #the relation
+        self.var_index = dict()
+        for i, var in enumerate(self.scope):
+            self.var_index[var] = i
 
-        #The next object data item 'sup_tuples' will be used to help
-        #support GAC propgation. It allows access to a list of 
-        #satisfying tuples that contain a particular variable/value
-        #pair.
-        self.sup_tuples = dict()
+        #'residues' maps a variable/value pair to the index in its list
+        #of supporting tuples of the last support found for it.
+        #has_support checks that tuple first and resumes scanning from
+        #there. The residues are only hints, so they need no restoring
+        #on backtrack.
+        self.residues = dict()
+        self.nSupportChecks = 0     #tuples tested by has_support
+        self.nResidueHits = 0       #calls answered by the residue itself
 
-    def add_satisfying_tuples(self, tuples):
-        '''We specify the constraint by adding its complete list of satisfying tuples.'''
-        for x in tuples:
-            t = tuple(x)  #ensure we have an immutable tuple
-            if not t in self.sat_tuples:
-                self.sat_tuples[t] = True
+        #bit_matrix of the relation for the scope's domains (binary
+        #table constraints only), compiled on first use
+        self.matrix = None
 
-            #now put t in as a support for all of the variable values in it
-            for i, val in enumerate(t):
-                var = self.scope[i]
-                if not (var,val) in self.sup_tuples:
-                    self.sup_tuples[(var,val)] = []
-                self.sup_tuples[(var,val)].append(t)
+        #number of conflicts (domain wipe outs) this constraint has
+        #caused, see CSP.record_conflict
+        self.weight = 1
+
+    def add_satisfying_tuples(self, tuples):
+        '''We specify the constraint by adding its complete list of satisfying tuples.
+
+           The relation may be shared with other constraints, so it is
+           never modified: the constraint gets a new relation with the
+           tuples added.'''
+        self.relation = self.relation.extend(tuples)
+        self.matrix = None
+
+    def compiled_args(self):
+        '''The arguments after name and scope with which CSP.load_compiled
+           rebuilds this constraint, as a list of JSON values, or None if
+           it can not be saved. Table constraints are rebuilt with their
+           relation, which save_compiled stores separately.'''
+        if self.tabular:
+            return []
+        return None
+
+    @property
+    def sat_tuples(self):
+        '''The set of satisfying tuples'''
+        return self.relation.sat
+
+    @property
+    def sup_tuples(self):
+        '''The supporting tuples of each variable/value pair, as a dict
+           keyed by (var, val). Built on demand from the relation'''
+        sups = dict()
+        for i, var in enumerate(self.scope):
+            for val, ts in self.relation.supports[i].items():
+                sups[(var, val)] = ts
+        return sups
 
     def get_scope(self):
         '''get list of variables the constraint is over'''
@@ -254,7 +729,7 @@ class Constraint:
            constraints "satisfies" function.  Note the list of values
            are must be ordered in the same order as the list of
            variables in the constraints scope'''
-        return tuple(vals) in self.sat_tuples
+        return tuple(vals) in self.relation
 
     def get_n_unasgn(self):
         '''return the number of unassigned variables in the constraint's scope'''
@@ -278,12 +753,155 @@ class Constraint:
            of assignments satisfying the constraint where each value is
            still in the corresponding variables current domain
         '''
-        if (var, val) in self.sup_tuples:
-            for t in self.sup_tuples[(var, val)]:
-                if self.tuple_is_valid(t):
-                    return True
+        sups = self.relation.supports[self.var_index[var]].get(val)
+        if not sups:
+            return False
+        residue = self.residues.get((var, val))
+        start = 0 if residue is None else residue
+        n = len(sups)
+        for k in range(n):
+            i = start + k
+            if i >= n:
+                i -= n
+            self.nSupportChecks += 1
+            if self.tuple_is_valid(sups[i]):
+                if i == residue:
+                    self.nResidueHits += 1
+                else:
+                    self.residues[(var, val)] = i
+                return True
         return False
 
+    def support_count(self, var, val):
+        '''Return the number of tuples supporting var=val that are
+           valid in the current domains. Used for value ordering;
+           constraints that are not tables return 1 (no information)
+           unless they override this.
+
+           Binary tables count exactly with bit-masks. Larger tables
+           check every tuple, which is too slow to do at every decision
+           once var=val has more than max_support_scan supports (720 for
+           a row of a 7x7 grid); then only every k-th support is checked,
+           for about max_support_scan of them, and the count is scaled
+           up by k. TableConstraint and CompactTableConstraint count
+           their live tuples exactly.'''
+        if not self.tabular:
+            return 1
+        if self.is_binary_table():
+            i = self.var_index[var]
+            rows = self.binary_matrix()[i]
+            return bin(rows[var.value_index(val)] &
+                       self.scope[1 - i].cur_domain_mask()).count('1')
+        sups = self.relation.supports[self.var_index[var]].get(val, ())
+        step = 1 + (len(sups) - 1) // self.max_support_scan if sups else 1
+        n = 0
+        for j in range(0, len(sups), step):
+            if self.tuple_is_valid(sups[j]):
+                n += 1
+        return n * step
+
+    def clear_stats(self):
+        '''Reset the support check counters'''
+        self.nSupportChecks = 0
+        self.nResidueHits = 0
+
+    #True if gac_revise always reaches a fixpoint for this constraint on
+    #its own, so the GAC queue need not revise it again after it prunes
+    idempotent = False
+
+    #Supports of a value that support_count checks at most, sampling
+    #evenly beyond that
+    max_support_scan = 64
+
+    #True if the constraint is defined by its relation (check and
+    #has_support look at the tuples), so that binary instances can be
+    #filtered with bit-matrices instead
+    tabular = True
+
+    def is_binary_table(self):
+        '''True if the propagators may use the bit-matrix routines
+           binary_fc and binary_revise on this constraint'''
+        return self.tabular and len(self.scope) == 2
+
+    def binary_matrix(self):
+        '''The (rows0, rows1) bit-matrix of a binary table constraint
+           (see Relation.bit_matrix)'''
+        if self.matrix is None:
+            self.matrix = self.relation.bit_matrix(self.scope[0].dom, self.scope[1].dom)
+        return self.matrix
+
+    def binary_fc(self, trail, x):
+        '''Forward check a binary table constraint whose only unassigned
+           variable is x: prune the values of x not supported by the
+           value of the other variable. Returns False on a domain
+           wipe out.'''
+        i = self.var_index[x]
+        y = self.scope[1 - i]
+        row = self.binary_matrix()[1 - i][y.value_index(y.get_assigned_value())]
+        dead = x.cur_domain_mask() & ~row
+        while dead:
+            low = dead & -dead
+            trail.prune(x, x.dom[low.bit_length() - 1])
+            dead ^= low
+        return x.cur_domain_size() > 0
+
+    def binary_revise(self, trail):
+        '''gac_revise for binary table constraints: a value of one
+           variable is supported iff its row of the bit-matrix meets the
+           current domain mask of the other variable'''
+        changed = []
+        matrix = self.binary_matrix()
+        for i in (0, 1):
+            x = self.scope[i]
+            rows = matrix[i]
+            other = self.scope[1 - i].cur_domain_mask()
+            cur = x.cur_domain_mask()
+            dead = 0
+            m = cur
+            while m:
+                low = m & -m
+                if not rows[low.bit_length() - 1] & other:
+                    dead |= low
+                m ^= low
+            if dead:
+                if x.is_assigned():
+                    return False, changed
+                changed.append(x)
+                if dead == cur:
+                    return False, changed
+                while dead:
+                    low = dead & -dead
+                    trail.prune(x, x.dom[low.bit_length() - 1])
+                    dead ^= low
+        return True, changed
+
+    def gac_revise(self, trail):
+        '''Prune (through trail) every current domain value of a
+           variable in scope that has no support in this constraint.
+           Returns (False, changed) if a domain is wiped out (or an
+           assigned value has no support), otherwise (True, changed),
+           where changed is the list of variables whose current domains
+           shrank. Binary table constraints are revised with
+           binary_revise. Subclasses with their own filtering override
+           this.'''
+        if self.is_binary_table():
+            return self.binary_revise(trail)
+        changed = []
+        for var in self.scope:
+            pruned = False
+            for val in var.cur_domain():
+                trail.check_interrupt()
+                if not self.has_support(var, val):
+                    if var.is_assigned():
+                        return False, changed
+                    trail.prune(var, val)
+                    pruned = True
+            if pruned:
+                changed.append(var)
+                if var.cur_domain_size() == 0:
+                    return False, changed
+        return True, changed
+
     def tuple_is_valid(self, t):
         '''Internal routine. Check if every value in tuple is still in
            corresponding variable domains'''
@@ -295,6 +913,646 @@ class Constraint:
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
+class TableConstraint(Constraint):
+    '''A table constraint filtered by Simple Tabular Reduction (STR2).
+
+       Besides the dictionaries of Constraint, the satisfying tuples are
+       kept in the list 'table', and the tuples that are still valid
+       (every value in its variable's current domain) form a sparse set:
+       they are table[position[0]], ..., table[position[size-1]].
+       Filtering removes a tuple by swapping its position past the end
+       of the live part and decrementing size, so restoring the table
+       on backtrack is a single assignment to size.
+
+       last_size records the current domain size of each variable in
+       scope as of the previous filtering. Variables whose size is
+       unchanged are not rechecked against the tuples.
+       '''
+
+    #revising twice in a row never prunes anything the second time
+    idempotent = True
+
+    def __init__(self, name, scope, relation=None):
+        Constraint.__init__(self, name, scope, relation)
+        self.reset_table()
+
+    @classmethod
+    def from_constraint(cls, c):
+        '''Return a TableConstraint with the same name, scope and
+           satisfying tuples as Constraint c (sharing its relation)'''
+        return cls(c.name, c.scope, c.relation)
+
+    def add_satisfying_tuples(self, tuples):
+        '''We specify the constraint by adding its complete list of satisfying tuples.'''
+        Constraint.add_satisfying_tuples(self, tuples)
+        self.reset_table()
+
+    def reset_table(self):
+        '''Make every satisfying tuple live again'''
+        self.table = list(self.relation.tuples)
+        self.position = list(range(len(self.table)))
+        self.size = len(self.table)
+        self.last_size = [-1] * len(self.scope)
+
+    def restore_table(self, state):
+        '''Undo record: put back the size and last_size saved in state'''
+        self.size, self.last_size = state
+
+    def support_count(self, var, val):
+        '''Count the supports of var=val among the live tuples only'''
+        i = self.var_index[var]
+        n = 0
+        for k in range(self.size):
+            t = self.table[self.position[k]]
+            if t[i] == val and self.tuple_is_valid(t):
+                n += 1
+        return n
+
+    def gac_revise(self, trail):
+        '''STR2 filtering. Removes the tuples that are no longer valid
+           from the live part of the table, then prunes every value of an
+           unassigned variable that appears in no live tuple.'''
+        scope = self.scope
+        arity = len(scope)
+        sizes = [var.cur_domain_size() for var in scope]
+        last = self.last_size
+
+        #only variables whose domains changed need their values checked
+        s_val = [i for i in range(arity) if sizes[i] != last[i]]
+        #values of unassigned variables not yet seen in a live tuple
+        s_sup = [i for i in range(arity) if not scope[i].is_assigned()]
+        unsupported = [set(scope[i].cur_domain()) for i in range(arity)]
+
+        table = self.table
+        position = self.position
+        size = self.size
+        k = 0
+        while k < size:
+            #size - k drops by one every step
+            if not (size - k) & 1023:
+                trail.check_interrupt()
+            t = table[position[k]]
+            valid = True
+            for i in s_val:
+                if not scope[i].in_cur_domain(t[i]):
+                    valid = False
+                    break
+            if valid:
+                emptied = False
+                for i in s_sup:
+                    unsupported[i].discard(t[i])
+                    if not unsupported[i]:
+                        emptied = True
+                if emptied:
+                    s_sup = [i for i in s_sup if unsupported[i]]
+                k += 1
+            else:
+                size -= 1
+                position[k], position[size] = position[size], position[k]
+
+        changed = []
+        if size > 0:
+            for i in s_sup:
+                var = scope[i]
+                for val in unsupported[i]:
+                    trail.prune(var, val)
+                changed.append(var)
+            sizes = [var.cur_domain_size() for var in scope]
+
+        if size != self.size or sizes != last:
+            trail.push(self.restore_table, (self.size, last))
+            self.size = size
+            self.last_size = sizes
+        return size > 0, changed
+
+class CompactTableConstraint(Constraint):
+    '''A table constraint filtered by the Compact-Table algorithm.
+
+       The satisfying tuples are stored as the rows of 'tuples' (a NumPy
+       array when numpy is available, otherwise a list). The set of rows
+       that are still valid is the integer bitmask 'live', and for each
+       position i in scope supports[i][val] is the bitmask of rows with
+       val at position i. Filtering is then a few whole-mask AND/OR
+       operations rather than a loop over tuples, and restoring 'live'
+       on backtrack is a single assignment.
+
+       As in TableConstraint, last_size records the current domain sizes
+       seen by the previous filtering so unchanged variables are skipped.
+       '''
+
+    idempotent = True
+
+    def __init__(self, name, scope, relation=None):
+        Constraint.__init__(self, name, scope, relation)
+        self.build_supports()
+
+    @classmethod
+    def from_constraint(cls, c):
+        '''Return a CompactTableConstraint with the same name, scope and
+           satisfying tuples as Constraint c (sharing its relation)'''
+        return cls(c.name, c.scope, c.relation)
+
+    def add_satisfying_tuples(self, tuples):
+        '''We specify the constraint by adding its complete list of satisfying tuples.'''
+        Constraint.add_satisfying_tuples(self, tuples)
+        self.build_supports()
+
+    def build_supports(self):
+        '''Rebuild the tuple table and the support bitmasks from
+           relation, and make every tuple live again'''
+        self.supports = [dict() for var in self.scope]
+        if isinstance(self.relation, CompiledRelation):
+            #the relation's own array, so that its tuples are not built
+            rows = self.relation.table
+        else:
+            rows = list(self.relation.tuples)
+        nbytes = (len(rows) + 7) // 8
+        if isinstance(rows, list) and numpy is not None and \
+                all(type(v) is int for t in rows for v in t):
+            rows = numpy.array(rows, dtype=numpy.int64).reshape(len(rows), len(self.scope))
+        self.tuples = rows
+        if not isinstance(rows, list):
+            for i, var in enumerate(self.scope):
+                column = rows[:, i]
+                for val in numpy.unique(column):
+                    bits = numpy.packbits(column == val, bitorder='little')
+                    self.supports[i][int(val)] = int.from_bytes(bits.tobytes(), 'little')
+        else:
+            for i, var in enumerate(self.scope):
+                bits = dict()
+                for k, t in enumerate(rows):
+                    if not t[i] in bits:
+                        bits[t[i]] = bytearray(nbytes)
+                    bits[t[i]][k >> 3] |= 1 << (k & 7)
+                for val in bits:
+                    self.supports[i][val] = int.from_bytes(bits[val], 'little')
+        self.live = (1 << len(rows)) - 1
+        self.last_size = [-1] * len(self.scope)
+
+    def restore_live(self, state):
+        '''Undo record: put back the live mask and last_size saved in state'''
+        self.live, self.last_size = state
+
+    def support_count(self, var, val):
+        '''The number of live tuples with val at the position of var'''
+        sup = self.supports[self.var_index[var]].get(val, 0)
+        return bin(self.live & sup).count('1')
+
+    def gac_revise(self, trail):
+        '''Compact-Table filtering. Intersects the live mask with the
+           supports of the current domains of the variables that changed,
+           then prunes every value of an unassigned variable whose support
+           mask no longer meets the live mask.'''
+        scope = self.scope
+        sizes = [var.cur_domain_size() for var in scope]
+        last = self.last_size
+        delta = [i for i in range(len(scope)) if sizes[i] != last[i]]
+
+        live = self.live
+        for i in delta:
+            sup = self.supports[i]
+            mask = 0
+            for val in scope[i].cur_domain():
+                mask |= sup.get(val, 0)
+            live &= mask
+            if not live:
+                break
+
+        changed = []
+        if live and (live != self.live or -1 in last):
+            for i, var in enumerate(scope):
+                if var.is_assigned() or (delta == [i] and not -1 in last):
+                    continue
+                sup = self.supports[i]
+                pruned = False
+                for val in var.cur_domain():
+                    if not sup.get(val, 0) & live:
+                        trail.prune(var, val)
+                        pruned = True
+                if pruned:
+                    changed.append(var)
+            sizes = [var.cur_domain_size() for var in scope]
+
+        if live != self.live or sizes != last:
+            trail.push(self.restore_live, (self.live, last))
+            self.live = live
+            self.last_size = sizes
+        return live != 0, changed
+
+class AllDiffConstraint(Constraint):
+    '''All-different constraint over its scope, represented by a function
+       rather than a table of satisfying tuples.
+
+       filtering selects what gac_revise does:
+         'gac' -- Regin's algorithm: find a maximum matching between the
+                  variables and their values, and prune every value that
+                  belongs to no maximum matching.
+         'fc'  -- forward checking only: prune the value of every assigned
+                  variable from the other variables of the scope.
+
+       check and has_support are implemented directly (has_support by
+       finding a matching with var=val), so prop_FC and prop_GAC work
+       with this constraint too.
+       '''
+
+    idempotent = True
+    tabular = False
+
+    def __init__(self, name, scope, filtering='gac'):
+        Constraint.__init__(self, name, scope)
+        self.filtering = filtering
+        #matching from the previous call, used as a starting point. It is
+        #only a hint, so it is never restored on backtrack.
+        self.match = dict()
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: AllDiffConstraint", self, "does not take satisfying tuples")
+
+    def compiled_args(self):
+        return [self.filtering]
+
+    def check(self, vals):
+        return len(set(vals)) == len(vals)
+
+    def has_support(self, var, val):
+        '''var=val has a support iff the other variables can take
+           distinct values from their current domains without val'''
+        if not var.in_cur_domain(val):
+            return False
+        doms = []
+        for x in self.scope:
+            if x is var:
+                doms.append([val])
+            else:
+                doms.append([d for d in x.cur_domain() if d != val])
+        match, size = self.max_matching(doms, dict())
+        return size == len(self.scope)
+
+    def support_count(self, var, val):
+        '''An estimate rather than the exact count: the product of the
+           current domain sizes of the other variables once val is
+           removed from them'''
+        if not var.in_cur_domain(val):
+            return 0
+        n = 1
+        for x in self.scope:
+            if x is not var:
+                n *= x.cur_domain_size() - (1 if x.in_cur_domain(val) else 0)
+        return n
+
+    def max_matching(self, doms, hint):
+        '''Maximum matching of positions i to values in doms[i], grown by
+           augmenting paths from the matching hint (position -> value).
+           Returns (position -> value, value -> position) and its size.'''
+        val_to_pos = dict()
+        pos_to_val = dict()
+        for i, d in enumerate(doms):
+            val = hint.get(i)
+            if val is not None and val in d and val not in val_to_pos:
+                pos_to_val[i] = val
+                val_to_pos[val] = i
+
+        def augment(i, seen):
+            for val in doms[i]:
+                if val in seen:
+                    continue
+                seen.add(val)
+                j = val_to_pos.get(val)
+                if j is None or augment(j, seen):
+                    pos_to_val[i] = val
+                    val_to_pos[val] = i
+                    return True
+            return False
+
+        for i in range(len(doms)):
+            if not i in pos_to_val:
+                augment(i, set())
+        return (pos_to_val, val_to_pos), len(pos_to_val)
+
+    def gac_revise(self, trail):
+        if self.filtering == 'fc':
+            return self.fc_revise(trail)
+        return self.regin_revise(trail)
+
+    def fc_revise(self, trail):
+        '''Prune the values of assigned variables from the unassigned
+           ones. Fails if two variables are assigned the same value.'''
+        used = set()
+        for x in self.scope:
+            if x.is_assigned():
+                val = x.get_assigned_value()
+                if val in used:
+                    return False, []
+                used.add(val)
+        changed = []
+        for x in self.scope:
+            if not x.is_assigned():
+                pruned = False
+                for val in x.cur_domain():
+                    if val in used:
+                        trail.prune(x, val)
+                        pruned = True
+                if pruned:
+                    changed.append(x)
+                    if x.cur_domain_size() == 0:
+                        return False, changed
+        return True, changed
+
+    def regin_revise(self, trail):
+        '''Regin's filtering. With a maximum matching M, orient matched
+           edges variable -> value and the others value -> variable. An
+           unmatched edge belongs to some maximum matching iff its value
+           end can be reached from a free value, or both its ends lie in
+           the same strongly connected component. Every other edge is
+           pruned.'''
+        scope = self.scope
+        n = len(scope)
+        doms = [x.cur_domain() for x in scope]
+        (pos_to_val, val_to_pos), size = self.max_matching(doms, self.match)
+        self.match = pos_to_val
+        if size < n:
+            return False, []
+
+        #nodes 0..n-1 are the positions in scope, n.. are the values
+        values = list(set(val for d in doms for val in d))
+        node = dict((val, n + j) for j, val in enumerate(values))
+        succ = [[] for k in range(n + len(values))]
+        for i, d in enumerate(doms):
+            succ[i].append(node[pos_to_val[i]])
+            for val in d:
+                if val != pos_to_val[i]:
+                    succ[node[val]].append(i)
+
+        #nodes reachable from the free (unmatched) values
+        reached = [False] * len(succ)
+        stack = [node[val] for val in values if not val in val_to_pos]
+        for k in stack:
+            reached[k] = True
+        while stack:
+            k = stack.pop()
+            for k2 in succ[k]:
+                if not reached[k2]:
+                    reached[k2] = True
+                    stack.append(k2)
+
+        comp = strongly_connected(succ)
+        changed = []
+        for i, x in enumerate(scope):
+            if x.is_assigned():
+                continue
+            pruned = False
+            for val in doms[i]:
+                k = node[val]
+                if val != pos_to_val[i] and not reached[k] and comp[k] != comp[i]:
+                    trail.prune(x, val)
+                    pruned = True
+            if pruned:
+                changed.append(x)
+        return True, changed
+
+def strongly_connected(succ):
+    '''Tarjan's algorithm without recursion. succ[k] lists the successors
+       of node k. Returns a list giving the component number of each node.'''
+    index = [None] * len(succ)
+    low = [0] * len(succ)
+    comp = [None] * len(succ)
+    on_stack = [False] * len(succ)
+    stack = []
+    counter = 0
+    ncomp = 0
+    for root in range(len(succ)):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            k, j = work.pop()
+            if j == 0:
+                index[k] = low[k] = counter
+                counter += 1
+                stack.append(k)
+                on_stack[k] = True
+            if j < len(succ[k]):
+                work.append((k, j + 1))
+                k2 = succ[k][j]
+                if index[k2] is None:
+                    work.append((k2, 0))
+                elif on_stack[k2]:
+                    low[k] = min(low[k], index[k2])
+                continue
+            if low[k] == index[k]:
+                while True:
+                    k2 = stack.pop()
+                    on_stack[k2] = False
+                    comp[k2] = ncomp
+                    if k2 == k:
+                        break
+                ncomp += 1
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[k])
+    return comp
+
+class NogoodConstraint(Constraint):
+    '''Forbids one combination of values: the variables in scope may not
+       all take the corresponding values in 'values' at once. Nogoods
+       are learned during search (see BT.solve_restarts) and stored as
+       a tuple rather than a table of every other combination.
+
+       gac_revise prunes the forbidden value of the one variable left
+       when every other variable can only take its forbidden value.
+       '''
+
+    idempotent = True
+    tabular = False
+
+    def __init__(self, name, scope, values):
+        Constraint.__init__(self, name, scope)
+        self.values = tuple(values)
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: NogoodConstraint", self, "does not take satisfying tuples")
+
+    def compiled_args(self):
+        return [list(self.values)]
+
+    def check(self, vals):
+        return tuple(vals) != self.values
+
+    def fixed(self, i):
+        '''True if scope[i] can take no value but values[i]'''
+        var = self.scope[i]
+        return var.cur_domain_size() == 1 and var.in_cur_domain(self.values[i])
+
+    def has_support(self, var, val):
+        if not var.in_cur_domain(val):
+            return False
+        i = self.var_index[var]
+        if val != self.values[i]:
+            return True
+        for j in range(len(self.scope)):
+            if j != i and not self.fixed(j):
+                return True
+        return False
+
+    def gac_revise(self, trail):
+        free = None
+        for i in range(len(self.scope)):
+            if not self.fixed(i):
+                if free is not None:
+                    return True, []     #two variables can avoid the nogood
+                free = i
+        if free is None:
+            return False, []
+        var = self.scope[free]
+        if var.in_cur_domain(self.values[free]):
+            trail.prune(var, self.values[free])
+            return True, [var]
+        return True, []
+
+def luby(i):
+    '''The i-th term (i >= 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4,
+       1, 1, 2, 1, 1, 2, 4, 8, ... used as a restart schedule'''
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while True:
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+
+class SearchInterrupted(Exception):
+    '''Raised by Trail.check_interrupt, inside a propagator, when the
+       search running it has to stop. reason is 'limit' (the time limit
+       has passed) or 'cancelled'.'''
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+class Trail:
+    '''Solver-wide undo stack used to restore state on backtracking.
+
+       Every change that has to be undone when search backtracks is
+       pushed onto the trail as an undo record: a function and the
+       argument to call it with. Pruning a value through the trail
+       pushes the matching unprune_value call.
+
+       Search takes a checkpoint (the current height of the trail)
+       before it makes an assignment, and rolls back to that
+       checkpoint when it undoes the assignment. Pushing a record is
+       O(1), and rolling back costs one call per record popped.
+
+       For conflict-directed backjumping (BT.solve_cbj) the trail can
+       also explain its prunings. Decision levels are numbered from 1
+       and sets of levels are int bitmasks. While 'explain' is True,
+       'level' maps each assigned variable to its decision level, and
+       every pruning of var is explained by the levels of the
+       assignments that caused it. 'expl' maps var to the union of the
+       explanations of its pruned values. The propagators set 'cause' to
+       the constraint they are revising, and a pruning by constraint c
+       is explained by the levels of the assigned variables of c plus
+       the explanations of its other variables (see explain_by).
+
+       A search with a time limit or cancel token sets 'interrupt' to a
+       function returning why the search must stop ('limit' or
+       'cancelled'), or None. Propagators call check_interrupt while
+       filtering, so that a long propagation does not overrun the limit.
+       '''
+
+    def __init__(self):
+        self.undo = []          #stack of (function, argument) undo records
+        self.nPrunings = 0      #number of prunings recorded on the trail
+        self.explain = False    #keep explanations of prunings
+        self.cause = None       #constraint currently pruning values
+        self.level = dict()     #assigned variable -> decision level
+        self.levels = 0         #bitmask of the levels in use
+        self.expl = dict()      #variable -> explanation of its prunings
+        self.interrupt = None   #tells the propagators to stop (see check_interrupt)
+
+    def check_interrupt(self):
+        '''Raise SearchInterrupted if interrupt says the search has to
+           stop. The search that set interrupt catches it and rolls back
+           whatever the propagator had done.'''
+        if self.interrupt is not None:
+            reason = self.interrupt()
+            if reason is not None:
+                raise SearchInterrupted(reason)
+
+    def checkpoint(self):
+        '''Return a marker for the current state of the trail'''
+        return len(self.undo)
+
+    def rollback(self, mark):
+        '''Undo every record pushed since checkpoint mark was taken'''
+        undo = self.undo
+        while len(undo) > mark:
+            fn, arg = undo.pop()
+            fn(arg)
+
+    def push(self, fn, arg):
+        '''Push an undo record: fn(arg) is called on rollback'''
+        self.undo.append((fn, arg))
+
+    def prune(self, var, val, reason=None):
+        '''Prune val from the current domain of var and record it. When
+           explaining, reason is the bitmask of decision levels that
+           caused the pruning; by default it is explain_by(cause, var).'''
+        var.prune_value(val)
+        self.undo.append((var.unprune_value, val))
+        self.nPrunings += 1
+        if self.explain:
+            if reason is None:
+                reason = self.explain_by(self.cause, var)
+            self.add_explanation(var, reason)
+
+    def record_prunings(self, prunings):
+        '''Record a list of (Variable, value) pairs that have already been
+           pruned by the caller (the old propagator contract). Nothing is
+           known about their causes, so when explaining they are blamed
+           on every level.'''
+        for var, val in prunings:
+            self.undo.append((var.unprune_value, val))
+            if self.explain:
+                self.add_explanation(var, self.levels)
+        self.nPrunings += len(prunings)
+
+    def explain_by(self, c, var=None):
+        '''Return the explanation of constraint c pruning a value of var,
+           or (with var None) of c failing: the levels of the assigned
+           variables of c and the explanations of its other variables.
+           With no constraint every level is blamed.'''
+        if c is None:
+            return self.levels
+        mask = 0
+        for x in c.scope:
+            if x is var:
+                continue
+            if x in self.level:
+                mask |= 1 << self.level[x]
+            else:
+                mask |= self.expl.get(x, 0)
+        return mask
+
+    def add_explanation(self, var, reason):
+        old = self.expl.get(var, 0)
+        if reason & ~old:
+            self.expl[var] = old | reason
+            self.undo.append((self.restore_explanation, (var, old)))
+
+    def restore_explanation(self, state):
+        '''Undo record: put back the explanation of a variable'''
+        var, old = state
+        self.expl[var] = old
+
+    def prunings(self, mark=0):
+        '''return list of (Variable, value) pairs pruned since checkpoint
+           mark (used for tracing)'''
+        return [(fn.__self__, arg) for fn, arg in self.undo[mark:]
+                if isinstance(getattr(fn, '__self__', None), Variable)]
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
@@ -309,13 +1567,25 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        self.trail = Trail()    #undo stack shared by the solver and propagators
+        #objects told of every conflict: listener.weight_changed(c)
+        self.conflict_listeners = []
+        #incremented whenever the set of constraints changes, so that
+        #indexes built over the constraints can tell they are stale
+        self.cons_version = 0
+        #constraints that the propagator of the current search filters
+        #in place of the CSP's own (see view), or None. Reset by
+        #BT.propagate at the root of every search.
+        self.views = None
+        #views kept by the propagators between searches, by propagator
+        self.view_cache = dict()
         for v in vars:
             self.add_var(v)
 
     def add_var(self,v):
         '''Add variable object to CSP while setting up an index
            to obtain the constraints over this variable'''
-        if not type(v) is Variable:
+        if not isinstance(v, Variable):
             print("Trying to add non variable ", v, " to CSP object")
         elif v in self.vars_to_cons:
             print("Trying to add variable ", v, " to CSP object that already has it")
@@ -326,7 +1596,7 @@ class CSP:
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -335,6 +1605,51 @@ class CSP:
                     return
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
+            self.cons_version += 1
+
+    def remove_constraint(self, c):
+        '''Remove constraint c from the CSP'''
+        if not c in self.cons:
+            print("Trying to remove constraint ", c, " that is not in CSP object")
+            return
+        self.cons.remove(c)
+        for v in c.scope:
+            self.vars_to_cons[v].remove(c)
+        self.cons_version += 1
+
+    def convert_constraints(self, convert):
+        '''Replace every constraint c of the CSP by convert(c), which must
+           have the same scope. convert may return c itself to keep it.
+           This changes the model, so references to the old constraints
+           held elsewhere go stale; use it when building a model. The
+           propagators use views instead (see view).'''
+        converted = dict()
+        changed = False
+        for i, c in enumerate(self.cons):
+            converted[c] = convert(c)
+            self.cons[i] = converted[c]
+            changed = changed or converted[c] is not c
+        for v in self.vars_to_cons:
+            self.vars_to_cons[v] = [converted[c] for c in self.vars_to_cons[v]]
+        if changed:
+            self.cons_version += 1
+
+    def view(self, c):
+        '''The constraint that the propagator of the current search uses
+           to filter constraint c of the CSP: c itself unless the
+           propagator keeps its own version of c (as prop_STR2 and
+           prop_CT do for table constraints) in views'''
+        if self.views is None:
+            return c
+        return self.views.get(c, c)
+
+    def record_conflict(self, c):
+        '''Called by the propagators when constraint c wipes out a
+           domain (or is violated): increase the weight of c and tell
+           the conflict listeners'''
+        c.weight += 1
+        for listener in self.conflict_listeners:
+            listener.weight_changed(c)
 
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
@@ -364,10 +1679,154 @@ class CSP:
             print(v, " = ", v.get_assigned_value(), "    ", end='')
         print("")
 
+    def save_compiled(self, path):
+        '''Save the variables and constraints of the CSP (not its current
+           domains or assignments) in directory path, to be loaded with
+           CSP.load_compiled. Variables are numbered by their position in
+           the CSP. Every relation of the table constraints is saved once,
+           however many constraints share it, as .npy arrays (see
+           CompiledRelation); everything else goes in csp.json. Needs
+           numpy; relations must be over integers, every other
+           constraint must implement compiled_args, and the classes of
+           the variables and constraints must be in COMPILED_CLASSES.
+           Returns True if the CSP was saved.'''
+        if numpy is None:
+            print("ERROR: save_compiled needs numpy")
+            return False
+
+        var_ids = dict((v, i) for i, v in enumerate(self.vars))
+        rel_ids = dict()
+        relations = []
+        cons = []
+        for v in self.vars:
+            if class_path(v) not in COMPILED_CLASSES:
+                print("ERROR: variable", v, "can not be saved:", class_path(v),
+                      "is not in COMPILED_CLASSES")
+                return False
+        for c in self.cons:
+            args = c.compiled_args()
+            if args is None or class_path(c) not in COMPILED_CLASSES:
+                print("ERROR: constraint", c, "can not be saved")
+                return False
+            entry = dict(cls=class_path(c), name=c.name,
+                         scope=[var_ids[v] for v in c.scope], args=args)
+            if c.tabular:
+                if id(c.relation) not in rel_ids:
+                    arrays = CompiledRelation.from_relation(c.relation)
+                    if arrays is None:
+                        print("ERROR: relation of constraint", c, "is not over integers")
+                        return False
+                    rel_ids[id(c.relation)] = len(relations)
+                    relations.append(arrays)
+                entry['relation'] = rel_ids[id(c.relation)]
+            cons.append(entry)
+
+        meta = dict(format=1, name=self.name,
+                    vars=[dict(cls=class_path(v), name=v.name, domain=v.domain())
+                          for v in self.vars],
+                    cons=cons,
+                    relations=[dict(lo=lo) for table, order, index, lo in relations])
+
+        os.makedirs(path, exist_ok=True)
+        for k, (table, order, index, lo) in enumerate(relations):
+            for part, array in (('table', table), ('order', order), ('index', index)):
+                numpy.save(os.path.join(path, "r{}.{}.npy".format(k, part)), array)
+        #write the metadata last, and by renaming, so that a directory
+        #with a csp.json is always complete
+        tmp = os.path.join(path, "csp.json.{}.tmp".format(os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "csp.json"))
+        return True
+
+    @staticmethod
+    def load_compiled(path, mmap=True):
+        '''Return the CSP saved in directory path by save_compiled, or
+           None if it can not be read. The relations are CompiledRelations
+           over the saved arrays, memory-mapped read only (unless mmap is
+           False), so they are not copied into this process and every
+           process that loads them shares one copy in the page cache.'''
+        if numpy is None:
+            print("ERROR: load_compiled needs numpy")
+            return None
+        try:
+            with open(os.path.join(path, "csp.json")) as f:
+                meta = json.load(f)
+            relations = []
+            for k, info in enumerate(meta['relations']):
+                arrays = [numpy.load(os.path.join(path, "r{}.{}.npy".format(k, part)),
+                                     mmap_mode='r' if mmap else None)
+                          for part in ('table', 'order', 'index')]
+                relations.append(CompiledRelation(*arrays, lo=info['lo']))
+
+            csp = CSP(meta['name'])
+            for info in meta['vars']:
+                csp.add_var(load_class(info['cls'])(info['name'], info['domain']))
+            for info in meta['cons']:
+                scope = [csp.vars[i] for i in info['scope']]
+                cls = load_class(info['cls'])
+                if 'relation' in info:
+                    c = cls(info['name'], scope, relations[info['relation']])
+                else:
+                    c = cls(info['name'], scope, *info['args'])
+                csp.add_constraint(c)
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            print("ERROR: can not load compiled CSP from", path, ":", e)
+            return None
+        return csp
+
+#The classes, by class_path, that CSP.save_compiled may save and
+#CSP.load_compiled may create. A compiled CSP names the classes of its
+#variables and constraints, so only these are imported; add the path of
+#any other class that should be saved.
+COMPILED_CLASSES = {
+    'cspbase:Variable', 'cspbase:BitVariable',
+    'cspbase:Constraint', 'cspbase:TableConstraint', 'cspbase:CompactTableConstraint',
+    'cspbase:AllDiffConstraint', 'cspbase:NogoodConstraint',
+    'kenken_csp:SumConstraint', 'kenken_csp:ProductConstraint',
+    'kenken_csp:DiffConstraint', 'kenken_csp:QuotientConstraint',
+}
+
+def class_path(obj):
+    '''"module:class" of obj, for CSP.save_compiled'''
+    cls = type(obj)
+    return "{}:{}".format(cls.__module__, cls.__qualname__)
+
+def load_class(path):
+    '''The class named by class_path, which must be in COMPILED_CLASSES
+       (ValueError otherwise)'''
+    if path not in COMPILED_CLASSES:
+        raise ValueError("{} is not in COMPILED_CLASSES".format(path))
+    module, name = path.split(':')
+    return getattr(importlib.import_module(module), name)
+
 ########################################################
 # Backtracking Routine                                 #
 ########################################################
 
+class SearchOutcome:
+    '''The result of BT.solve (and bt_search).
+
+       status is 'solved', 'unsat' (the search space was exhausted),
+       'limit' (a node, decision or time limit was reached) or
+       'cancelled'. solution is the {Variable: value} dict found, or
+       None. nDecisions, nNodes and nPrunings are the statistics of the
+       search so far and elapsed its wall clock time in seconds.
+       nRestarts is set by BT.solve_restarts.'''
+
+    def __init__(self, status, solution, bt, elapsed):
+        self.status = status
+        self.solution = solution
+        self.nDecisions = bt.nDecisions
+        self.nNodes = bt.nNodes
+        self.nPrunings = bt.nPrunings
+        self.elapsed = elapsed
+        self.nRestarts = 0
+
+    def __str__(self):
+        return "{} after {} decisions, {} nodes, {} prunings, {:.3f}s".format(
+            self.status, self.nDecisions, self.nNodes, self.nPrunings, self.elapsed)
+
 class BT:
     '''use a class to encapsulate things like statistics
        and bookeeping for pruning/unpruning variabel domains
@@ -381,9 +1840,14 @@ class BT:
         '''csp == CSP object specifying the CSP to be solved'''
 
         self.csp = csp
+        self.trail = csp.trail
         self.nDecisions = 0 #nDecisions is the number of variable 
                             #assignments made during search
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
+        self.nSolutions = 0 #number of solutions found by the current search
+        self.nNodes = 0     #number of variables branched on
+        self.nRestarts = 0  #restarts made by solve_restarts
+        self.stop_reason = None #why the last search stopped early (see solutions)
         unasgn_vars = list() #used to track unassigned variables
         self.TRACE = False
         self.runtime = 0
@@ -401,6 +1865,8 @@ class BT:
         '''Initialize counters'''
         self.nDecisions = 0
         self.nPrunings = 0
+        self.nSolutions = 0
+        self.nNodes = 0
         self.runtime = 0
 
     def print_stats(self):
@@ -413,18 +1879,67 @@ class BT:
         for var, val in prunings:
             var.unprune_value(val)
 
+    def propagate(self, propagator, var=None):
+        '''Run the propagator (after var has been assigned, or at the
+           root when var is None) and return its status. Prunings the
+           propagator returns under the old (status, prunings) contract
+           are recorded on the trail so that rollback undoes them too.'''
+        n = self.trail.nPrunings
+        self.trail.cause = None
+        try:
+            if var is None:
+                self.csp.views = None
+                status, prunings = propagator(self.csp)
+            else:
+                status, prunings = propagator(self.csp, var)
+            self.trail.record_prunings(prunings)
+        finally:
+            self.nPrunings = self.nPrunings + self.trail.nPrunings - n
+        return status
+
+    def interrupt_check(self, deadline, cancel):
+        '''Return the function a search with a deadline (a
+           time.perf_counter() value, or None) and cancel token (or
+           None) puts in Trail.interrupt: it returns 'limit' once the
+           deadline has passed, 'cancelled' once cancel is set, and
+           otherwise None. Returns None if there is neither.'''
+        if deadline is None and cancel is None:
+            return None
+        def interrupt():
+            if deadline is not None and time.perf_counter() > deadline:
+                return 'limit'
+            if cancel is not None and cancel.is_set():
+                return 'cancelled'
+            return None
+        return interrupt
+
     def restore_all_variable_domains(self):
-        '''Reinitialize all variable domains'''
+        '''Reinitialize all variable domains, undoing everything left
+           on the trail'''
+        self.trail.rollback(0)
         for var in self.csp.vars:
             if var.is_assigned():
                 var.unassign()
             var.restore_curdom()
 
+    def restrict_domains(self, domains):
+        '''Prune (through the trail) every value of a variable that is
+           not in its bitmask in domains (see solutions). Returns False
+           if a domain is left empty.'''
+        for var, mask in zip(self.csp.vars, domains):
+            for i, val in enumerate(var.dom):
+                if not mask >> i & 1 and var.in_cur_domain(val):
+                    self.trail.prune(var, val)
+            if var.cur_domain_size() == 0:
+                return False
+        return True
+
     def restoreUnasgnVar(self, var):
         '''Add variable back to list of unassigned vars'''
         self.unasgn_vars.append(var)
         
-    def bt_search(self,propagator,var_ord=None,val_ord=None):
+    def bt_search(self,propagator,var_ord=None,val_ord=None,*,node_limit=None,
+                  decision_limit=None,time_limit=None,cancel=None):
         '''Try to solve the CSP using specified propagator routine
 
            propagator == a function with the following template
@@ -448,103 +1963,541 @@ class BT:
              in this case bt_search will backtrack
            return is true if we can continue.
 
-           The list of variable values pairs are all of the values
-           the propagator pruned (using the variable's prune_value method). 
-           bt_search NEEDS to know this in order to correctly restore these 
-           values when it undoes a variable assignment.
+           The propagator should prune values through the CSP's trail
+           (csp.trail.prune(var, val)), which records them so bt_search
+           can restore them when it undoes a variable assignment. In
+           that case the returned list is empty.
+
+           Propagators may instead prune values themselves (using the
+           variable's prune_value method) and return them in the list;
+           bt_search then records them on the trail. A pruning must not
+           be both made through the trail and returned.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
            pruned! Nor should it prune a value twice
 
            var_ord is the variable ordering function currently being used; 
            val_ord is the value ordering function currently being used.
-           '''
-
-        self.clear_stats()
-        stime = time.process_time()
-
-        self.restore_all_variable_domains()
-        
-        self.unasgn_vars = []
-        for v in self.csp.vars:
-            if not v.is_assigned():
-                self.unasgn_vars.append(v)
 
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
+           node_limit, decision_limit, time_limit (seconds of wall clock
+           time) and cancel (any object with an is_set() method, e.g. a
+           threading.Event) bound the search; see solve.
 
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
+           The search itself is done by solve; this routine prints its
+           result and returns its SearchOutcome. If a solution is found
+           the variables are left assigned to it.
+           '''
 
-        if status == False:
-            print("CSP{} detected contradiction at root".format(
-                self.csp.name))
-        else:
-            status = self.bt_recurse(propagator, var_ord, val_ord, 1)   #now do recursive search
+        outcome = self.solve(propagator, var_ord, val_ord, node_limit=node_limit,
+                             decision_limit=decision_limit, time_limit=time_limit,
+                             cancel=cancel)
 
-        self.restoreValues(prunings)
-        if status == False:
+        if outcome.status == 'unsat':
             print("CSP{} unsolved. Has no solutions".format(self.csp.name))
-        if status == True:
+        elif outcome.status == 'solved':
             print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
+                                                             self.runtime))
             self.csp.print_soln()
+        else:
+            print("CSP{} search stopped ({}) after {:.3f}s".format(
+                self.csp.name, outcome.status, outcome.elapsed))
 
         print("bt_search finished")
         self.print_stats()
+        return outcome
+
+    def solve(self, propagator, var_ord=None, val_ord=None, *, node_limit=None,
+              decision_limit=None, time_limit=None, cancel=None, nogoods=None,
+              domains=None):
+        '''Search for the first solution, printing nothing, and return a
+           SearchOutcome. The search gives up once it has branched on
+           node_limit variables, made decision_limit assignments, run
+           for time_limit seconds of wall clock time, or been cancelled
+           (cancel.is_set() returns True; checked before every decision),
+           whichever comes first. If a solution is found the variables
+           are left assigned to it. nogoods and domains are passed on to
+           solutions.'''
+
+        stime = time.perf_counter()
+        search = self.solutions(propagator, var_ord, val_ord, limit=1,
+                                node_limit=node_limit, decision_limit=decision_limit,
+                                time_limit=time_limit, cancel=cancel,
+                                nogoods=nogoods, domains=domains)
+        solution = next(search, None)
+        search.close()
+
+        if solution is not None:
+            for var, val in solution.items():
+                var.assign(val)
+            status = 'solved'
+        elif self.stop_reason is not None:
+            status = self.stop_reason
+        else:
+            status = 'unsat'
+        return SearchOutcome(status, solution, self, time.perf_counter() - stime)
+
+    def solutions(self, propagator, var_ord=None, val_ord=None, *, limit=None,
+                  node_limit=None, decision_limit=None, time_limit=None,
+                  cancel=None, nogoods=None, domains=None):
+        '''Generator of the solutions of the CSP, each one a dict mapping
+           every Variable to its value. propagator, var_ord and val_ord
+           are as for bt_search. At most limit solutions are produced
+           (all of them if limit is None), so
+
+               next(bt.solutions(prop), None)          first solution
+               list(bt.solutions(prop, limit=k))       first k solutions
+               bt.count_solutions(prop)                count them all
+
+           The search keeps an explicit stack of choice points instead of
+           recursing, so it is not limited by Python's recursion depth,
+           and prints nothing. Statistics accumulate in nDecisions,
+           nNodes (variables branched on), nPrunings and nSolutions while
+           it runs. When the generator is exhausted or closed every
+           assignment and pruning it made is undone.
+
+           The search also stops once it has branched on node_limit
+           variables, made decision_limit assignments, or time_limit
+           seconds of wall clock time have passed since it started
+           (including time spent by the caller between solutions).
+           stop_reason is then 'limit'. cancel is an object with an
+           is_set() method, checked before every decision; when it
+           returns True the search stops with stop_reason 'cancelled'.
+           stop_reason is None if the search ended by itself. The time
+           limit and cancel are also checked while the propagator runs
+           (see Trail.check_interrupt), at the root as well, so a long
+           propagation is cut short rather than finished first.
+
+           If nogoods is a list and a limit or cancellation stops the
+           search before any solution is found, the branches refuted so
+           far are appended to it as nogoods: lists of (Variable, value)
+           pairs that no solution contains, namely the decisions leading
+           to a choice point plus one value refuted there.
+
+           domains, if given, restricts the search to a subproblem: it is
+           a list with the current domain of each variable of the CSP, in
+           order, as a bitmask (see Variable.cur_domain_mask), and values
+           outside it are pruned before the search starts.
+           '''
 
-    def bt_recurse(self, propagator, var_ord, val_ord, level):
-        '''Return true if found solution. False if still need to search.
-           If top level returns false--> no solution'''
+        self.clear_stats()
+        stime = time.process_time()
+        deadline = None
+        if time_limit is not None:
+            deadline = time.perf_counter() + time_limit
+        self.stop_reason = None
+        self.restore_all_variable_domains()
+        trail = self.trail
+        interrupt = trail.interrupt
 
-        if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
-        if not self.unasgn_vars:
-            #all variables assigned
-            return True
-        else:
-            ##Figure out which variable to assign,
-            ##Then remove it from the list of unassigned vars
-            if var_ord:
-              var = var_ord(self.csp)
-            else:
-              var = self.unasgn_vars[0]
-            self.unasgn_vars.remove(var) 
+        self.unasgn_vars = []
+        for v in self.csp.vars:
+            if not v.is_assigned():
+                self.unasgn_vars.append(v)
 
+        #each choice point is [var, iterator over the values left to
+        #try, trail mark taken before var was assigned (None when var
+        #is not assigned), values of var refuted so far]
+        stack = []
+        root = trail.checkpoint()
+        try:
+            trail.interrupt = self.interrupt_check(deadline, cancel)
+            if domains is not None and not self.restrict_domains(domains):
+                return
+            try:
+                status = self.propagate(propagator) #initial propagate no assigned variables.
+            except SearchInterrupted as e:
+                self.stop_reason = e.reason
+                return
             if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
-
-            if val_ord:
-              value_order = val_ord(self.csp,var)
-            else:
-              value_order = var.cur_domain()
+                print(len(self.unasgn_vars), " unassigned variables at start of search")
+                print("Root Prunings: ", trail.prunings(root))
+            if not status:
+                return
+
+            descend = True
+            while True:
+                if descend:
+                    if not self.unasgn_vars:
+                        #all variables assigned
+                        self.nSolutions += 1
+                        yield dict((v, v.get_assigned_value()) for v in self.csp.vars)
+                        if limit is not None and self.nSolutions >= limit:
+                            return
+                    else:
+                        if node_limit is not None and self.nNodes >= node_limit:
+                            self.stop_reason = 'limit'
+                            self.record_nogoods(stack, nogoods)
+                            return
+                        self.nNodes += 1
+                        ##Figure out which variable to assign,
+                        ##Then remove it from the list of unassigned vars
+                        if var_ord:
+                            var = var_ord(self.csp)
+                        else:
+                            var = self.unasgn_vars[0]
+                        self.unasgn_vars.remove(var)
+                        if val_ord:
+                            value_order = val_ord(self.csp, var)
+                        else:
+                            value_order = var.cur_domain()
+                        if self.TRACE:
+                            print('  ' * len(stack), "search var = ", var)
+                        stack.append([var, iter(value_order), None, []])
+
+                if not stack:
+                    return
+                point = stack[-1]
+                var = point[0]
+                if point[2] is not None:
+                    #undo the previous value of var
+                    point[3].append(var.get_assigned_value())
+                    trail.rollback(point[2])
+                    var.unassign()
+                    point[2] = None
+
+                descend = False
+                for val in point[1]:
+                    if ((decision_limit is not None and self.nDecisions >= decision_limit) or
+                            (time_limit is not None and time.perf_counter() > deadline)):
+                        self.stop_reason = 'limit'
+                        self.record_nogoods(stack, nogoods)
+                        return
+                    if cancel is not None and cancel.is_set():
+                        self.stop_reason = 'cancelled'
+                        self.record_nogoods(stack, nogoods)
+                        return
+                    mark = trail.checkpoint()
+                    var.assign(val)
+                    self.nDecisions = self.nDecisions+1
+                    try:
+                        status = self.propagate(propagator, var)
+                    except SearchInterrupted as e:
+                        #val is not refuted: undo it before recording nogoods
+                        self.stop_reason = e.reason
+                        trail.rollback(mark)
+                        var.unassign()
+                        self.record_nogoods(stack, nogoods)
+                        return
+                    if self.TRACE:
+                        print('  ' * len(stack), "search", var, "=", val,
+                              "status = ", status, "pruned = ", trail.prunings(mark))
+                    if status:
+                        point[2] = mark
+                        descend = True
+                        break
+                    point[3].append(val)
+                    trail.rollback(mark)
+                    var.unassign()
+
+                if not descend:
+                    #no values left: backtrack
+                    stack.pop()
+                    self.restoreUnasgnVar(var)
+        finally:
+            for var, values, mark, refuted in stack:
+                if mark is not None:
+                    var.unassign()
+            trail.rollback(root)
+            trail.interrupt = interrupt
+            self.runtime = time.process_time() - stime
+
+    def solve_restarts(self, propagator, var_ord=None, val_ord=None,
+                       schedule='luby', base=100, factor=1.5, max_restarts=None,
+                       learn=True, keep_nogoods=False, seed=None, *,
+                       time_limit=None, cancel=None):
+        '''Search with restarts, returning a SearchOutcome whose
+           statistics are totals over every run (nRestarts counts the
+           restarts).
+
+           Run i (from 1) is cut off after branching on base * luby(i)
+           variables if schedule is 'luby', or base * factor**(i-1) if
+           it is 'geometric'. After max_restarts restarts the last run
+           has no node limit. Restarts only help if the heuristics are
+           randomized (e.g. ord_mrv_rand, val_lcv_support_rand); seed,
+           if given, seeds the random module first.
+
+           If learn is True the nogoods of every abandoned run are added
+           to the CSP as NogoodConstraints, so later runs do not explore
+           those branches again. They are removed at the end unless
+           keep_nogoods is True. time_limit and cancel bound the whole
+           search as in solve.'''
+
+        if seed is not None:
+            random.seed(seed)
+        stime = time.perf_counter()
+        learned = []
+        totals = [0, 0, 0]              #decisions, nodes, prunings
+        self.nRestarts = 0
+        try:
+            while True:
+                if max_restarts is not None and self.nRestarts >= max_restarts:
+                    node_limit = None
+                elif schedule == 'luby':
+                    node_limit = base * luby(self.nRestarts + 1)
+                else:
+                    node_limit = int(base * factor ** self.nRestarts)
+                remaining = None
+                if time_limit is not None:
+                    remaining = max(0.0, time_limit - (time.perf_counter() - stime))
+                nogoods = [] if learn else None
+                outcome = self.solve(propagator, var_ord, val_ord, node_limit=node_limit,
+                                     time_limit=remaining, cancel=cancel,
+                                     nogoods=nogoods)
+                totals[0] += self.nDecisions
+                totals[1] += self.nNodes
+                totals[2] += self.nPrunings
+                if outcome.status != 'limit' or node_limit is None:
+                    break
+                if time_limit is not None and time.perf_counter() - stime >= time_limit:
+                    break
+                for nogood in nogoods or ():
+                    c = NogoodConstraint("Nogood{}".format(len(learned)),
+                                         [var for var, val in nogood],
+                                         [val for var, val in nogood])
+                    self.csp.add_constraint(c)
+                    learned.append(c)
+                self.nRestarts += 1
+        finally:
+            if not keep_nogoods:
+                for c in learned:
+                    self.csp.remove_constraint(c)
+
+        self.nDecisions, self.nNodes, self.nPrunings = totals
+        outcome = SearchOutcome(outcome.status, outcome.solution, self,
+                                time.perf_counter() - stime)
+        outcome.nRestarts = self.nRestarts
+        return outcome
+
+    def solve_cbj(self, propagator, var_ord=None, val_ord=None, learn=False,
+                  keep_nogoods=False, *, node_limit=None, decision_limit=None,
+                  time_limit=None, cancel=None):
+        '''Search for the first solution with conflict-directed
+           backjumping and return a SearchOutcome (as solve does, with
+           the same limits).
+
+           The trail explains every pruning by the decision levels that
+           caused it (see Trail), and a failed propagation by the levels
+           behind the constraint that failed (CSP.record_conflict). Each
+           level collects the levels blamed for the failures of its
+           values. When its values run out, the search jumps straight
+           back to the most recent level in that conflict set, and skips
+           the levels in between. nBackjumps counts the levels skipped.
+           Propagators that do not report their conflicts are blamed on
+           every level, which is plain backtracking.
+
+           If learn is True the conflict set of every exhausted level is
+           also added to the CSP as a NogoodConstraint (the assignments
+           of those levels can not be extended to a solution), which
+           the propagators then use for the rest of the search. Learned
+           nogoods are removed at the end unless keep_nogoods is True.
+           '''
 
-            for val in value_order:
+        self.clear_stats()
+        self.stop_reason = None
+        self.nBackjumps = 0
+        stime = time.perf_counter()
+        cpu = time.process_time()
+        deadline = None
+        if time_limit is not None:
+            deadline = stime + time_limit
+        self.restore_all_variable_domains()
+        trail = self.trail
+        interrupt = trail.interrupt
+        trail.explain = True
+        trail.level = dict()
+        trail.levels = 0
+        trail.expl = dict()
+        self.conflict = None
+        self.csp.conflict_listeners.append(self)
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
+        self.unasgn_vars = []
+        for v in self.csp.vars:
+            if not v.is_assigned():
+                self.unasgn_vars.append(v)
 
+        #each level is [var, iterator over the values left to try, trail
+        #mark taken before var was assigned (None when it is not),
+        #conflict set of the failed values, explanation of the values
+        #pruned from var before the level started]
+        stack = []
+        learned = []
+        solution = None
+        unsat = False
+        root = trail.checkpoint()
+        try:
+            trail.interrupt = self.interrupt_check(deadline, cancel)
+            try:
+                if not self.propagate(propagator):
+                    return SearchOutcome('unsat', None, self, time.perf_counter() - stime)
+            except SearchInterrupted as e:
+                self.stop_reason = e.reason
+                return SearchOutcome(e.reason, None, self, time.perf_counter() - stime)
+
+            while self.unasgn_vars:
+                if node_limit is not None and self.nNodes >= node_limit:
+                    self.stop_reason = 'limit'
+                    break
+                self.nNodes += 1
+                if var_ord:
+                    var = var_ord(self.csp)
+                else:
+                    var = self.unasgn_vars[0]
+                self.unasgn_vars.remove(var)
+                if val_ord:
+                    value_order = val_ord(self.csp, var)
+                else:
+                    value_order = var.cur_domain()
+                stack.append([var, iter(value_order), None, 0, trail.expl.get(var, 0)])
+
+                #find a value for the top level, backjumping as needed
+                while True:
+                    point = stack[-1]
+                    var = point[0]
+                    level = len(stack)
+                    below = (1 << level) - 1    #levels before this one
+                    for val in point[1]:
+                        if ((decision_limit is not None and self.nDecisions >= decision_limit) or
+                                (time_limit is not None and time.perf_counter() > deadline)):
+                            self.stop_reason = 'limit'
+                            break
+                        if cancel is not None and cancel.is_set():
+                            self.stop_reason = 'cancelled'
+                            break
+                        mark = trail.checkpoint()
+                        var.assign(val)
+                        trail.level[var] = level
+                        trail.levels |= 1 << level
+                        self.nDecisions = self.nDecisions+1
+                        self.conflict = None
+                        try:
+                            ok = self.propagate(propagator, var)
+                        except SearchInterrupted as e:
+                            self.stop_reason = e.reason
+                            trail.rollback(mark)
+                            self.unassign_level(var)
+                            break
+                        if ok:
+                            point[2] = mark
+                            break
+                        if self.conflict is None:
+                            self.conflict = trail.levels
+                        point[3] |= self.conflict & below
+                        trail.rollback(mark)
+                        self.unassign_level(var)
+                    if point[2] is not None or self.stop_reason is not None:
+                        break
+
+                    #no values left: jump back to the latest level to blame
+                    jump = point[3] | (point[4] & below)
+                    stack.pop()
+                    self.restoreUnasgnVar(var)
+                    if learn and jump:
+                        c = self.learn_nogood(stack, jump, len(learned))
+                        learned.append(c)
+                    if not jump:
+                        unsat = True
+                        break
+                    target = jump.bit_length() - 1
+                    self.nBackjumps += len(stack) - target
+                    while len(stack) > target:
+                        skipped = stack.pop()
+                        self.unassign_level(skipped[0])
+                        self.restoreUnasgnVar(skipped[0])
+                    point = stack[-1]
+                    trail.rollback(point[2])
+                    self.unassign_level(point[0])
+                    point[2] = None
+                    point[3] |= jump & ((1 << target) - 1)
+                if unsat or self.stop_reason is not None:
+                    break
+            else:
+                solution = dict((v, v.get_assigned_value()) for v in self.csp.vars)
+        finally:
+            for point in stack:
+                if point[2] is not None:
+                    self.unassign_level(point[0])
+            trail.rollback(root)
+            trail.explain = False
+            trail.interrupt = interrupt
+            self.csp.conflict_listeners.remove(self)
+            if not keep_nogoods:
+                for c in learned:
+                    self.csp.remove_constraint(c)
+            self.runtime = time.process_time() - cpu
+
+        if solution is not None:
+            for var, val in solution.items():
                 var.assign(val)
-                self.nDecisions = self.nDecisions+1
-
-                status, prunings = propagator(self.csp, var)
-                self.nPrunings = self.nPrunings + len(prunings)
-
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
-
-                if status:
-                    if self.bt_recurse(propagator, var_ord,val_ord, level+1):
-                        return True
-
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
-                self.restoreValues(prunings)
-                var.unassign()
-
-            self.restoreUnasgnVar(var)
-            return False
+            status = 'solved'
+            self.nSolutions = 1
+        elif self.stop_reason is not None:
+            status = self.stop_reason
+        else:
+            status = 'unsat'
+        return SearchOutcome(status, solution, self, time.perf_counter() - stime)
+
+    def unassign_level(self, var):
+        '''Unassign var, a decision of solve_cbj'''
+        var.unassign()
+        self.trail.levels &= ~(1 << self.trail.level.pop(var))
+
+    def learn_nogood(self, stack, levels, n):
+        '''Add a NogoodConstraint forbidding the assignments of the
+           levels (a bitmask) of stack, and return it'''
+        scope = []
+        values = []
+        for level in range(1, len(stack) + 1):
+            if levels >> level & 1:
+                var = stack[level - 1][0]
+                scope.append(var)
+                values.append(var.get_assigned_value())
+        c = NogoodConstraint("Learned{}".format(n), scope, values)
+        self.csp.add_constraint(c)
+        return c
+
+    def weight_changed(self, c):
+        '''Conflict listener used by solve_cbj: remember the levels to
+           blame for the failure of constraint c'''
+        self.conflict = self.trail.explain_by(c)
+
+    def record_nogoods(self, stack, nogoods):
+        '''Append the nogoods of the search stack to the list nogoods
+           (see solutions), unless it is None or a solution was found'''
+        if nogoods is None or self.nSolutions > 0:
+            return
+        decisions = []
+        for var, values, mark, refuted in stack:
+            for val in refuted:
+                nogoods.append(decisions + [(var, val)])
+            if mark is None:
+                break
+            decisions.append((var, var.get_assigned_value()))
+
+    def check_unique(self, propagator, var_ord=None, val_ord=None, *,
+                     node_limit=None, time_limit=None):
+        '''Return 0 if the CSP has no solution, 1 if it has exactly one and
+           'many' if it has more, stopping as soon as a second solution is
+           found. The search for the second solution carries on from the
+           first rather than starting again. node_limit and time_limit
+           are as for solutions; if a limit stops the search before the
+           answer is known, None is returned.'''
+        n = 0
+        for solution in self.solutions(propagator, var_ord, val_ord, limit=2,
+                                       node_limit=node_limit, time_limit=time_limit):
+            n += 1
+        if n == 2:
+            return 'many'
+        if self.stop_reason is not None:
+            return None
+        return n
 
+    def count_solutions(self, propagator, var_ord=None, val_ord=None, *, limit=None,
+                        domains=None):
+        '''Return the number of solutions of the CSP (counting at most
+           limit of them), or of the subproblem given by domains (see
+           solutions)'''
+        n = 0
+        for solution in self.solutions(propagator, var_ord, val_ord, limit=limit,
+                                       domains=domains):
+            n += 1
+        return n
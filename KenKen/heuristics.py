@@ -2,6 +2,7 @@
 #to be implemented.
 
 import random
+import weakref
 '''
 This file will contain different variable ordering heuristics to be used within
 bt_search.
@@ -47,6 +48,249 @@ def ord_mrv(csp):
 
 
 
+
+def ord_mrv_rand(csp):
+    '''
+    MRV with ties broken at random (using the random module), for search with
+    restarts.
+    '''
+
+    min_vars = []
+    min_dom_size = None
+    for x in csp.get_all_unasgn_vars():
+        size = x.cur_domain_size()
+        if min_dom_size is None or size < min_dom_size:
+            min_vars = [x]
+            min_dom_size = size
+        elif size == min_dom_size:
+            min_vars.append(x)
+
+    if not min_vars:
+        return None
+    return random.choice(min_vars)
+
+
+class MRVIndex:
+    '''
+    Index of the unassigned variables of a CSP by current domain size, kept up
+    to date incrementally: the index is one of the watchers of every variable,
+    so pruning, unpruning, assigning and unassigning move a variable between
+    buckets in O(1).
+
+    Variables are bucketed by size * (maxdeg + 1) + (maxdeg - degree), where
+    degree is the number of constraints on the variable, so the first variable
+    of the lowest non-empty bucket has the smallest domain and, among those,
+    the highest degree. low is a lower bound on that bucket; select() moves
+    it up past empty buckets, and changes only ever move it down by the new
+    key, so selection is O(1) amortised.
+
+    The index holds csp only through a weak reference, so that MRV_INDEXES
+    (keyed weakly by CSP) does not keep the CSP alive.
+    '''
+
+    def __init__(self, csp):
+        self.csp = weakref.ref(csp)
+        self.version = csp.cons_version
+        self.vars = csp.get_all_vars()
+        self.degree = dict()
+        for v in self.vars:
+            self.degree[v] = len(csp.get_cons_with_var(v))
+        self.maxdeg = max(self.degree.values()) if self.vars else 0
+        self.size = dict()      #current domain size of each unassigned variable
+        self.key = dict()       #bucket of each unassigned variable
+        self.buckets = []       #dicts used as insertion ordered sets
+        self.low = 0
+        for v in self.vars:
+            v.watchers.append(self)
+            if not v.is_assigned():
+                self.insert(v, v.cur_domain_size())
+
+    def stale(self):
+        '''True if variables or constraints have been added to or removed
+           from the CSP since the index was built (or the CSP is gone)'''
+        csp = self.csp()
+        return csp is None or len(self.vars) != len(csp.vars) or self.version != csp.cons_version
+
+    def detach(self):
+        '''Stop watching the variables'''
+        for v in self.vars:
+            if self in v.watchers:
+                v.watchers.remove(self)
+
+    def insert(self, var, size):
+        key = size * (self.maxdeg + 1) + self.maxdeg - self.degree[var]
+        while len(self.buckets) <= key:
+            self.buckets.append(dict())
+        self.buckets[key][var] = None
+        self.size[var] = size
+        self.key[var] = key
+        if key < self.low:
+            self.low = key
+
+    def remove(self, var):
+        del self.buckets[self.key.pop(var)][var]
+        del self.size[var]
+
+    def domain_changed(self, var, delta):
+        if var in self.key:
+            size = self.size[var] + delta
+            self.remove(var)
+            self.insert(var, size)
+
+    def assignment_changed(self, var):
+        if var.is_assigned():
+            if var in self.key:
+                self.remove(var)
+        elif not var in self.key:
+            self.insert(var, var.cur_domain_size())
+
+    def select(self):
+        '''Return the unassigned variable with the smallest current domain
+           (highest degree on ties), or None if every variable is assigned'''
+        buckets = self.buckets
+        while self.low < len(buckets) and not buckets[self.low]:
+            self.low += 1
+        if self.low == len(buckets):
+            return None
+        return next(iter(buckets[self.low]))
+
+
+#MRVIndex of each CSP searched with ord_mrv_inc
+MRV_INDEXES = weakref.WeakKeyDictionary()
+
+def ord_mrv_inc(csp):
+    '''
+    MRV as in ord_mrv (ties broken by degree), answered from an MRVIndex of csp
+    that is built on the first call and then maintained incrementally.
+    '''
+
+    index = MRV_INDEXES.get(csp)
+    if index is None or index.stale():
+        if index is not None:
+            index.detach()
+        index = MRVIndex(csp)
+        MRV_INDEXES[csp] = index
+    return index.select()
+
+
+class WdegIndex:
+    '''
+    Weighted degrees for dom/wdeg. wdeg[x] is, for an unassigned variable x,
+    the summed weight of the constraints on x that have some other unassigned
+    variable. The index watches the variables' assignments and listens for
+    conflicts (CSP.record_conflict), and updates wdeg only for the variables
+    each event touches: n_unasgn[c] counts the unassigned variables of every
+    constraint c, and c stops counting towards its last unassigned variable
+    when n_unasgn[c] drops to 1. Like MRVIndex it holds csp only through a
+    weak reference.
+    '''
+
+    def __init__(self, csp):
+        self.csp = weakref.ref(csp)
+        self.version = csp.cons_version
+        self.vars = csp.get_all_vars()
+        self.n_unasgn = dict()
+        for c in csp.get_all_cons():
+            self.n_unasgn[c] = c.get_n_unasgn()
+        self.wdeg = dict()
+        for v in self.vars:
+            v.watchers.append(self)
+            if not v.is_assigned():
+                self.wdeg[v] = self.weighted_degree(v)
+        csp.conflict_listeners.append(self)
+
+    def stale(self):
+        '''True if the CSP has changed since the index was built (or the
+           CSP is gone)'''
+        csp = self.csp()
+        return csp is None or len(self.vars) != len(csp.vars) or self.version != csp.cons_version
+
+    def detach(self):
+        '''Stop watching the variables and the CSP'''
+        for v in self.vars:
+            if self in v.watchers:
+                v.watchers.remove(self)
+        csp = self.csp()
+        if csp is not None and self in csp.conflict_listeners:
+            csp.conflict_listeners.remove(self)
+
+    def weighted_degree(self, var):
+        '''Compute wdeg of unassigned var from scratch'''
+        w = 0
+        for c in self.csp().get_cons_with_var(var):
+            if self.n_unasgn[c] > 1:
+                w += c.weight
+        return w
+
+    def domain_changed(self, var, delta):
+        pass
+
+    def assignment_changed(self, var):
+        #constraints added since the index was built are not counted;
+        #ord_dom_wdeg rebuilds a stale index before using it
+        if self.stale():
+            return
+        csp = self.csp()
+        if var.is_assigned():
+            self.wdeg.pop(var, None)
+            for c in csp.get_cons_with_var(var):
+                self.n_unasgn[c] -= 1
+                if self.n_unasgn[c] == 1:
+                    for x in c.get_scope():
+                        if x in self.wdeg:
+                            self.wdeg[x] -= c.weight
+        else:
+            for c in csp.get_cons_with_var(var):
+                self.n_unasgn[c] += 1
+                if self.n_unasgn[c] == 2:
+                    for x in c.get_scope():
+                        if x in self.wdeg:
+                            self.wdeg[x] += c.weight
+            self.wdeg[var] = self.weighted_degree(var)
+
+    def weight_changed(self, c):
+        if self.n_unasgn.get(c, 0) > 1:
+            for x in c.get_scope():
+                if x in self.wdeg:
+                    self.wdeg[x] += 1
+
+    def select(self):
+        '''Return the unassigned variable minimising cur_domain_size / wdeg,
+           or None if every variable is assigned'''
+        best = None
+        for x in self.vars:
+            if x in self.wdeg:
+                w = self.wdeg[x]
+                #compare size/w < best_size/best_w without dividing; a
+                #variable with no weight comes last
+                if best is None or (w and (best_w == 0 or
+                                           x.cur_domain_size() * best_w < best_size * w)):
+                    best = x
+                    best_size = x.cur_domain_size()
+                    best_w = w
+        return best
+
+
+#WdegIndex of each CSP searched with ord_dom_wdeg
+WDEG_INDEXES = weakref.WeakKeyDictionary()
+
+def ord_dom_wdeg(csp):
+    '''
+    dom/wdeg: choose the variable with the smallest ratio of current domain size
+    to weighted degree, where each constraint weighs one plus the number of
+    conflicts it has caused (see WdegIndex). Weights accumulate over every
+    search of csp.
+    '''
+
+    index = WDEG_INDEXES.get(csp)
+    if index is None or index.stale():
+        if index is not None:
+            index.detach()
+        index = WdegIndex(csp)
+        WDEG_INDEXES[csp] = index
+    return index.select()
+
+
 def val_lcv(csp,var):
     '''
     A value heuristic that, given a variable, chooses the value to be assigned according to the
@@ -82,3 +326,47 @@ def val_lcv(csp,var):
         ordered_vals.append(val)
 
     return ordered_vals
+
+
+def support_scores(csp, var):
+    '''
+    Score each value of var by the product of its support counts
+    (Constraint.support_count) in the constraints on var that still have
+    another unassigned variable, as seen by the propagator of the current
+    search (CSP.view). Returns a dict from value to score.
+    '''
+
+    cons = [csp.view(c) for c in csp.get_cons_with_var(var) if c.get_n_unasgn() > 1]
+    score = {}
+    for d in var.cur_domain():
+        s = 1
+        for c in cons:
+            s *= c.support_count(var, d)
+            if s == 0:
+                break
+        score[d] = s
+    return score
+
+
+def val_lcv_support(csp, var):
+    '''
+    A Least-Constraining-Value ordering that needs no trial assignments. The
+    values of var are returned from the highest support score (see
+    support_scores; the value leaving the neighbours the most combinations) to
+    the lowest, ties in domain order.
+    '''
+
+    score = support_scores(csp, var)
+    return sorted(var.cur_domain(), key=lambda d: -score[d])
+
+
+def val_lcv_support_rand(csp, var):
+    '''
+    val_lcv_support with ties between values broken at random (using the random
+    module), for search with restarts.
+    '''
+
+    score = support_scores(csp, var)
+    vals = var.cur_domain()
+    random.shuffle(vals)
+    return sorted(vals, key=lambda d: -score[d])
@@ -30,6 +30,12 @@ The grid-only models do not need to encode the cage constraints.
 '''
 from cspbase import *
 import itertools
+import os
+from collections import OrderedDict
+try:
+    import numpy
+except ImportError:
+    numpy = None            #CageTableCache then keeps tables in memory only
 
 
 def verify_add(vals, target_val):
@@ -82,10 +88,439 @@ def verify_mult(vals, target_val):
     return prod == target_val
 
 
-def init_vars(domain):
+def sum_partitions(target, k, lo, hi):
+    '''
+    Generates the non-decreasing k-tuples of integers in lo..hi that add up to
+    target (the partitions of target into k parts in that range).
+    '''
+    if k == 0:
+        if target == 0:
+            yield ()
+        return
+    #the first part is at most target // k, since the others are no smaller
+    for first in range(lo, min(hi, target // k) + 1):
+        rest = target - first
+        if rest < first * (k - 1) or rest > hi * (k - 1):
+            continue
+        for tail in sum_partitions(rest, k - 1, first, hi):
+            yield (first,) + tail
+
+
+def factorisations(target, k, lo, hi):
+    '''
+    Generates the non-decreasing k-tuples of integers in lo..hi (lo >= 1) that
+    multiply to target.
+    '''
+    if k == 0:
+        if target == 1:
+            yield ()
+        return
+    #the first factor is at most the k-th root of target
+    for first in range(lo, min(hi, target) + 1):
+        if first ** k > target:
+            break
+        if target % first == 0:
+            for tail in factorisations(target // first, k - 1, first, hi):
+                yield (first,) + tail
+
+
+def cage_conflicts(cells):
+    '''
+    Returns the pairs of positions (i, j), i < j, of cells (a list of
+    (row, col) pairs) that are in the same row or column of the board, and so
+    must take different values.
+    '''
+    pairs = []
+    for i, j in itertools.combinations(range(len(cells)), 2):
+        if cells[i][0] == cells[j][0] or cells[i][1] == cells[j][1]:
+            pairs.append((i, j))
+    return pairs
+
+
+def cage_tuples(op, target_value, cells, size):
+    '''
+    Returns the sorted list of satisfying tuples of a cage over cells (a list of
+    (row, col) pairs, in scope order) on a board with values 1..size, without
+    enumerating every tuple of the cross product. op is the cage operation (0
+    addition, 1 subtraction, 2 division, 3 multiplication; None for a single
+    cell cage). Tuples giving equal values to two cells in the same row or
+    column are left out, as the grid constraints forbid them anyway.
+    '''
+    k = len(cells)
+    if op is None or k == 1:
+        multisets = [(target_value,)] if 1 <= target_value <= size else []
+    elif op == 0:  #addition
+        multisets = sum_partitions(target_value, k, 1, size)
+    elif op == 3:  #multiplication
+        multisets = factorisations(target_value, k, 1, size) if target_value > 0 else []
+    elif op == 1 and k == 2:  #subtraction: a - b == target
+        multisets = [tuple(sorted((b + target_value, b))) for b in range(1, size + 1)
+                     if 1 <= b + target_value <= size]
+    elif op == 2 and k == 2:  #division: a // b == target
+        multisets = [tuple(sorted((a, b))) for b in range(1, size + 1)
+                     for a in range(target_value * b, min(size, target_value * b + b - 1) + 1)
+                     if a >= 1]
+    else:
+        #subtraction or division over more than two cells: filter multisets
+        verify = verify_sub if op == 1 else verify_div
+        multisets = [m for m in itertools.combinations_with_replacement(range(1, size + 1), k)
+                     if verify(m, target_value)]
+
+    conflicts = cage_conflicts(cells)
+    sat_tuples = set()
+    for m in multisets:
+        for t in set(itertools.permutations(m)):
+            if all(t[i] != t[j] for i, j in conflicts):
+                sat_tuples.add(t)
+    return sorted(sat_tuples)
+
+
+class CageTableCache:
+    '''
+    Memoizes cage_tuples. A cage is identified by its signature: operation,
+    target, board size, number of cells and which pairs of cells share a row
+    or column, since those determine the table. Cages with the same signature
+    share one table.
+
+    Tables are kept, as Relations, in an in-process LRU of at most maxsize entries. If a
+    directory is given (and numpy is available) tables are also saved there as
+    .npy files, so the cache survives across processes. A table loaded from
+    disk is read into a Relation of its own like a generated one: the disk
+    cache saves the time spent enumerating the tuples, not memory.
+    hits, disk_hits and misses count how lookups were answered.
+    '''
+
+    def __init__(self, maxsize=4096, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        if directory is not None and numpy is None:
+            print("ERROR: the on-disk cage table cache needs numpy; using memory only")
+            self.directory = None
+        self.tables = OrderedDict()
+        self.clear_stats()
+
+    def clear_stats(self):
+        '''Reset the hit/miss counters'''
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def print_stats(self):
+        print("Cage table cache: {} hits, {} disk hits, {} misses, {} tables in memory".format(
+            self.hits, self.disk_hits, self.misses, len(self.tables)))
+
+    def signature(self, op, target_value, cells, size):
+        '''Canonical key of a cage (see cage_tuples for the arguments)'''
+        return (op, target_value, size, len(cells), tuple(cage_conflicts(cells)))
+
+    def get_relation(self, op, target_value, cells, size):
+        '''Return a Relation holding cage_tuples(op, target_value, cells,
+           size), shared by every cage with the same signature'''
+        key = self.signature(op, target_value, cells, size)
+        if key in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+
+        table = None
+        if self.directory is not None:
+            table = self.load(key)
+        if table is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            table = cage_tuples(op, target_value, cells, size)
+            if self.directory is not None:
+                self.save(key, table)
+
+        relation = Relation(table, len(cells))
+        self.tables[key] = relation
+        if len(self.tables) > self.maxsize:
+            self.tables.popitem(last=False)
+        return relation
+
+    def get_tuples(self, op, target_value, cells, size):
+        '''Return cage_tuples(op, target_value, cells, size), from the
+           cache if possible'''
+        return list(self.get_relation(op, target_value, cells, size).tuples)
+
+    def path(self, key):
+        '''File name of the on-disk table for signature key'''
+        op, target_value, size, k, conflicts = key
+        #encode the conflicting pairs as a bitmask over all pairs
+        pairs = list(itertools.combinations(range(k), 2))
+        geometry = sum(1 << pairs.index(p) for p in conflicts)
+        name = "cage-{}-{}-{}-{}-{}.npy".format(
+            'x' if op is None else op, target_value, size, k, geometry)
+        return os.path.join(self.directory, name)
+
+    def load(self, key):
+        '''Return the table for key from the directory, or None'''
+        try:
+            rows = numpy.load(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return [tuple(t) for t in rows.tolist()]
+
+    def save(self, key, table):
+        '''Write the table for key to the directory'''
+        os.makedirs(self.directory, exist_ok=True)
+        rows = numpy.array(table, dtype=numpy.int16).reshape(len(table), key[3])
+        #write then rename, so other processes never see a partial file
+        tmp = "{}.{}.tmp".format(self.path(key), os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.save(f, rows)
+        os.replace(tmp, self.path(key))
+
+
+#cage tables shared by every model built in this process
+CAGE_CACHE = CageTableCache()
+
+
+class CageConstraint(Constraint):
+    '''
+    Base class of the intensional cage constraints: the values of the cells in
+    scope must combine to target under the cage operation. No tuples are
+    stored. has_support searches the current domains for a completion,
+    pruning partial assignments with feasible(), so prop_GAC works with these
+    constraints; the subclasses provide their own gac_revise filtering.
+    '''
+
+    tabular = False
+
+    def __init__(self, name, scope, target):
+        Constraint.__init__(self, name, scope)
+        self.target = target
+
+    def compiled_args(self):
+        return [self.target]
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: cage constraint", self, "does not take satisfying tuples")
+
+    def feasible(self, vals, doms):
+        '''
+        Return False if the partial assignment vals (a prefix of the scope) can
+        not be completed from doms, the domains of the remaining cells.
+        '''
+        return True
+
+    def complete(self, vals, doms):
+        '''
+        Return True if vals can be completed from doms to a tuple satisfying the
+        constraint.
+        '''
+        if not doms:
+            return self.check(vals)
+        if not self.feasible(vals, doms):
+            return False
+        for val in doms[0]:
+            vals.append(val)
+            if self.complete(vals, doms[1:]):
+                vals.pop()
+                return True
+            vals.pop()
+        return False
+
+    def has_support(self, var, val):
+        doms = []
+        for x in self.scope:
+            if x is var:
+                doms.append([val])
+            else:
+                doms.append(x.cur_domain())
+        if not all(doms):
+            return False
+        return self.complete([], doms)
+
+    def pairwise_revise(self, trail):
+        '''
+        GAC filtering of a two cell cage: keep a value of one cell only if some
+        value of the other cell makes the pair satisfy the constraint.
+        '''
+        x, y = self.scope
+        changed = []
+        for var, other in ((x, y), (y, x)):
+            if var.is_assigned():
+                continue
+            other_vals = other.cur_domain()
+            pruned = False
+            for val in var.cur_domain():
+                if var is x:
+                    ok = any(self.check((val, w)) for w in other_vals)
+                else:
+                    ok = any(self.check((w, val)) for w in other_vals)
+                if not ok:
+                    trail.prune(var, val)
+                    pruned = True
+            if pruned:
+                changed.append(var)
+                if var.cur_domain_size() == 0:
+                    return False, changed
+        if x.is_assigned() and y.is_assigned():
+            return self.check((x.get_assigned_value(), y.get_assigned_value())), changed
+        return True, changed
+
+
+class SumConstraint(CageConstraint):
+    '''
+    Addition cage: the cell values add up to target. Filtering is bounds
+    reasoning: a value v of a cell is kept only if target - v lies between the
+    smallest and the largest sums the other cells can still make.
+    '''
+
+    idempotent = True
+
+    def check(self, vals):
+        return verify_add(vals, self.target)
+
+    def feasible(self, vals, doms):
+        lo = sum(vals) + sum(min(d) for d in doms)
+        hi = sum(vals) + sum(max(d) for d in doms)
+        return lo <= self.target <= hi
+
+    def gac_revise(self, trail):
+        changed = []
+        while True:
+            doms = [x.cur_domain() for x in self.scope]
+            if not all(doms):
+                return False, changed
+            mins = [min(d) for d in doms]
+            maxs = [max(d) for d in doms]
+            lo = sum(mins)
+            hi = sum(maxs)
+            if not lo <= self.target <= hi:
+                return False, changed
+            pruned = False
+            for i, x in enumerate(self.scope):
+                if x.is_assigned():
+                    continue
+                #range of values the other cells leave for x
+                low = self.target - (hi - maxs[i])
+                high = self.target - (lo - mins[i])
+                for val in doms[i]:
+                    if val < low or val > high:
+                        trail.prune(x, val)
+                        pruned = True
+                        if not x in changed:
+                            changed.append(x)
+            if not pruned:
+                return True, changed
+
+
+class ProductConstraint(CageConstraint):
+    '''
+    Multiplication cage: the cell values multiply to target. Filtering keeps a
+    value v of a cell only if v divides target and target // v lies between the
+    smallest and the largest products the other cells can still make.
+    '''
+
+    idempotent = True
+
+    def check(self, vals):
+        return verify_mult(vals, self.target)
+
+    def feasible(self, vals, doms):
+        prod = 1
+        for val in vals:
+            prod *= val
+        if prod == 0 or self.target % prod != 0:
+            return prod == 0 and self.target == 0
+        lo = hi = prod
+        for d in doms:
+            lo *= min(d)
+            hi *= max(d)
+        return lo <= self.target <= hi
+
+    def gac_revise(self, trail):
+        changed = []
+        while True:
+            doms = [x.cur_domain() for x in self.scope]
+            if not all(doms):
+                return False, changed
+            pruned = False
+            for i, x in enumerate(self.scope):
+                #range of products the other cells can make
+                lo = hi = 1
+                for j, d in enumerate(doms):
+                    if j != i:
+                        lo *= min(d)
+                        hi *= max(d)
+                for val in doms[i]:
+                    if val == 0 or self.target % val != 0 or not lo <= self.target // val <= hi:
+                        if x.is_assigned():
+                            return False, changed
+                        trail.prune(x, val)
+                        pruned = True
+                        if not x in changed:
+                            changed.append(x)
+                if x.cur_domain_size() == 0:
+                    return False, changed
+                doms[i] = x.cur_domain()
+            if not pruned:
+                if all(x.is_assigned() for x in self.scope):
+                    return self.check([x.get_assigned_value() for x in self.scope]), changed
+                return True, changed
+
+
+class DiffConstraint(CageConstraint):
+    '''
+    Subtraction cage, with the semantics of verify_sub: some cell value minus
+    the others equals target, i.e. 2 * v == target + sum(vals) for some v.
+    Two cell cages are filtered pairwise; larger ones fall back to has_support.
+    '''
+
+    def __init__(self, name, scope, target):
+        CageConstraint.__init__(self, name, scope, target)
+        self.idempotent = len(self.scope) == 2
+
+    def check(self, vals):
+        total = sum(vals)
+        return any(2 * val == self.target + total for val in vals)
+
+    def gac_revise(self, trail):
+        if len(self.scope) == 2:
+            return self.pairwise_revise(trail)
+        return CageConstraint.gac_revise(self, trail)
+
+
+class QuotientConstraint(CageConstraint):
+    '''
+    Division cage, with the semantics of verify_div: some cell value floor
+    divided by the product of the others equals target. Two cell cages are
+    filtered pairwise; larger ones fall back to has_support.
+    '''
+
+    def __init__(self, name, scope, target):
+        CageConstraint.__init__(self, name, scope, target)
+        self.idempotent = len(self.scope) == 2
+
+    def check(self, vals):
+        prod = 1
+        for val in vals:
+            prod *= val
+        if prod == 0:
+            return False
+        return any(val // (prod // val) == self.target for val in vals)
+
+    def gac_revise(self, trail):
+        if len(self.scope) == 2:
+            return self.pairwise_revise(trail)
+        return CageConstraint.gac_revise(self, trail)
+
+
+#cage constraint class for each cage operation
+CAGE_CONSTRAINTS = {0: SumConstraint,       #addition
+                    1: DiffConstraint,      #subtraction
+                    2: QuotientConstraint,  #division
+                    3: ProductConstraint}   #multiplication
+
+
+def init_vars(domain, var_type=Variable):
     '''
     Helper function for binary_ne_grid and nary_ad_grid:
     Returns the game board with all the variables for a KenKen board with given the domain.
+    var_type is the Variable class to use (Variable or BitVariable).
     '''
     size = len(domain)
     board = []
@@ -94,7 +529,7 @@ def init_vars(domain):
     for row in range(1, size + 1):
         row_vars = []
         for col in range(1, size + 1):
-            row_vars.append(Variable('V{0}{1}'.format(row, col), domain))
+            row_vars.append(var_type('V{0}{1}'.format(row, col), domain))
         board.append(row_vars)
 
     return board
@@ -120,141 +555,203 @@ def get_c_name(vars):
     return name
 
 
-def binary_ne_grid(kenken_grid):
+class GridTemplate:
     '''
-    A model of a KenKen grid (without cage constraints) built using only
-    binary-not-equal constraints for both the row and column constraints.
+    The part of a KenKen grid model that is the same for every puzzle of one
+    board size: the names and cell positions of the row and column
+    constraints, and their table of satisfying tuples. encoding is
+    'binary' (binary not-equal constraints, as binary_ne_grid) or 'nary'
+    (n-ary all-different constraints, as nary_ad_grid). build() hands out
+    fresh variables and constraints that share the template's Relation, so
+    the table is only generated once.
     '''
 
-    size = kenken_grid[0][0]  #board size
+    def __init__(self, size, encoding='nary'):
+        self.size = size
+        self.encoding = encoding
+        #Starting domain; used to initialize variables
+        self.domain = list(range(1, size + 1))
+        self.relation = None
 
-    #Starting domain; used to initialize variables
-    domain = []
-    for i in range(1, size + 1):
-        domain.append(i)
+        lines = []
+        for row in range(1, size + 1):
+            lines.append([(row, col) for col in range(1, size + 1)])
+        for col in range(1, size + 1):
+            lines.append([(row, col) for row in range(1, size + 1)])
+
+        #name and cells of every row and column constraint
+        self.scopes = []
+        for line in lines:
+            if encoding == 'binary':
+                for pair in itertools.combinations(line, 2):
+                    self.scopes.append(("C(V{0}{1},V{2}{3})".format(*(pair[0] + pair[1])), pair))
+            else:
+                name = "C(" + ",".join("V{0}{1}".format(*cell) for cell in line) + ")"
+                self.scopes.append((name, line))
+
+    def get_relation(self):
+        '''The Relation shared by the row and column constraints, built on
+           first use'''
+        if self.relation is None:
+            if self.encoding == 'binary':
+                #pairs that satisfy the constraints, shared by all of them
+                self.relation = Relation(itertools.permutations(self.domain, 2), 2)
+            else:
+                self.relation = Relation(itertools.permutations(self.domain), self.size)
+        return self.relation
+
+    def build(self, var_type=Variable, alldiff=None):
+        '''
+        Return (board, constraints): a size*size board of new variables of
+        class var_type and the row and column constraints over them. For
+        the 'nary' encoding alldiff selects AllDiffConstraints instead of
+        the table (see ad_constraint); the 'binary' encoding has no
+        all-different constraints, and raises ValueError if alldiff is
+        given.
+        '''
+        if self.encoding == 'binary' and alldiff:
+            raise ValueError("alldiff={!r} needs the 'nary' grid encoding".format(alldiff))
+        board = init_vars(self.domain, var_type)
+        relation = None
+        if self.encoding == 'binary' or not alldiff:
+            relation = self.get_relation()
+
+        constraints = []
+        for name, cells in self.scopes:
+            scope = [board[row - 1][col - 1] for row, col in cells]
+            if self.encoding == 'binary':
+                constraints.append(Constraint(name, scope, relation))
+            else:
+                constraints.append(ad_constraint(name, scope, self.domain, alldiff, relation))
+        return board, constraints
+
+
+class GridTemplateCache:
+    '''
+    Memoizes GridTemplates by board size and encoding. hits and misses
+    count how lookups were answered.
+    '''
 
-    #Initialize Variables and store them in an size*size board
-    board = init_vars(domain)
+    def __init__(self):
+        self.templates = dict()
+        self.clear_stats()
 
-    #Initialize Contraints and store them in list constraints
-    constraints = []
-    #Store row constraints to constraints
-    for row in board:
-        #initialize row constraints
-        for pair in itertools.combinations(row, 2):
-            c = Constraint("C({0},{1})".format(pair[0].name, pair[1].name),
-                           [pair[0], pair[1]])
-            #pairs that satisfy the constraints:
-            sat_pairs = []
-            for sat_pair in itertools.permutations(domain, 2):
-                sat_pairs.append(sat_pair)
-            c.add_satisfying_tuples(sat_pairs)
-            constraints.append(c)
+    def clear_stats(self):
+        '''Reset the hit/miss counters'''
+        self.hits = 0
+        self.misses = 0
+
+    def print_stats(self):
+        print("Grid template cache: {} hits, {} misses, {} templates".format(
+            self.hits, self.misses, len(self.templates)))
+
+    def clear(self):
+        '''Drop every template'''
+        self.templates.clear()
+
+    def get_template(self, size, encoding='nary'):
+        '''Return the GridTemplate for size and encoding'''
+        key = (size, encoding)
+        if key in self.templates:
+            self.hits += 1
+            return self.templates[key]
+        self.misses += 1
+        template = GridTemplate(size, encoding)
+        self.templates[key] = template
+        return template
 
-    #Store column constraints to constraints
-    for col in range(len(domain)):
-        column = []
-        for row in range(len(domain)):
-            column.append(board[row][col])
-        for pair in itertools.combinations(column, 2):
-            #initialize column constraints
-            c = Constraint("C({0},{1})".format(pair[0].name, pair[1].name),
-                           [pair[0], pair[1]])
-            #pairs that satisfy the constraints:
-            sat_pairs = []
-            for sat_pair in itertools.permutations(domain, 2):
-                sat_pairs.append(sat_pair)
-            c.add_satisfying_tuples(sat_pairs)
-            constraints.append(c)
 
-    #Initialize CSP
-    csp = CSP("{0}-BinaryKenKen".format(size))
+#grid templates shared by every model built in this process
+GRID_TEMPLATES = GridTemplateCache()
+
+
+def grid_template(size, encoding, templates):
+    '''
+    Helper function for the grid models: the GridTemplate of size and
+    encoding from templates (a GridTemplateCache), or a new one if it is
+    None.
+    '''
+    if templates is None:
+        return GridTemplate(size, encoding)
+    return templates.get_template(size, encoding)
+
+
+def grid_csp(name, board, constraints):
+    '''
+    Helper function for the grid models: a CSP with the variables of board
+    and constraints.
+    '''
+    csp = CSP(name)
     #add every variable to csp
     for row in board:
         for var in row:
             csp.add_var(var)
-    #add every onstraint to csp
     for c in constraints:
         csp.add_constraint(c)
-
-    return csp, board
+    return csp
 
 
-def nary_ad_grid(kenken_grid):
+def binary_ne_grid(kenken_grid, var_type=Variable, templates=GRID_TEMPLATES):
     '''
     A model of a KenKen grid (without cage constraints) built using only
-    n-ary all-different constraints for both the row and column constraints.
+    binary-not-equal constraints for both the row and column constraints.
+    var_type selects the Variable class used for the cells. The constraints
+    come from the 'binary' GridTemplate of the board size in templates (a
+    GridTemplateCache), or a new template if it is None.
     '''
-    size = kenken_grid[0][0] #board size
 
-    #Starting domain; used to initialize variables
-    domain = []
-    for i in range(1, size + 1):
-        domain.append(i)
-    # init variables
-    board = init_vars(domain)
+    size = kenken_grid[0][0]  #board size
+    board, constraints = grid_template(size, 'binary', templates).build(var_type)
+    return grid_csp("{0}-BinaryKenKen".format(size), board, constraints), board
 
 
-    # Initialize Contraints and store them in list constraints
-    constraints = []
-    # Store row constraints to constraints
-    for row in board:
-        #initialize constraint c with with all variables in row row
-        c_name = get_c_name(row)
-        c = Constraint(c_name, row)
-        #combinations of values that satisfy the constraints
-        sat_combs = []
-        for diff_comb in itertools.permutations(domain, size):
-            sat_combs.append(diff_comb)
-        c.add_satisfying_tuples(sat_combs)
-        constraints.append(c)
+def ad_constraint(c_name, scope, domain, alldiff=None, relation=None):
+    '''
+    Helper function for nary_ad_grid:
+    Returns an all-different constraint over scope. If alldiff is None it is a
+    table of every permutation of domain (the Relation relation if given, so
+    that rows and columns can share one table), otherwise an AllDiffConstraint
+    with filtering alldiff ('gac' or 'fc').
+    '''
+    if alldiff:
+        return AllDiffConstraint(c_name, scope, alldiff)
 
-    # add column constraints
-    # build columns
-    for col in range(len(domain)):  # column num from 0 to n-1
-        column = []
-        for row in range(len(domain)):  # num of rows
-            column.append(board[row][col])
-        #initialize constraint c with scope of all variables column col
-        c_name = get_c_name(column)
-        c = Constraint(c_name, column)
+    if relation is None:
         #combinations of values that satisfy the constraints
-        sat_combs = []
-        for diff_comb in itertools.permutations(domain, size):
-            sat_combs.append(diff_comb)
-        c.add_satisfying_tuples(sat_combs)
-        constraints.append(c)
+        relation = Relation(itertools.permutations(domain, len(scope)), len(scope))
+    return Constraint(c_name, scope, relation)
 
-    #Initialize CSP
-    csp = CSP("{0}-aryKenKen".format(size))
-    #add every variable to csp
-    for row in board:
-        for var in row:
-            csp.add_var(var)
-    #add all the n-ary row and column constraints to csp
-    for c in constraints:
-        csp.add_constraint(c)
 
-    return csp, board
+def nary_ad_grid(kenken_grid, var_type=Variable, alldiff=None, templates=GRID_TEMPLATES):
+    '''
+    A model of a KenKen grid (without cage constraints) built using only
+    n-ary all-different constraints for both the row and column constraints.
+    var_type selects the Variable class used for the cells. If alldiff is
+    'gac' or 'fc' the rows and columns are AllDiffConstraints with that
+    filtering instead of tables of permutations. The constraints come from
+    the 'nary' GridTemplate of the board size in templates (a
+    GridTemplateCache), or a new template if it is None.
+    '''
+    size = kenken_grid[0][0] #board size
+    board, constraints = grid_template(size, 'nary', templates).build(var_type, alldiff)
+    return grid_csp("{0}-aryKenKen".format(size), board, constraints), board
 
 
-def kenken_csp_model(kenken_grid):
+def cage_constraints(kenken_grid, board, cages='table', cage_cache=CAGE_CACHE):
     '''
-    A model built using n-ary all-different constraints for the grid and
-    KenKen cage constraints.
+    Return the cage constraints of kenken_grid over the cell variables of
+    board. If cages is 'arith' they are intensional cage constraints
+    (CAGE_CONSTRAINTS) rather than tables of satisfying tuples. Cage tables
+    come from cage_cache (a CageTableCache), or are generated afresh if it
+    is None. A cage whose operation is not 0 to 3 raises ValueError.
     '''
 
-    #Get the board the n-ary csp's using nary_ad_grid(kenken_grid)
-    n_ary = nary_ad_grid(kenken_grid)
-    n_ary_csp = n_ary[0]
-    board = n_ary[1]
-
     size = kenken_grid[0][0]  # board size
-
-    #Starting domain; used to initialize variables
-    domain = []
-    for i in range(1, size + 1):
-        domain.append(i)
+    if cage_cache is None:
+        def get_relation(op, target_value, cells, size):
+            return Relation(cage_tuples(op, target_value, cells, size), len(cells))
+    else:
+        get_relation = cage_cache.get_relation
 
     #Store all the cage constraints in constarints
     constraints = []
@@ -268,54 +765,98 @@ def kenken_csp_model(kenken_grid):
             c_scope.append(board[row - 1][col - 1])
             target_value = cage[1]
 
-            c = Constraint("Cage: " + "C(V{0}{1})".format(row, col), c_scope)
-            c.add_satisfying_tuples([(target_value)])
+            c_name = "Cage: " + "C(V{0}{1})".format(row, col)
+            if cages == 'arith':
+                c = SumConstraint(c_name, c_scope, target_value)
+            else:
+                c = Constraint(c_name, c_scope,
+                               get_relation(None, target_value, [(row, col)], size))
             constraints.append(c)
             continue  #move onto the next cage
 
         #if len(cage) > 2
+        cells = []
         for cell in range(0, len(cage) - 2):
             row = (cage[cell] // 10)
             col = (cage[cell] % 10)
             c_scope.append(board[row - 1][col - 1])
+            cells.append((row, col))
         op = cage[-1]
+        if op not in CAGE_CONSTRAINTS:
+            raise ValueError("bad operation {0} in cage {1}, expected 0 to 3".format(op, cage))
         target_value = cage[-2]
 
         c_name = get_c_name(c_scope)
-        c = Constraint("Cage: " + c_name, c_scope)
-
-        #Verify if each combination satisfies the constraint and add to sat_combs
-        sat_combs = []
-        for t in itertools.product(domain, repeat=len(c_scope)):
-            if op == 0:  #addition
-                if verify_add(t, target_value):
-                    sat_combs.append(t)
-            elif op == 1:  #subtraction
-                if verify_sub(t, target_value):
-                    sat_combs.append(t)
-            elif op == 2:  #division
-                if verify_div(t, target_value):
-                    sat_combs.append(t)
-            elif op == 3:  #multiplication
-                if verify_mult(t, target_value):
-                    sat_combs.append(t)
-        c.add_satisfying_tuples(sat_combs)
+        if cages == 'arith':
+            constraints.append(CAGE_CONSTRAINTS[op]("Cage: " + c_name, c_scope, target_value))
+            continue
+
+        #generate the satisfying tuples directly rather than filtering the
+        #cross product of the domains
+        c = Constraint("Cage: " + c_name, c_scope,
+                       get_relation(op, target_value, cells, size))
         constraints.append(c)
 
+    return constraints
 
-    #Initialize CSP
-    csp = CSP("{0}-KenKen".format(size))
 
-    #add all variables to csp
-    for row in board:
-        for var in row:
-            csp.add_var(var)
+def kenken_csp_model(kenken_grid, var_type=Variable, alldiff=None, cages='table',
+                     cage_cache=CAGE_CACHE, grid='nary', grid_templates=GRID_TEMPLATES):
+    '''
+    A model built using n-ary all-different constraints for the grid and
+    KenKen cage constraints.
+    var_type selects the Variable class used for the cells, and alldiff the
+    encoding of the rows and columns (see nary_ad_grid); with grid 'binary'
+    they are binary not-equal constraints instead (see binary_ne_grid), and
+    giving alldiff as well raises ValueError.
+    The row and column constraints come from the GridTemplate of the board
+    size in grid_templates (a GridTemplateCache), or a new template if it
+    is None. cages and cage_cache select how the cage constraints are
+    built (see cage_constraints).
+    '''
 
-    #add cage constraints to csp
-    for c in constraints:
-        csp.add_constraint(c)
-    #add row and column constraints to csp
-    for c in n_ary_csp.get_all_cons():
-        csp.add_constraint(c)
+    size = kenken_grid[0][0]  # board size
+    template = grid_template(size, grid, grid_templates)
+    board, grid_constraints = template.build(var_type, alldiff)
+    constraints = cage_constraints(kenken_grid, board, cages, cage_cache)
+
+    #cage constraints first, then row and column constraints
+    return grid_csp("{0}-KenKen".format(size), board, constraints + grid_constraints), board
+
+
+class GridModel:
+    '''
+    A KenKen model of one board size whose grid (the variables and the row
+    and column constraints of nary_ad_grid) is built once and reused for
+    many puzzles: set_puzzle swaps in the cage constraints of each puzzle
+    in place of those of the last one.
+    '''
 
-    return csp, board
+    def __init__(self, size, var_type=Variable, alldiff=None):
+        self.size = size
+        self.csp, self.board = nary_ad_grid([[size]], var_type, alldiff)
+        self.grid_cons = list(self.csp.get_all_cons())
+        self.cages = []
+
+    def set_puzzle(self, kenken_grid, cages='table', cage_cache=CAGE_CACHE):
+        '''
+        Make the model that of kenken_grid, with cage constraints built as
+        cage_constraints does, and return (csp, board) as kenken_csp_model
+        does. Every variable is unassigned and has its full domain again,
+        and the weights of the grid constraints are reset. Returns None if
+        kenken_grid is not of this model's size.
+        '''
+        if kenken_grid[0][0] != self.size:
+            print("ERROR: {0}x{0} puzzle given to a {1}x{1} GridModel".format(
+                kenken_grid[0][0], self.size))
+            return None
+        constraints = cage_constraints(kenken_grid, self.board, cages, cage_cache)
+        BT(self.csp).restore_all_variable_domains()
+        for c in self.cages:
+            self.csp.remove_constraint(c)
+        for c in self.grid_cons:
+            c.weight = 1
+        self.cages = constraints
+        for c in self.cages:
+            self.csp.add_constraint(c)
+        return self.csp, self.board
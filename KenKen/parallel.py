@@ -0,0 +1,450 @@
+'''Portfolio solving of KenKen puzzles on every core of one machine.
+
+Which propagator and ordering heuristics solve a KenKen instance fastest
+varies a lot from one instance to the next. solve_portfolio runs several
+configurations at once, each in its own worker process that builds the
+CSP with kenken_csp_model and searches it. The first worker to finish
+(with a solution, or a proof that there is none) wins, and the others
+are cancelled.
+
+solve_eps instead splits one search into many small subproblems and
+searches them on a pool of worker processes (embarrassingly parallel
+search), to count the solutions of a puzzle or prove it has none, or to
+find the first solution sooner.
+
+A configuration is a dict with the keys
+
+    prop        the propagator (prop_FC, prop_GAC, prop_GAC3, ...)
+    var_ord     the variable ordering heuristic, or None
+    val_ord     the value ordering heuristic, or None
+    var_type    Variable or BitVariable           (default Variable)
+    alldiff     the row and column encoding       (default None, see nary_ad_grid)
+    cages       'table' or 'arith'                (default 'table')
+    seed        seed for the random module, for the randomized heuristics
+    restarts    True to search with BT.solve_restarts instead of BT.solve
+
+Only prop is required. Configurations are passed to the worker processes,
+so the functions in them must be defined at module level.
+'''
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+import os
+import time
+import queue
+import random
+import multiprocessing
+import concurrent.futures
+
+#Configurations tried first by portfolio_configs
+PORTFOLIO = [
+    dict(prop=prop_GAC3, var_ord=ord_mrv, val_ord=val_lcv_support,
+         var_type=BitVariable, alldiff='gac', cages='arith'),
+    dict(prop=prop_GAC3, var_ord=ord_dom_wdeg, val_ord=val_lcv_support,
+         var_type=BitVariable, alldiff='gac', cages='arith'),
+    dict(prop=prop_GAC, var_ord=ord_mrv, val_ord=val_lcv),
+    dict(prop=prop_FC, var_ord=ord_mrv, val_ord=val_lcv),
+    dict(prop=prop_CT, var_ord=ord_mrv, val_ord=None),
+    dict(prop=prop_FC, var_ord=ord_mrv, val_ord=None,
+         var_type=BitVariable, alldiff='gac', cages='arith'),
+]
+
+#Seconds solve_portfolio waits for a result before checking whether any
+#worker process has died
+PORTFOLIO_POLL = 0.1
+
+def portfolio_configs(n):
+    '''Return n configurations: those of PORTFOLIO, then GAC-3 with the
+       randomized heuristics and restarts, each with its own seed'''
+    configs = PORTFOLIO[:n]
+    seed = 1
+    while len(configs) < n:
+        configs.append(dict(prop=prop_GAC3, var_ord=ord_mrv_rand,
+                            val_ord=val_lcv_support_rand, var_type=BitVariable,
+                            alldiff='gac', cages='arith', seed=seed, restarts=True))
+        seed += 1
+    return configs
+
+def config_label(config):
+    '''A short description of a configuration'''
+    names = [config['prop'].__name__]
+    for key in ('var_ord', 'val_ord'):
+        if config.get(key) is not None:
+            names.append(config[key].__name__)
+    label = "/".join(names)
+    if config.get('var_type', Variable) is not Variable:
+        label += " " + config['var_type'].__name__
+    if config.get('alldiff') is not None:
+        label += " alldiff=" + config['alldiff']
+    if config.get('cages', 'table') != 'table':
+        label += " cages=" + config['cages']
+    if config.get('restarts'):
+        label += " restarts"
+    if config.get('seed') is not None:
+        label += " seed={}".format(config['seed'])
+    return label
+
+
+class WorkerStats:
+    '''What one worker of a portfolio reported.
+
+       status is that of its SearchOutcome ('solved', 'unsat', 'limit' or
+       'cancelled'), 'error' if the worker failed, or 'killed' if it did
+       not stop when cancelled and had to be terminated. solution is the
+       board as a list of rows of values, or None. build is the time taken
+       by kenken_csp_model and elapsed the search time, in seconds.
+       exitcode is that of a worker process that died without reporting
+       (its status is then 'error'), otherwise None.'''
+
+    def __init__(self, index, label, status, solution=None, nDecisions=0,
+                 nNodes=0, nPrunings=0, build=0.0, elapsed=0.0, exitcode=None):
+        self.index = index
+        self.label = label
+        self.status = status
+        self.solution = solution
+        self.nDecisions = nDecisions
+        self.nNodes = nNodes
+        self.nPrunings = nPrunings
+        self.build = build
+        self.elapsed = elapsed
+        self.exitcode = exitcode
+
+    def __str__(self):
+        line = "{:>2} {:<9} {:>9} decisions {:>8.3f}s build {:>8.3f}s search  {}".format(
+            self.index, self.status, self.nDecisions, self.build, self.elapsed, self.label)
+        if self.exitcode is not None:
+            line += " (exit code {})".format(self.exitcode)
+        return line
+
+
+class PortfolioOutcome:
+    '''The result of solve_portfolio.
+
+       status is the status of the winning worker ('solved' or 'unsat'),
+       'error' if every worker failed, or 'limit' if no worker finished
+       otherwise. solution is the winner's board
+       (a list of rows of values) or None, winner its WorkerStats or None,
+       workers the WorkerStats of every worker in configuration order and
+       elapsed the wall clock time of the whole portfolio.'''
+
+    def __init__(self, winner, workers, elapsed):
+        self.winner = winner
+        self.workers = workers
+        self.elapsed = elapsed
+        if winner is None:
+            if workers and all(stats.status == 'error' for stats in workers):
+                self.status = 'error'
+            else:
+                self.status = 'limit'
+            self.solution = None
+        else:
+            self.status = winner.status
+            self.solution = winner.solution
+
+    def __str__(self):
+        if self.status == 'error':
+            lines = ["every worker failed in {:.3f}s".format(self.elapsed)]
+        elif self.winner is None:
+            lines = ["no worker finished in {:.3f}s".format(self.elapsed)]
+        else:
+            lines = ["{} by worker {} in {:.3f}s".format(
+                self.status, self.winner.index, self.elapsed)]
+        for stats in self.workers:
+            lines.append(str(stats))
+        return "\n".join(lines)
+
+
+def portfolio_worker(index, kenken_grid, config, cancel, results, time_limit=None):
+    '''Body of a portfolio worker process: build the CSP of kenken_grid,
+       search it as config says until done or cancel is set, and put a
+       WorkerStats on the results queue'''
+    label = config_label(config)
+    try:
+        if config.get('seed') is not None:
+            random.seed(config['seed'])
+        stime = time.perf_counter()
+        csp, board = kenken_csp_model(kenken_grid, config.get('var_type', Variable),
+                                      config.get('alldiff'), config.get('cages', 'table'))
+        build = time.perf_counter() - stime
+        solver = BT(csp)
+        if config.get('restarts'):
+            outcome = solver.solve_restarts(config['prop'], config.get('var_ord'),
+                                            config.get('val_ord'), seed=config.get('seed'),
+                                            time_limit=time_limit, cancel=cancel)
+        else:
+            outcome = solver.solve(config['prop'], config.get('var_ord'),
+                                   config.get('val_ord'), time_limit=time_limit,
+                                   cancel=cancel)
+        solution = None
+        if outcome.status == 'solved':
+            solution = [[var.get_assigned_value() for var in row] for row in board]
+        results.put(WorkerStats(index, label, outcome.status, solution, outcome.nDecisions,
+                                outcome.nNodes, outcome.nPrunings, build, outcome.elapsed))
+    except Exception as e:
+        print("ERROR portfolio worker {} ({}) failed: {!r}".format(index, label, e))
+        results.put(WorkerStats(index, label, 'error'))
+
+
+def solve_portfolio(kenken_grid, configs=None, workers=None, time_limit=None, grace=1.0):
+    '''Solve kenken_grid with a portfolio of configurations, one worker
+       process each, and return a PortfolioOutcome.
+
+       configs defaults to portfolio_configs(workers), and workers to the
+       number of CPUs. Each worker gives up after time_limit seconds of
+       search, and the portfolio stops waiting for them time_limit +
+       grace seconds after it started (the grace allowing for building
+       the models). Once a worker has finished the others are cancelled;
+       they stop before their next decision, and any still running grace
+       seconds later are terminated.'''
+
+    if configs is None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        configs = portfolio_configs(workers)
+
+    stime = time.perf_counter()
+    ctx = multiprocessing.get_context()
+    cancel = ctx.Event()
+    results = ctx.Queue()
+    procs = []
+    for i, config in enumerate(configs):
+        proc = ctx.Process(target=portfolio_worker,
+                           args=(i, kenken_grid, config, cancel, results, time_limit))
+        proc.daemon = True
+        proc.start()
+        procs.append(proc)
+
+    stats = [None] * len(configs)
+    winner = None
+    #without a time limit wait as long as it takes
+    deadline = None if time_limit is None else stime + time_limit + grace
+    pending = len(configs)
+    while pending:
+        timeout = PORTFOLIO_POLL
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.perf_counter())
+            if timeout <= 0:
+                break
+        try:
+            reported = [results.get(timeout=timeout)]
+        except queue.Empty:
+            reported = []
+        #a worker that died (killed, crashed or exited) without reporting
+        #would be waited for forever: once its process is gone, take any
+        #results already sent, then count it as failed
+        dead = [i for i, proc in enumerate(procs)
+                if stats[i] is None and proc.exitcode is not None]
+        if dead:
+            try:
+                while True:
+                    reported.append(results.get_nowait())
+            except queue.Empty:
+                pass
+        for worker in reported:
+            stats[worker.index] = worker
+            pending -= 1
+            if winner is None and worker.status in ('solved', 'unsat'):
+                winner = worker
+                cancel.set()
+                stop = time.perf_counter() + grace
+                deadline = stop if deadline is None else min(deadline, stop)
+        for i in dead:
+            if stats[i] is None:
+                print("ERROR portfolio worker {} ({}) exited with code {} without a result".format(
+                    i, config_label(configs[i]), procs[i].exitcode))
+                stats[i] = WorkerStats(i, config_label(configs[i]), 'error',
+                                       exitcode=procs[i].exitcode)
+                pending -= 1
+
+    cancel.set()
+    for proc in procs:
+        proc.join(timeout=grace)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    for i, config in enumerate(configs):
+        if stats[i] is None:
+            stats[i] = WorkerStats(i, config_label(config), 'killed')
+
+    return PortfolioOutcome(winner, stats, time.perf_counter() - stime)
+
+
+def eps_subproblems(csp, propagator, n):
+    '''Split the search of csp into at least n subproblems (fewer if the
+       search tree is too small), for embarrassingly parallel search.
+
+       Each subproblem is the list of the current domains of the
+       variables of csp, as bitmasks (see Variable.cur_domain_mask); see
+       BT.solutions for searching one. Starting from the domains left by
+       propagating at the root, every subproblem of the frontier is split
+       on its variable with the smallest domain of two or more values
+       (one subproblem per value, propagated after assigning it) until
+       there are n subproblems or none can be split. The subproblems are
+       in depth first order, so that the earlier ones hold the solutions
+       a sequential search would find first. Returns [] if the
+       propagator refutes csp at the root.'''
+
+    solver = BT(csp)
+    solver.restore_all_variable_domains()
+    trail = csp.trail
+    frontier = []
+    if solver.propagate(propagator):
+        frontier.append([v.cur_domain_mask() for v in csp.vars])
+
+    split = True
+    while split and 0 < len(frontier) < n:
+        split = False
+        children = []
+        for domains in frontier:
+            solver.restore_all_variable_domains()
+            solver.restrict_domains(domains)
+            var = None
+            for v in csp.vars:
+                size = v.cur_domain_size()
+                if size > 1 and (var is None or size < var.cur_domain_size()):
+                    var = v
+            if var is None:
+                children.append(domains)
+                continue
+            split = True
+            for val in var.cur_domain():
+                mark = trail.checkpoint()
+                var.assign(val)
+                if solver.propagate(propagator, var):
+                    children.append([v.cur_domain_mask() for v in csp.vars])
+                trail.rollback(mark)
+                var.unassign()
+        frontier = children
+
+    solver.restore_all_variable_domains()
+    return frontier
+
+
+class EPSOutcome:
+    '''The result of solve_eps.
+
+       status is 'solved' or 'unsat'. In 'first' mode solution is a
+       solution board (a list of rows of values) or None; in 'count'
+       mode count is the number of solutions. nSubproblems is the number
+       of subproblems the search was split into and nSolved the number
+       searched before the result was known. nDecisions and nNodes are
+       totals over the subproblems searched. split is the wall clock
+       time of the decomposition, busy the summed search time of the
+       workers and elapsed the wall clock time of the whole search.'''
+
+    def __init__(self, mode, solution, count, nSubproblems):
+        self.mode = mode
+        self.solution = solution
+        self.count = count
+        self.nSubproblems = nSubproblems
+        self.nSolved = 0
+        self.nDecisions = 0
+        self.nNodes = 0
+        self.split = 0.0
+        self.busy = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def status(self):
+        return 'solved' if self.count else 'unsat'
+
+    def __str__(self):
+        if self.mode == 'count':
+            result = "{} solutions".format(self.count)
+        else:
+            result = self.status
+        return "{}: {} of {} subproblems, {} decisions, {} nodes, split {:.3f}s, busy {:.3f}s, {:.3f}s".format(
+            result, self.nSolved, self.nSubproblems, self.nDecisions, self.nNodes,
+            self.split, self.busy, self.elapsed)
+
+
+#The model of each EPS worker process, built once by eps_init
+EPS_WORKER = dict()
+
+def eps_init(kenken_grid, config, cancel):
+    '''Initializer of an EPS worker process: build the CSP of kenken_grid
+       as config says, once for all the subproblems the worker searches'''
+    csp, board = kenken_csp_model(kenken_grid, config.get('var_type', Variable),
+                                  config.get('alldiff'), config.get('cages', 'table'))
+    EPS_WORKER['solver'] = BT(csp)
+    EPS_WORKER['board'] = board
+    EPS_WORKER['config'] = config
+    EPS_WORKER['cancel'] = cancel
+
+def eps_task(domains, mode):
+    '''Search the subproblem domains in an EPS worker. Returns (status,
+       solution board or None, number of solutions, decisions, nodes,
+       search time).'''
+    solver = EPS_WORKER['solver']
+    config = EPS_WORKER['config']
+    stime = time.perf_counter()
+    if mode == 'count':
+        count = solver.count_solutions(config['prop'], config.get('var_ord'),
+                                       config.get('val_ord'), domains=domains)
+        status = 'solved' if count else 'unsat'
+        solution = None
+    else:
+        outcome = solver.solve(config['prop'], config.get('var_ord'), config.get('val_ord'),
+                               cancel=EPS_WORKER['cancel'], domains=domains)
+        status = outcome.status
+        solution = None
+        count = 0
+        if status == 'solved':
+            count = 1
+            solution = [[var.get_assigned_value() for var in row]
+                        for row in EPS_WORKER['board']]
+            solver.restore_all_variable_domains()
+    return (status, solution, count, solver.nDecisions, solver.nNodes,
+            time.perf_counter() - stime)
+
+
+def solve_eps(kenken_grid, config, mode='first', workers=None, subproblems=None):
+    '''Embarrassingly parallel search of kenken_grid with the propagator
+       and heuristics of config (a configuration as for solve_portfolio).
+       Returns an EPSOutcome.
+
+       The search is split into subproblems (eps_subproblems; 30 per
+       worker by default, so that uneven subproblems even out) which are
+       handed to a pool of workers, each with its own copy of the model,
+       one at a time as the workers become free. In 'first' mode the
+       first solution found ends the search: the subproblems not yet
+       started are dropped and the running ones cancelled. In 'count'
+       mode every subproblem is searched and their solutions counted.'''
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if subproblems is None:
+        subproblems = 30 * workers
+
+    stime = time.perf_counter()
+    csp, board = kenken_csp_model(kenken_grid, config.get('var_type', Variable),
+                                  config.get('alldiff'), config.get('cages', 'table'))
+    parts = eps_subproblems(csp, config['prop'], subproblems)
+    outcome = EPSOutcome(mode, None, 0, len(parts))
+    outcome.split = time.perf_counter() - stime
+
+    ctx = multiprocessing.get_context()
+    cancel = ctx.Event()
+    with concurrent.futures.ProcessPoolExecutor(workers, ctx, eps_init,
+                                                (kenken_grid, config, cancel)) as pool:
+        futures = [pool.submit(eps_task, domains, mode) for domains in parts]
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            status, solution, count, decisions, nodes, busy = future.result()
+            if status == 'cancelled':
+                continue
+            outcome.nSolved += 1
+            outcome.count += count
+            outcome.nDecisions += decisions
+            outcome.nNodes += nodes
+            outcome.busy += busy
+            if mode != 'count' and solution is not None and outcome.solution is None:
+                outcome.solution = solution
+                cancel.set()
+                for f in futures:
+                    f.cancel()
+
+    outcome.elapsed = time.perf_counter() - stime
+    return outcome
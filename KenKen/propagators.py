@@ -26,14 +26,31 @@
        in this case bt_search will backtrack
        return is true if we can continue.
 
-      The list of variable values pairs are all of the values
-      the propagator pruned (using the variable's prune_value method).
-      bt_search NEEDS to know this in order to correctly restore these
-      values when it undoes a variable assignment.
+      Values are pruned through the CSP's trail, csp.trail.prune(var, val),
+      which records them so bt_search can restore them when it undoes a
+      variable assignment. The propagators in this file do this and
+      return an empty list.
+
+      Older propagators may instead prune values themselves (using the
+      variable's prune_value method) and return them in the list;
+      bt_search then records them on the trail for them. A pruning must
+      not be both made through the trail and returned.
 
       NOTE propagator SHOULD NOT prune a value that has already been
       pruned! Nor should it prune a value twice
 
+      When a propagator fails because of a constraint (a domain wipe
+      out, or a violated constraint) it calls csp.record_conflict(c),
+      which the conflict-weighted heuristics use. Before pruning values
+      for constraint c it sets csp.trail.cause = c, so that backjumping
+      search can tell which assignments caused the prunings.
+
+      A search with a time limit or cancel token has to be able to stop
+      while the propagator runs, so propagators that may take long call
+      csp.trail.check_interrupt() as they go (gac_enforce does so before
+      every revision). It raises SearchInterrupted, which the search
+      catches.
+
       PROPAGATOR called with newly_instantiated_variable = None
       PROCESSING REQUIRED:
         for plain backtracking (where we only check fully instantiated
@@ -59,6 +76,8 @@
 
          for gac we initialize the GAC queue with all constraints containing V.
    '''
+from cspbase import Constraint, TableConstraint, CompactTableConstraint, SearchInterrupted
+from collections import deque
 
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no
@@ -73,6 +92,7 @@ def prop_BT(csp, newVar=None):
             for var in vars:
                 vals.append(var.get_assigned_value())
             if not c.check(vals):
+                csp.record_conflict(c)
                 return False, []
     return True, []
 
@@ -81,7 +101,7 @@ def prop_FC(csp, newVar=None):
     Forward checking: check constraints with only one uninstantiated variable.
     '''
 
-    pruned_vals = []
+    trail = csp.trail
 
     if newVar is None:
         cons = csp.get_all_cons()
@@ -92,23 +112,29 @@ def prop_FC(csp, newVar=None):
         #if there is only 1 unassigned variable in c do FC
         if c.get_n_unasgn() == 1:
             x = c.get_unasgn_vars()[0]
+            trail.cause = c
+            #binary tables: one AND with a precomputed bit-matrix row
+            if c.is_binary_table():
+                if not c.binary_fc(trail, x):
+                    csp.record_conflict(c)
+                    return (False, [])
+                continue
             for d in x.cur_domain():
                 x.assign(d)
                 vars = c.get_scope()
                 vals = []
                 for var in vars:
                     vals.append(var.get_assigned_value())
-                if not c.check(vals):
-                    if (x, d) not in pruned_vals:
-                        x.prune_value(d)
-                        pruned_vals.append((x, d))
-                #unassign x and repeat the process
+                #unassign x before pruning d from its current domain
                 x.unassign()
-                #stop when DWO reached - no valid assignment of values to satisfy the constraints
-                if x.cur_domain_size() == 0:
-                    return (False, pruned_vals)
+                if not c.check(vals):
+                    trail.prune(x, d)
+            #stop when DWO reached - no valid assignment of values to satisfy the constraints
+            if x.cur_domain_size() == 0:
+                csp.record_conflict(c)
+                return (False, [])
 
-    return (True, pruned_vals)
+    return (True, [])
 
 
 def prop_GAC(csp, newVar=None):
@@ -117,7 +143,7 @@ def prop_GAC(csp, newVar=None):
     Otherwise we do GAC enforce with onstraints containing newVar on GAC Queue
     '''
 
-    pruned_vals = []
+    trail = csp.trail
 
     if newVar is None:
         cons = csp.get_all_cons()
@@ -125,16 +151,165 @@ def prop_GAC(csp, newVar=None):
         cons = csp.get_cons_with_var(newVar)
 
     for c in cons:
+        trail.check_interrupt()
+        trail.cause = c
+        if c.is_binary_table():
+            if not c.binary_revise(trail)[0]:
+                csp.record_conflict(c)
+                return (False, [])
+            continue
         for x in c.get_scope():
             for d in x.cur_domain():
+                trail.check_interrupt()
                 #first check if c has support when x = d
                 if not c.has_support(x, d):
-                    if (x, d) not in pruned_vals:
-                        x.prune_value(d)
-                        pruned_vals.append((x, d))
+                    trail.prune(x, d)
                 #DWO reachced - stop
                 if x.cur_domain_size() == 0:
-                    return (False, pruned_vals)
+                    csp.record_conflict(c)
+                    return (False, [])
+
+    return (True, [])
+
+
+
+def gac_enforce(csp, cons):
+    '''
+    Worklist GAC: revise the constraints in cons until no more values can
+    be pruned. Whenever a constraint shrinks the domain of a variable,
+    every constraint on that variable that is not already on the queue is
+    put back on it. Returns False as soon as a domain is wiped out.
+    '''
+
+    trail = csp.trail
+    queue = deque(cons)
+    on_queue = set(queue)
+
+    while queue:
+        c = queue.popleft()
+        on_queue.discard(c)
+        trail.check_interrupt()
+        trail.cause = c
+        #revise with the propagator's own version of c, if it has one
+        r = csp.view(c)
+        status, changed = r.gac_revise(trail)
+        if not status:
+            csp.record_conflict(c)
+            return False
+        for var in changed:
+            for c2 in csp.get_cons_with_var(var):
+                if c2 is c and r.idempotent:
+                    continue
+                if c2 not in on_queue:
+                    queue.append(c2)
+                    on_queue.add(c2)
+
+    return True
+
+
+def prop_GAC3(csp, newVar=None):
+    '''
+    GAC-3 propagation run to a fixpoint. If newVar is None all constraints start
+    on the queue, otherwise only the constraints containing newVar do.
+    '''
+
+    if newVar is None:
+        cons = csp.get_all_cons()
+    else:
+        cons = csp.get_cons_with_var(newVar)
+
+    return (gac_enforce(csp, cons), [])
+
+
+def table_views(csp, key, convert):
+    '''
+    Return a dict mapping every plain table constraint c of csp to
+    convert(c), a constraint over the same scope and relation that keeps
+    its own filtering state. csp itself is not changed. The views are kept
+    in csp.view_cache[key]; when the constraints of csp change, views of
+    the constraints (with the same relation) that are still there are
+    reused and the others dropped. Converting large tables takes a while,
+    so the search's interrupt is checked between conversions; if it
+    stops the search, the views made so far are kept for the next call.
+    '''
 
-    return (True, pruned_vals)
+    cached = csp.view_cache.get(key)
+    if cached is not None and cached[0] == csp.cons_version:
+        views = cached[1]
+        if all(v.relation is c.relation for c, v in views.items()):
+            return views
+    old = cached[1] if cached is not None else dict()
+    views = dict()
+    try:
+        for c in csp.get_all_cons():
+            if type(c) is Constraint:
+                v = old.get(c)
+                if v is None or v.relation is not c.relation:
+                    csp.trail.check_interrupt()
+                    v = convert(c)
+                views[c] = v
+    except SearchInterrupted:
+        #no version matches None, so the next call reuses these views
+        #and converts the rest
+        csp.view_cache[key] = (None, views)
+        raise
+    csp.view_cache[key] = (csp.cons_version, views)
+    return views
+
+
+def str2_table(c):
+    '''
+    Return plain table constraint c as a TableConstraint; other constraints are
+    returned unchanged.
+    '''
+
+    if type(c) is Constraint:
+        return TableConstraint.from_constraint(c)
+    return c
+
+
+def prop_STR2(csp, newVar=None):
+    '''
+    GAC propagation with Simple Tabular Reduction. The plain table constraints
+    of csp are filtered by TableConstraint views sharing their tuples (see
+    table_views), set up on the initial call (newVar is None); the model
+    itself is not changed. GAC is run to a fixpoint as in prop_GAC3.
+    '''
+
+    if newVar is None or csp.views is None:
+        csp.views = table_views(csp, 'str2', str2_table)
+    if newVar is None:
+        cons = csp.get_all_cons()
+    else:
+        cons = csp.get_cons_with_var(newVar)
+
+    return (gac_enforce(csp, cons), [])
+
+
+def ct_table(c):
+    '''
+    Return plain table constraint c as a CompactTableConstraint; other constraints
+    are returned unchanged.
+    '''
+
+    if type(c) is Constraint:
+        return CompactTableConstraint.from_constraint(c)
+    return c
+
+
+def prop_CT(csp, newVar=None):
+    '''
+    GAC propagation with Compact-Table. The plain table constraints of csp are
+    filtered by CompactTableConstraint views sharing their tuples (see
+    table_views), set up on the initial call (newVar is None); the model
+    itself is not changed. GAC is run to a fixpoint as in prop_GAC3.
+    '''
+
+    if newVar is None or csp.views is None:
+        csp.views = table_views(csp, 'ct', ct_table)
+    if newVar is None:
+        cons = csp.get_all_cons()
+    else:
+        cons = csp.get_cons_with_var(newVar)
 
+    return (gac_enforce(csp, cons), [])
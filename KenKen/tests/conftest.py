@@ -0,0 +1,6 @@
+'''The solver modules are flat modules in KenKen/ that import each other
+by name (from cspbase import *), so put that directory on the path.'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+'''Small random KenKen puzzles for the tests.'''
+import random
+
+
+def latin_square(n, rng):
+    '''A random n x n latin square over 1..n'''
+    rows = [[(r + c) % n + 1 for c in range(n)] for r in range(n)]
+    rng.shuffle(rows)
+    cols = list(range(n))
+    rng.shuffle(cols)
+    perm = list(range(1, n + 1))
+    rng.shuffle(perm)
+    return [[perm[row[c] - 1] for c in cols] for row in rows]
+
+
+def random_puzzle(n, seed, ops=(0, 1, 2, 3)):
+    '''A random kenken_grid of size n whose cages (of 2 to 4 cells) hold
+       a random latin square. The cage operations are drawn from ops (0
+       add, 1 subtract, 2 divide, 3 multiply; subtract and divide only
+       for 2-cell cages); with only add, the puzzles usually have more
+       than one solution. Returns (kenken_grid, square).'''
+    rng = random.Random(seed)
+    square = latin_square(n, rng)
+    free = {(r, c) for r in range(n) for c in range(n)}
+    cages = []
+    while free:
+        cage = [min(free)]
+        free.discard(cage[0])
+        k = rng.choice([2, 2, 3, 3, 4])
+        while len(cage) < k:
+            nbrs = [(r + dr, c + dc) for (r, c) in cage
+                    for dr, dc in ((0, 1), (1, 0), (0, -1), (-1, 0))
+                    if (r + dr, c + dc) in free]
+            if not nbrs:
+                break
+            cell = rng.choice(nbrs)
+            cage.append(cell)
+            free.discard(cell)
+        if len(cage) == 1:
+            #join a neighbouring cage
+            r, c = cage[0]
+            for other in cages:
+                if any(abs(r - a) + abs(c - b) == 1 for a, b in other):
+                    other.append((r, c))
+                    break
+            continue
+        cages.append(cage)
+
+    kenken_grid = [[n]]
+    for cage in cages:
+        vals = [square[r][c] for r, c in cage]
+        big, small = max(vals), min(vals)
+        choices = [op for op in ops if op in (0, 3) or
+                   (len(cage) == 2 and (op == 1 or big % small == 0))]
+        op = rng.choice(choices or [0])
+        if op == 0:
+            target = sum(vals)
+        elif op == 1:
+            target = big - small
+        elif op == 2:
+            target = big // small
+        else:
+            target = 1
+            for v in vals:
+                target *= v
+        kenken_grid.append([(r + 1) * 10 + c + 1 for r, c in cage] + [target, op])
+    return kenken_grid, square
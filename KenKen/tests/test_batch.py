@@ -0,0 +1,86 @@
+'''Regression checks for the batch solver.'''
+import io
+import os
+import json
+
+import pytest
+
+from batch import *
+from puzzles import random_puzzle
+
+
+def puzzle_lines():
+    lines = []
+    for seed, n in enumerate((4, 5, 4, 6)):
+        kenken_grid, square = random_puzzle(n, seed)
+        if seed % 2:
+            lines.append(json.dumps(kenken_grid))
+        else:
+            lines.append(json.dumps(dict(id="p{}".format(seed), grid=kenken_grid)))
+    lines.append("")
+    lines.append("not json")
+    lines.append(json.dumps([[4], [11, 12, 100, 0]]))
+    return [line + "\n" for line in lines]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_solve_batch(workers):
+    out = io.StringIO()
+    assert solve_batch(puzzle_lines(), out, workers=workers) == 6
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+
+    #in input order, keyed by id or line number; the blank line is skipped
+    assert [r['id'] for r in results] == ["p0", 2, "p2", 4, 6, 7]
+    for r in results[:4]:
+        assert r['status'] == 'solved'
+        sol = r['solution']
+        size = r['size']
+        assert all(sorted(row) == list(range(1, size + 1)) for row in sol)
+        assert all(sorted(col) == list(range(1, size + 1)) for col in zip(*sol))
+    assert results[4]['status'] == 'error'
+    assert results[5]['status'] == 'unsat'
+
+
+@pytest.mark.parametrize('grid', [[[4], [99, 3]], [[4], [11, 50, 5, 0]], [[4], [11, 12, 3, 7]],
+                                  [[4], [11, 12, 3, -1]], [[3], [10, 2]], [[3], [14, 2]]])
+def test_parse_puzzle_checks_cages(grid):
+    with pytest.raises(ValueError, match="bad cage"):
+        parse_puzzle(json.dumps(grid))
+    #and the batch reports it as an error line rather than failing
+    out = io.StringIO()
+    solve_batch([json.dumps(grid)], out, workers=1)
+    result = json.loads(out.getvalue())
+    assert result['status'] == 'error' and result['error'].startswith("ValueError: bad cage")
+
+
+def test_parse_puzzle_accepts_single_cell_cages():
+    assert parse_puzzle(json.dumps([[2], [11, 1], [12, 2], [21, 22, 3, 0]])) == \
+        (None, [[2], [11, 1], [12, 2], [21, 22, 3, 0]])
+
+
+def prop_exit_on_5x5(csp, newVar=None):
+    #the worker dies on the 5x5 puzzle
+    if len(csp.get_all_vars()) == 25:
+        os._exit(3)
+    return prop_GAC3(csp, newVar)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_solve_batch_survives_dead_workers(ordered):
+    out = io.StringIO()
+    config = dict(BATCH_CONFIG, prop=prop_exit_on_5x5)
+    assert solve_batch(puzzle_lines(), out, config, workers=2, ordered=ordered) == 6
+    results = dict((r['id'], r) for r in map(json.loads, out.getvalue().splitlines()))
+    assert sorted(results, key=str) == sorted(["p0", 2, "p2", 4, 6, 7], key=str)
+    assert results[2]['status'] == 'error' and 'died' in results[2]['error']
+    assert [results[i]['status'] for i in ("p0", "p2", 4, 7)] == ['solved'] * 3 + ['unsat']
+
+
+def test_main_reads_and_writes_files(tmp_path):
+    infile = tmp_path / "in.jsonl"
+    outfile = tmp_path / "out.jsonl"
+    infile.write_text("".join(puzzle_lines()))
+    main([str(infile), '-o', str(outfile), '--workers', '1',
+          '--var-ord', 'ord_dom_wdeg', '--val-ord', 'none'])
+    results = [json.loads(line) for line in outfile.read_text().splitlines()]
+    assert [r['status'] for r in results] == ['solved'] * 4 + ['error', 'unsat']
@@ -0,0 +1,97 @@
+'''Regression checks for compiled relations and CSP.save_compiled /
+CSP.load_compiled.'''
+import json
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from puzzles import random_puzzle
+
+
+def search(csp, prop):
+    solver = BT(csp)
+    outcome = solver.solve(prop, ord_mrv, val_lcv)
+    return (outcome.status, solver.nDecisions, solver.nPrunings,
+            [v.get_assigned_value() for v in csp.vars])
+
+
+def test_compiled_relation_matches_relation():
+    r = Relation([(1, 2), (2, 1), (3, 3), (1, 3)], 2)
+    cr = CompiledRelation(*CompiledRelation.from_relation(r))
+    assert len(cr) == len(r)
+    for i in range(2):
+        for val in range(0, 5):
+            sups = cr.supports[i].get(val)
+            assert (sups is None) == (r.supports[i].get(val) is None)
+            if sups is not None:
+                assert list(sups) == r.supports[i][val]
+                assert [sups[j] for j in range(len(sups))] == r.supports[i][val]
+            assert (val in cr.supports[i]) == (val in r.supports[i])
+    for t in [(1, 2), (3, 3), (2, 2), (0, 1), (1, 4), (1,), ('a', 1)]:
+        assert (t in cr) == (t in r)
+    assert cr.tuples == r.tuples and cr.sat == r.sat
+
+    empty = CompiledRelation(*CompiledRelation.from_relation(Relation([], 3)))
+    assert len(empty) == 0 and empty.supports[0].get(1) is None and (1, 1, 1) not in empty
+    assert CompiledRelation.from_relation(Relation([('a', 'b')], 2)) is None
+
+
+@pytest.mark.parametrize('kw, prop', [
+    (dict(), prop_GAC3),
+    (dict(), prop_STR2),
+    (dict(), prop_CT),
+    (dict(grid='binary'), prop_FC),
+    (dict(var_type=BitVariable, alldiff='gac', cages='arith'), prop_GAC3),
+    (dict(alldiff='fc'), prop_GAC)])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_and_load_compiled(tmp_path, kw, prop, mmap):
+    kenken_grid, square = random_puzzle(5, 3)
+    csp, board = kenken_csp_model(kenken_grid, **kw)
+    assert csp.save_compiled(str(tmp_path))
+    loaded = CSP.load_compiled(str(tmp_path), mmap)
+    assert [(type(v), v.name, v.domain()) for v in loaded.vars] == \
+        [(type(v), v.name, v.domain()) for v in csp.vars]
+    assert [(type(c), c.name) for c in loaded.cons] == [(type(c), c.name) for c in csp.cons]
+    assert search(loaded, prop) == search(csp, prop)
+
+
+@pytest.mark.parametrize('prop', [prop_GAC3, prop_CT])
+def test_search_does_not_build_the_tuples(tmp_path, prop):
+    kenken_grid, square = random_puzzle(6, 3)
+    csp, board = kenken_csp_model(kenken_grid)
+    assert csp.save_compiled(str(tmp_path))
+    loaded = CSP.load_compiled(str(tmp_path))
+    assert search(loaded, prop) == search(csp, prop)
+    assert all(c.relation._tuples is None and c.relation._sat is None for c in loaded.cons)
+
+
+def test_load_compiled_missing_directory(tmp_path, capsys):
+    assert CSP.load_compiled(str(tmp_path / 'missing')) is None
+    assert "ERROR" in capsys.readouterr().out
+
+
+def test_load_compiled_only_creates_known_classes(tmp_path, capsys):
+    kenken_grid, square = random_puzzle(4, 0)
+    csp, board = kenken_csp_model(kenken_grid)
+    assert csp.save_compiled(str(tmp_path))
+    meta_path = tmp_path / 'csp.json'
+    meta = json.loads(meta_path.read_text())
+    meta['vars'][0]['cls'] = 'os:system'
+    meta_path.write_text(json.dumps(meta))
+    assert CSP.load_compiled(str(tmp_path)) is None
+    assert "COMPILED_CLASSES" in capsys.readouterr().out
+
+
+class OtherVariable(Variable):
+    pass
+
+
+def test_save_compiled_only_saves_known_classes(tmp_path, capsys):
+    csp = CSP('other', [OtherVariable('x', [1, 2])])
+    assert not csp.save_compiled(str(tmp_path))
+    assert "COMPILED_CLASSES" in capsys.readouterr().out
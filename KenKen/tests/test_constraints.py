@@ -0,0 +1,49 @@
+'''Regression checks for the constraint classes of cspbase.'''
+import itertools
+
+from cspbase import *
+
+
+def not_equal(x, y):
+    c = Constraint("C({},{})".format(x.name, y.name), [x, y],
+                   Relation(itertools.permutations([1, 2, 3], 2), 2))
+    return c
+
+
+def test_residue_hits_only_count_stored_residues():
+    x = Variable('x', [1, 2, 3])
+    y = Variable('y', [1, 2, 3])
+    c = not_equal(x, y)
+
+    #first lookup: no residue was stored yet, so it is not a hit
+    assert c.has_support(x, 1)
+    assert c.nResidueHits == 0
+
+    #the support found first is stored and answers the next lookup
+    assert c.has_support(x, 1)
+    assert c.nResidueHits == 1
+
+    #once the residue is lost the search moves on and stores a new one
+    y.prune_value(2)
+    assert c.has_support(x, 1)
+    assert c.nResidueHits == 1
+    assert c.has_support(x, 1)
+    assert c.nResidueHits == 2
+
+
+def test_support_count_samples_large_support_lists():
+    vars = [Variable('x{}'.format(i), list(range(1, 7))) for i in range(4)]
+    c = Constraint('C', vars, Relation(itertools.permutations(range(1, 7), 4), 4))
+    #x0=1 has 5*4*3 = 60 supports: counted exactly
+    assert c.support_count(vars[0], 1) == 60
+    vars[1].prune_value(2)
+    assert c.support_count(vars[0], 1) == 48
+
+    #with fewer supports scanned, every second one is checked and the
+    #count doubled
+    c.max_support_scan = 30
+    vars[1].unprune_value(2)
+    assert c.support_count(vars[0], 1) == 60
+    for val in (2, 3, 4):
+        vars[1].prune_value(val)
+    assert c.support_count(vars[0], 1) == 24
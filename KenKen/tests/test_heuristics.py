@@ -0,0 +1,25 @@
+'''Regression checks for the variable and value ordering heuristics.'''
+import gc
+import weakref
+
+import pytest
+
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from puzzles import random_puzzle
+
+
+@pytest.mark.parametrize('var_ord, indexes', [(ord_mrv_inc, MRV_INDEXES),
+                                              (ord_dom_wdeg, WDEG_INDEXES)])
+def test_indexes_do_not_keep_the_csp_alive(var_ord, indexes):
+    kenken_grid, square = random_puzzle(4, 0)
+    csp, board = kenken_csp_model(kenken_grid)
+    assert BT(csp).solve(prop_GAC3, var_ord, val_lcv).status == 'solved'
+    assert csp in indexes
+
+    ref = weakref.ref(csp)
+    del csp
+    gc.collect()
+    assert ref() is None
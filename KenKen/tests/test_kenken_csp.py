@@ -0,0 +1,56 @@
+'''Regression checks for the KenKen models.'''
+import pytest
+
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from puzzles import random_puzzle
+
+
+@pytest.mark.parametrize('prop', [prop_GAC3, prop_STR2, prop_CT])
+def test_grid_model_solves_puzzles_in_a_row(prop, capsys):
+    model = GridModel(5)
+    n_grid = len(model.grid_cons)
+    for seed in range(3):
+        kenken_grid, square = random_puzzle(5, seed)
+        csp, board = model.set_puzzle(kenken_grid)
+        assert len(csp.get_all_cons()) == n_grid + len(kenken_grid) - 1
+        assert all(c.weight == 1 for c in model.grid_cons)
+        outcome = BT(csp).solve(prop, ord_dom_wdeg, val_lcv_support)
+        assert outcome.status == 'solved'
+        assert all(c.check([var.get_assigned_value() for var in c.get_scope()])
+                   for c in csp.get_all_cons())
+    assert "ERROR" not in capsys.readouterr().out
+
+
+def test_binary_grid_rejects_alldiff():
+    kenken_grid, square = random_puzzle(4, 0)
+    with pytest.raises(ValueError):
+        kenken_csp_model(kenken_grid, alldiff='gac', grid='binary')
+    csp, board = kenken_csp_model(kenken_grid, grid='binary')
+    assert BT(csp).count_solutions(prop_GAC3) == \
+        BT(kenken_csp_model(kenken_grid)[0]).count_solutions(prop_GAC3)
+
+
+@pytest.mark.parametrize('cages', ['table', 'arith'])
+@pytest.mark.parametrize('op', [4, -1, 7])
+def test_bad_cage_operation_is_rejected(cages, op):
+    kenken_grid = [[4], [11, 12, 13, 2, op]]
+    with pytest.raises(ValueError, match=r"bad operation .* in cage \[11, 12, 13, 2, {}\]".format(op)):
+        kenken_csp_model(kenken_grid, cages=cages, cage_cache=None)
+    with pytest.raises(ValueError):
+        GridModel(4).set_puzzle(kenken_grid, cages)
+
+
+def test_cage_table_cache_on_disk(tmp_path):
+    kenken_grid, square = random_puzzle(5, 4)
+    first = CageTableCache(directory=str(tmp_path))
+    csp, board = kenken_csp_model(kenken_grid, cage_cache=first)
+    assert first.misses > 0 and first.disk_hits == 0
+
+    second = CageTableCache(directory=str(tmp_path))
+    loaded, board = kenken_csp_model(kenken_grid, cage_cache=second)
+    assert second.misses == 0 and second.disk_hits == first.misses
+    assert [c.relation.tuples for c in loaded.get_all_cons()] == \
+        [c.relation.tuples for c in csp.get_all_cons()]
@@ -0,0 +1,95 @@
+'''Regression checks for parallel search.'''
+import os
+import time
+
+from parallel import *
+from benchmarks import BOARDS
+from puzzles import random_puzzle
+
+
+def is_latin(rows):
+    n = len(rows)
+    return (all(sorted(row) == list(range(1, n + 1)) for row in rows) and
+            all(sorted(col) == list(range(1, n + 1)) for col in zip(*rows)))
+
+
+def test_portfolio_solves():
+    kenken_grid, square = random_puzzle(5, 1)
+    outcome = solve_portfolio(kenken_grid, workers=2, time_limit=60)
+    assert outcome.status == 'solved'
+    assert is_latin(outcome.solution)
+    assert [stats.index for stats in outcome.workers] == [0, 1]
+
+
+def prop_broken(csp, newVar=None):
+    raise RuntimeError("broken propagator")
+
+
+def test_portfolio_reports_errors():
+    kenken_grid, square = random_puzzle(4, 1)
+    configs = [dict(prop=prop_broken), dict(prop=prop_broken, var_ord=ord_mrv)]
+    outcome = solve_portfolio(kenken_grid, configs, time_limit=10)
+    assert outcome.status == 'error'
+    assert outcome.solution is None
+    assert [stats.status for stats in outcome.workers] == ['error', 'error']
+
+
+def prop_exit(csp, newVar=None):
+    os._exit(3)
+
+
+def test_portfolio_survives_dead_workers():
+    kenken_grid, square = random_puzzle(4, 1)
+    configs = [dict(prop=prop_exit), dict(prop=prop_exit, var_ord=ord_mrv)]
+    outcome = solve_portfolio(kenken_grid, configs)
+    assert outcome.status == 'error'
+    assert [(stats.status, stats.exitcode) for stats in outcome.workers] == [('error', 3)] * 2
+
+    #the other workers still win
+    configs = [dict(prop=prop_exit), dict(prop=prop_GAC3, var_ord=ord_mrv)]
+    outcome = solve_portfolio(kenken_grid, configs)
+    assert outcome.status == 'solved' and outcome.winner.index == 1
+    assert outcome.workers[0].status == 'error'
+
+
+def test_portfolio_time_limit_is_overall():
+    configs = [dict(prop=prop_BT), dict(prop=prop_BT, var_ord=ord_mrv)]
+    stime = time.perf_counter()
+    outcome = solve_portfolio(BOARDS[9], configs, time_limit=0.5, grace=0.5)
+    assert outcome.status == 'limit'
+    assert time.perf_counter() - stime < 5
+
+
+
+def test_eps_subproblems_partition_the_search():
+    kenken_grid, square = random_puzzle(5, 2, (0,))
+    csp, board = kenken_csp_model(kenken_grid)
+    expected = BT(csp).count_solutions(prop_GAC3, ord_mrv)
+    subproblems = eps_subproblems(csp, prop_GAC3, 16)
+    assert len(subproblems) >= 16
+    assert sum(BT(csp).count_solutions(prop_GAC3, ord_mrv, domains=domains)
+               for domains in subproblems) == expected
+
+
+def test_eps_agrees_with_sequential_search():
+    config = dict(prop=prop_GAC3, var_ord=ord_mrv, val_ord=val_lcv_support)
+    for kenken_grid in (random_puzzle(5, 2, (0,))[0], random_puzzle(6, 3)[0]):
+        csp, board = kenken_csp_model(kenken_grid)
+        expected = BT(csp).count_solutions(prop_GAC3, ord_mrv)
+        outcome = solve_eps(kenken_grid, config, 'count', workers=2, subproblems=8)
+        assert outcome.status == 'solved' and outcome.count == expected
+        outcome = solve_eps(kenken_grid, config, 'first', workers=2, subproblems=8)
+        assert outcome.status == 'solved'
+        csp, board = kenken_csp_model(kenken_grid)
+        solution = dict(zip([v for row in board for v in row],
+                            [val for row in outcome.solution for val in row]))
+        assert all(c.check([solution[v] for v in c.get_scope()]) for c in csp.get_all_cons())
+
+
+def test_eps_unsat():
+    kenken_grid, square = random_puzzle(5, 1)
+    kenken_grid[1][-2] += 100
+    for mode in ('first', 'count'):
+        outcome = solve_eps(kenken_grid, dict(prop=prop_GAC3, var_ord=ord_mrv), mode,
+                            workers=2, subproblems=8)
+        assert outcome.status == 'unsat'
@@ -0,0 +1,30 @@
+'''Regression checks for the propagators.'''
+import pytest
+
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from puzzles import random_puzzle
+
+
+@pytest.mark.parametrize('prop', [prop_STR2, prop_CT])
+def test_table_propagators_leave_the_model_alone(prop):
+    kenken_grid, square = random_puzzle(4, 2, ops=(0,))
+    csp, board = kenken_csp_model(kenken_grid)
+    cons = list(csp.get_all_cons())
+    version = csp.cons_version
+    solver = BT(csp)
+
+    expected = solver.count_solutions(prop_GAC3, ord_mrv)
+    assert solver.count_solutions(prop, ord_mrv, val_lcv_support) == expected
+    assert csp.get_all_cons() == cons
+    assert csp.cons_version == version
+
+    #the views are reused by the next search, and do not leak into a
+    #search with another propagator
+    views = dict(csp.view_cache)
+    assert solver.count_solutions(prop, ord_mrv) == expected
+    assert all(csp.view_cache[key][1] is views[key][1] for key in views)
+    assert solver.count_solutions(prop_GAC3, ord_mrv) == expected
+    assert csp.views is None
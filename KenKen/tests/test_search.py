@@ -0,0 +1,258 @@
+'''Regression checks for the search methods of BT.'''
+import itertools
+import random
+import threading
+import time
+
+import pytest
+
+from cspbase import *
+from kenken_csp import *
+from propagators import *
+from heuristics import *
+from puzzles import random_puzzle
+from benchmarks import BOARDS
+
+
+def test_limits_are_keyword_only():
+    csp, board = binary_ne_grid([[3]])
+    solver = BT(csp)
+    with pytest.raises(TypeError):
+        solver.solve(prop_FC, ord_mrv, None, 10)
+    with pytest.raises(TypeError):
+        next(solver.solutions(prop_FC, ord_mrv, None, 1))
+    with pytest.raises(TypeError):
+        solver.count_solutions(prop_FC, ord_mrv, None, 1)
+    assert solver.solve(prop_FC, ord_mrv, node_limit=1).status == 'limit'
+    assert solver.count_solutions(prop_FC, ord_mrv, limit=5) == 5
+
+
+def unsat_puzzle(n, seed):
+    '''random_puzzle(n, seed) with the target of one cage moved by one so
+       that it has no solution'''
+    kenken_grid, square = random_puzzle(n, seed)
+    for k in range(1, len(kenken_grid)):
+        for delta in (1, -1):
+            puzzle = [list(cage) for cage in kenken_grid]
+            puzzle[k][-2] += delta
+            if puzzle[k][-2] < 1:
+                continue
+            csp, board = kenken_csp_model(puzzle)
+            if BT(csp).count_solutions(prop_GAC3, ord_mrv) == 0:
+                return puzzle
+
+
+def chain_csp(n):
+    vars = [Variable('x{}'.format(i), [0, 1, 2]) for i in range(n)]
+    csp = CSP('chain', vars)
+    ne = Relation([(a, b) for a in range(3) for b in range(3) if a != b], 2)
+    for i in range(n - 1):
+        csp.add_constraint(Constraint('C{}'.format(i), [vars[i], vars[i + 1]], ne))
+    return csp
+
+
+@pytest.mark.parametrize('prop', [prop_BT, prop_FC, prop_GAC, prop_GAC3])
+def test_count_latin_squares(prop):
+    assert BT(binary_ne_grid([[3]])[0]).count_solutions(prop) == 12
+    assert BT(nary_ad_grid([[3]])[0]).count_solutions(prop, ord_mrv) == 12
+    if prop is not prop_BT:
+        assert BT(binary_ne_grid([[4]])[0]).count_solutions(prop, ord_mrv) == 576
+
+
+def test_solutions_are_distinct_and_valid():
+    csp, board = nary_ad_grid([[4]])
+    solver = BT(csp)
+    seen = set()
+    for solution in solver.solutions(prop_FC, ord_mrv, limit=50):
+        assert all(c.check([solution[v] for v in c.get_scope()]) for c in csp.get_all_cons())
+        seen.add(tuple(solution[v] for v in csp.get_all_vars()))
+    assert len(seen) == 50
+    #the generator undoes everything it did
+    assert all(not v.is_assigned() and v.cur_domain_size() == 4 for v in csp.get_all_vars())
+
+
+def test_deep_search_does_not_recurse():
+    assert BT(chain_csp(5000)).count_solutions(prop_FC, limit=1) == 1
+
+
+#model options and propagators that must all agree on the number of solutions
+MODELS = [dict(), dict(grid='binary'), dict(alldiff='gac'), dict(alldiff='fc'),
+          dict(var_type=BitVariable, alldiff='gac', cages='arith')]
+PROPS = [prop_FC, prop_GAC, prop_GAC3, prop_STR2, prop_CT]
+
+
+#(size, seed, operations): puzzles with one solution and with several
+@pytest.mark.parametrize('n, seed, ops', [(3, 0, (0,)), (3, 1, (0, 1, 2, 3)),
+                                          (4, 0, (0,)), (4, 2, (0,)), (4, 5, (0, 1, 2, 3)),
+                                          (5, 1, (0, 1, 2, 3)), (5, 3, (0,))])
+def test_propagators_agree_on_solution_counts(n, seed, ops):
+    kenken_grid, square = random_puzzle(n, seed, ops)
+    counts = set()
+    for kw in MODELS:
+        for prop in PROPS:
+            if prop is prop_FC and n > 4 and kw.get('grid') != 'binary':
+                #forward checking is slow on the n-ary models
+                continue
+            csp, board = kenken_csp_model(kenken_grid, **kw)
+            counts.add(BT(csp).count_solutions(prop, ord_mrv, val_lcv_support))
+    if n < 5:
+        csp, board = kenken_csp_model(kenken_grid)
+        counts.add(BT(csp).count_solutions(prop_BT, ord_mrv))
+    assert len(counts) == 1
+    assert counts.pop() >= 1
+
+
+def test_check_unique():
+    for kenken_grid, expected in ((random_puzzle(4, 3, (0,))[0], 1),
+                                  (random_puzzle(4, 0, (0,))[0], 'many'),
+                                  (unsat_puzzle(4, 1), 0)):
+        csp, board = kenken_csp_model(kenken_grid)
+        solver = BT(csp)
+        assert solver.check_unique(prop_GAC3, ord_mrv) == expected
+        assert solver.check_unique(prop_FC, ord_mrv, val_lcv) == expected
+        #the second solution is found without starting the search again
+        if expected == 'many':
+            assert solver.nSolutions == 2
+
+
+def test_check_unique_cut_short():
+    csp, board = binary_ne_grid([[5]])
+    solver = BT(csp)
+    assert solver.check_unique(prop_FC, node_limit=3) is None
+    assert solver.stop_reason is not None
+
+
+@pytest.mark.parametrize('schedule', ['luby', 'geometric'])
+@pytest.mark.parametrize('learn', [True, False])
+def test_restarts_agree_with_solve(schedule, learn):
+    for n, seed in ((5, 1), (6, 3)):
+        kenken_grid, square = random_puzzle(n, seed)
+        csp, board = kenken_csp_model(kenken_grid, BitVariable, 'gac', 'arith')
+        cons = list(csp.get_all_cons())
+        solver = BT(csp)
+        expected = solver.count_solutions(prop_GAC3, ord_mrv)
+        outcome = solver.solve_restarts(prop_GAC3, ord_mrv_rand, val_lcv_support_rand,
+                                        schedule, base=2, learn=learn, seed=seed)
+        assert outcome.status == 'solved'
+        assert outcome.nRestarts > 0
+        assert all(c.check([outcome.solution[v] for v in c.get_scope()]) for c in cons)
+        if expected == 1:
+            assert [[outcome.solution[v] for v in row] for row in board] == square
+        assert csp.get_all_cons() == cons
+
+    csp, board = kenken_csp_model(unsat_puzzle(5, 1))
+    outcome = BT(csp).solve_restarts(prop_GAC3, ord_mrv_rand, val_lcv_support_rand,
+                                     schedule, base=2, learn=learn, seed=1)
+    assert outcome.status == 'unsat'
+
+
+def test_restart_nogoods_are_sound():
+    kenken_grid, square = random_puzzle(5, 2, (0,))
+    csp, board = kenken_csp_model(kenken_grid, BitVariable, 'gac', 'arith')
+    solver = BT(csp)
+    expected = solver.count_solutions(prop_GAC3, ord_mrv)
+    outcome = solver.solve_restarts(prop_GAC3, ord_mrv_rand, val_lcv_support_rand,
+                                    base=1, keep_nogoods=True, seed=3)
+    assert outcome.status == 'solved'
+    nogoods = [c for c in csp.get_all_cons() if isinstance(c, NogoodConstraint)]
+    assert nogoods
+    #the kept nogoods only cut off branches without solutions
+    assert solver.count_solutions(prop_GAC3, ord_mrv) == expected
+
+
+def random_csp(rng, i):
+    '''A small random CSP over {0, 1, 2} of binary and ternary tables and
+       the odd AllDiffConstraint'''
+    vars = [BitVariable('v{}'.format(k), [0, 1, 2]) for k in range(rng.randint(4, 7))]
+    csp = CSP('random{}'.format(i), vars)
+    for k in range(rng.randint(len(vars), 3 * len(vars))):
+        scope = rng.sample(vars, rng.choice([2, 2, 3]))
+        if rng.random() < 0.15:
+            csp.add_constraint(AllDiffConstraint('a{}'.format(k), scope))
+        else:
+            tuples = [t for t in itertools.product([0, 1, 2], repeat=len(scope))
+                      if rng.random() < 0.7]
+            c = Constraint('c{}'.format(k), scope)
+            c.add_satisfying_tuples(tuples)
+            csp.add_constraint(c)
+    return csp
+
+
+@pytest.mark.parametrize('prop', [prop_BT, prop_FC, prop_GAC, prop_GAC3])
+@pytest.mark.parametrize('learn', [False, True])
+def test_cbj_agrees_with_solve(prop, learn):
+    rng = random.Random(7)
+    statuses = set()
+    for i in range(60):
+        csp = random_csp(rng, i)
+        cons = list(csp.get_all_cons())
+        var_ord = rng.choice([None, ord_mrv, ord_dom_wdeg])
+        expected = BT(csp).solve(prop_GAC3, ord_mrv).status
+        outcome = BT(csp).solve_cbj(prop, var_ord, None, learn)
+        assert outcome.status == expected
+        if expected == 'solved':
+            assert all(c.check([outcome.solution[v] for v in c.get_scope()]) for c in cons)
+        assert csp.get_all_cons() == cons
+        statuses.add(expected)
+    assert statuses == {'solved', 'unsat'}
+
+
+def test_cbj_backjumps_on_kenken():
+    kenken_grid, square = random_puzzle(4, 1)
+    csp, board = kenken_csp_model(kenken_grid)
+    expected = BT(csp).count_solutions(prop_GAC3, ord_mrv)
+    solver = BT(csp)
+    outcome = solver.solve_cbj(prop_BT, ord_mrv, None, learn=True, keep_nogoods=True)
+    assert outcome.status == 'solved'
+    assert solver.nBackjumps > 0
+    #learned nogoods hold in every solution
+    assert solver.count_solutions(prop_GAC3, ord_mrv) == expected
+
+
+@pytest.mark.parametrize('prop', [prop_GAC, prop_GAC3, prop_STR2, prop_CT])
+@pytest.mark.parametrize('method', ['solve', 'solve_cbj'])
+def test_time_limit_cuts_propagation_short(prop, method):
+    #root propagation of the 8x8 table model takes about half a second
+    csp, board = kenken_csp_model(BOARDS[8])
+    solver = BT(csp)
+    stime = time.perf_counter()
+    outcome = getattr(solver, method)(prop, ord_mrv, time_limit=0.05)
+    assert time.perf_counter() - stime < 0.05 + 0.1
+    assert outcome.status == 'limit' and solver.nDecisions == 0
+    assert csp.trail.interrupt is None
+    assert all(v.cur_domain_size() == 8 and not v.is_assigned() for v in csp.get_all_vars())
+
+
+def test_cancel_stops_propagation():
+    csp, board = kenken_csp_model(BOARDS[8])
+    cancel = threading.Event()
+    cancel.set()
+    outcome = BT(csp).solve(prop_GAC3, ord_mrv, cancel=cancel)
+    assert outcome.status == 'cancelled' and outcome.nDecisions == 0
+    #without the cancel token the search is unaffected
+    kenken_grid, square = random_puzzle(5, 1)
+    csp, board = kenken_csp_model(kenken_grid)
+    assert BT(csp).solve(prop_GAC3, ord_mrv).status == 'solved'
+
+
+def test_time_limit_during_decision_keeps_nogoods_sound():
+    kenken_grid, square = random_puzzle(5, 1)
+    csp, board = kenken_csp_model(kenken_grid)
+    decisions = []
+    def slow_prop(csp, newVar=None):
+        if newVar is not None:
+            decisions.append((newVar, newVar.get_assigned_value()))
+            if len(decisions) == 3:
+                #the propagation of the third decision never ends by itself
+                while True:
+                    csp.trail.check_interrupt()
+        return prop_GAC3(csp, newVar)
+    solver = BT(csp)
+    nogoods = []
+    stime = time.perf_counter()
+    outcome = solver.solve(slow_prop, ord_mrv, time_limit=0.2, nogoods=nogoods)
+    assert time.perf_counter() - stime < 0.2 + 0.1
+    assert outcome.status == 'limit' and solver.nDecisions == 3
+    #the interrupted value was not refuted
+    assert all(nogood[-1] != decisions[2] for nogood in nogoods)
+    assert not any(v.is_assigned() for v in csp.get_all_vars())